@@ -0,0 +1,120 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire *ttl* seconds after their insertion.
+    A non-positive *ttl* disables the expiration. It is thread-safe.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class KnowledgeGraphClient:
+    """
+    Client of the knowledge-graph (linked data) server that returns the translations
+    of the entities found in a query. The connections are kept alive in a pooled
+    HTTP session, the answers are cached by (query, input language, output language),
+    and the queries of a lookup are sent concurrently.
+    """
+    def __init__(
+            self,
+            url: str,
+            cache_size: int = 4096,
+            cache_ttl: float = 3600.0,
+            max_workers: int = 8,
+            timeout: Optional[float] = None):
+        self.url = url
+        self.timeout = timeout
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def query(self, query: str, lang_in: str, lang_out: str) -> Dict[str, List[Dict]]:
+        """
+        Returns the translations of the entities found in the *query*,
+        i.e. a dictionary whose keys are the entities (as found in the query).
+        """
+        key = (query, lang_in, lang_out)
+        translations = self.cache.get(key)
+        if translations is None:
+            kg_server_response = self.session.post(
+                self.url,
+                data={'lang_in': lang_in, 'lang_out': lang_out, 'query': query},
+                timeout=self.timeout)
+            assert 199 < kg_server_response.status_code < 300, \
+                f"{self.url} responded {kg_server_response.status_code}: {kg_server_response.text}"
+            translations = json.loads(kg_server_response.text)["result"].get("translations", {})
+            self.cache.put(key, translations)
+        return translations
+
+    def lookup(self, queries: List[Tuple[str, str, str]]) -> List[Dict[str, List[Dict]]]:
+        """
+        Returns the result of :py:meth:`query` for each (query, lang_in, lang_out) of *queries*.
+        The queries that are not in the cache are sent concurrently.
+        """
+        unique_queries = list(OrderedDict.fromkeys(queries))
+        if len(unique_queries) <= 1:
+            results = {q: self.query(*q) for q in unique_queries}
+        else:
+            futures = {q: self.executor.submit(self.query, *q) for q in unique_queries}
+            results = {q: f.result() for q, f in futures.items()}
+        return [results[q] for q in queries]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
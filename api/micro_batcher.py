@@ -0,0 +1,150 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+import queue
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    Gathers the requests that arrive within a window of *max_wait_ms* milliseconds
+    from the first one and elaborates them with a single inference step of the
+    :py:class:`api.speech_processor.SpeechToTextProcessor`.
+    A batch is closed earlier if it already contains *max_batch_size* requests,
+    or if adding a request would make the padded batch exceed *max_batch_frames*
+    frames. In the latter case, the request is kept for the next batch.
+    An `end_session` command closes the batch as well, so that the session is ended
+    only after the requests that precede it have been processed.
+
+    Requests are put in the batcher as raw JSON lines (see :py:meth:`put`) and
+    the outputs are returned in the same order in which the requests arrived.
+    """
+    def __init__(self, processor, max_wait_ms: float, max_batch_frames: int, max_batch_size: int):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.processor = processor
+        self.max_wait_secs = max_wait_ms / 1000.0
+        self.max_batch_frames = max_batch_frames
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        # A preprocessed request that did not fit in the previous batch
+        self._pending = None
+
+    def put(self, request_id, input_json: str):
+        self.requests.put((request_id, input_json))
+
+    def _preproc(self, request_id, input_json):
+        """
+        Returns a tuple `(request_id, command, preprocessed request, output)`,
+        where only one among the last three elements is not None. The output is set
+        when the request has been already answered, e.g. when it cannot be preprocessed.
+        """
+        try:
+            input_request = json.loads(input_json)
+            if "command" in input_request:
+                if input_request["command"] in {"shutdown", "end_session"}:
+                    return request_id, input_request, None, None
+                else:
+                    raise Exception(f"Unrecognized command {input_request['command']}")
+            parsed_request, input_audio = self.processor.preproc_request(request_id, input_request)
+            return request_id, None, (request_id, parsed_request, input_audio), None
+        except BaseException as e:
+            self.logger.exception(f"Issue while preprocessing ID[{request_id}]")
+            return request_id, None, None, {"status": "error", "message": str(e)}
+
+    def _end_session(self, request_id, command):
+        try:
+            self.processor.end_session(command["session_id"])
+            return {"status": "ok"}
+        except BaseException as e:
+            self.logger.exception(f"Issue while ending the session of ID[{request_id}]")
+            return {"status": "error", "message": str(e)}
+
+    def _collect(self) -> Tuple[List[Tuple[Any, Any]], Optional[Dict]]:
+        """
+        Waits for the requests of the next batch and preprocesses them.
+        Returns the list of preprocessed requests or outputs (in arrival order)
+        and the command that closed the batch, if any.
+        """
+        if self._pending is not None:
+            request_id, command, preprocessed, output = self._pending
+            self._pending = None
+        else:
+            request_id, command, preprocessed, output = self._preproc(*self.requests.get())
+        if command is not None:
+            if command["command"] != "end_session":
+                return [], command
+            # no request of the batch precedes it, so the session can be ended immediately
+            output = self._end_session(request_id, command)
+        entries = [(request_id, preprocessed if preprocessed is not None else output)]
+        batch_size = 1 if preprocessed is not None else 0
+        batch_max_len = preprocessed[2].shape[0] if preprocessed is not None else 0
+        deadline = time.monotonic() + self.max_wait_secs
+        while batch_size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request_id, input_json = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            request_id, command, preprocessed, output = self._preproc(request_id, input_json)
+            if command is not None:
+                if command["command"] == "end_session":
+                    # the session is ended after the requests collected so far
+                    self._pending = (request_id, command, None, None)
+                    break
+                return entries, command
+            if preprocessed is not None:
+                new_max_len = max(batch_max_len, preprocessed[2].shape[0])
+                if batch_size > 0 and new_max_len * (batch_size + 1) > self.max_batch_frames:
+                    self._pending = (request_id, None, preprocessed, None)
+                    break
+                batch_max_len = new_max_len
+                batch_size += 1
+                entries.append((request_id, preprocessed))
+            else:
+                entries.append((request_id, output))
+        return entries, None
+
+    def next_outputs(self) -> Tuple[List[Tuple[Any, Dict]], Optional[Dict]]:
+        """
+        Waits for the next batch of requests and elaborates them.
+        Returns the list of `(request_id, output)` pairs, in the same order
+        in which the requests arrived, and the command received, if any.
+        """
+        entries, command = self._collect()
+        to_process = [e for _, e in entries if isinstance(e, tuple)]
+        results = {}
+        if len(to_process) > 0:
+            start_time = time.time()
+            try:
+                for (request_id, _, _), result in zip(to_process, self.processor.process_batch(to_process)):
+                    result["status"] = "ok"
+                    results[request_id] = result
+            except BaseException as e:
+                self.logger.exception(
+                    f"Issue while processing ID[{', '.join(str(r) for r, _, _ in to_process)}]")
+                for request_id, _, _ in to_process:
+                    results[request_id] = {"status": "error", "message": str(e)}
+            end_time = time.time()
+            self.logger.info(f"Batch of {len(to_process)} requests processed in {end_time - start_time} s.")
+        outputs = []
+        for request_id, entry in entries:
+            if request_id in results:
+                outputs.append((request_id, results[request_id]))
+            else:
+                outputs.append((request_id, entry))
+        return outputs, command
@@ -18,6 +18,7 @@ Simple server waiting on stdin for ST data for which a double output is produced
 import json
 import logging
 import sys
+import threading
 import uuid
 from argparse import Namespace
 
@@ -64,6 +65,9 @@ def start_server(cfg: DictConfig):
         sys.exit(-1)
 
     sys.stdout.write("server started successfully\n")
+    if cfg.task.server_max_wait_ms > 0:
+        serve_with_micro_batching(processor, cfg, logger)
+        return
     while True:
         logger.info("Waiting for input...")
         input_json = sys.stdin.readline()
@@ -75,10 +79,13 @@ def start_server(cfg: DictConfig):
                 if input_request["command"] == "shutdown":
                     logger.info("Shutting down...")
                     break
+                elif input_request["command"] == "end_session":
+                    processor.end_session(input_request["session_id"])
+                    output = {}
                 else:
                     raise Exception(f"Unrecognized command {input_request['command']}")
-
-            output = processor.process(request_id, input_request)
+            else:
+                output = processor.process(request_id, input_request)
             output["status"] = "ok"
             output_json = json.dumps(output)
         except BaseException as e:
@@ -88,9 +95,60 @@ def start_server(cfg: DictConfig):
         sys.stdout.write(output_json + "\n")
 
 
+def read_requests(batcher, logger):
+    while True:
+        input_json = sys.stdin.readline()
+        request_id = uuid.uuid4()
+        logger.info(f"Received Request ID[{request_id}]")
+        if input_json == "":
+            # The stdin has been closed, so no other request can arrive
+            batcher.put(request_id, json.dumps({"command": "shutdown"}))
+            break
+        batcher.put(request_id, input_json)
+
+
+def serve_with_micro_batching(processor, cfg: DictConfig, logger):
+    """
+    Serves the requests gathering those arriving within --server-max-wait-ms
+    milliseconds in a single batch (see :py:class:`api.micro_batcher.MicroBatcher`).
+    The answers are written in the same order as the requests.
+    """
+    from api.micro_batcher import MicroBatcher
+    batcher = MicroBatcher(
+        processor,
+        cfg.task.server_max_wait_ms,
+        cfg.task.server_max_batch_frames,
+        cfg.task.server_max_batch_size)
+    reader = threading.Thread(target=read_requests, args=(batcher, logger), daemon=True)
+    reader.start()
+    while True:
+        logger.info("Waiting for input...")
+        outputs, command = batcher.next_outputs()
+        for request_id, output in outputs:
+            logger.info(f"Answering Request ID[{request_id}]")
+            sys.stdout.write(json.dumps(output) + "\n")
+        sys.stdout.flush()
+        if command is not None:
+            logger.info("Shutting down...")
+            break
+
+
 def cli_main():
     parser = options.get_generation_parser()
     parser.add_argument("--server-processor", type=str, choices=["st", "st_triangle", "st_triangle_ne"])
+    parser.add_argument(
+        "--server-reuse-encoder-states", action="store_true", default=False,
+        help="reuse the encoder frontend outputs across the overlapping windows of a streaming session "
+             "(supported by Conformer and Speechformer encoders)")
+    parser.add_argument(
+        "--server-max-wait-ms", type=float, default=0.0,
+        help="if > 0, the requests arriving within this amount of milliseconds are processed in a single batch")
+    parser.add_argument(
+        "--server-max-batch-frames", type=int, default=30000,
+        help="maximum number of (padded) frames in a batch of requests")
+    parser.add_argument(
+        "--server-max-batch-size", type=int, default=16,
+        help="maximum number of requests in a batch")
     args = options.parse_args_and_arch(parser)
     main(args)
 
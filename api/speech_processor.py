@@ -12,17 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License
 import ast
+import base64
 import logging
 import time
+from collections import OrderedDict
 
 import dataclasses
+import numpy as np
 import torch
 
 from api.ne_postprocessing import move_tags_after_space, move_tags_to_start_or_end
-from examples.speech_to_text.data_utils_new import extract_fbank_features
+from examples.speech_to_text.data_utils_new import extract_fbank_features, IncrementalFbankExtractor
+from examples.speech_to_text.modules.encoder_streaming_support import EncoderStreamingState, EncoderStreamingSupport
 from examples.speech_to_text.utils.tags import join_tags_tokens
 from fairseq import checkpoint_utils, tasks, utils
 from fairseq.data.audio.audio_utils import get_waveform
+from fairseq.data.audio.speech_to_text_dataset import _collate_frames
 from fairseq.data.audio.feature_transforms import CompositeAudioFeatureTransform
 
 
@@ -33,6 +38,8 @@ class SpeechToTextProcessor:
 
     # The dataclass representing the request
     request_class: type
+    # Maximum number of streaming sessions whose state is kept in memory
+    max_sessions: int = 64
 
     def __init__(self, cfg):
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -59,6 +66,13 @@ class SpeechToTextProcessor:
         self.tokenizer = self.task.build_tokenizer(cfg.tokenizer)
         self.bpe = self.task.build_bpe(cfg.bpe)
         self.post_process = cfg.common_eval.post_process
+        # State of the streaming sessions, from the least to the most recently used
+        self.sessions = OrderedDict()
+        self.reuse_encoder_states = getattr(cfg.task, "server_reuse_encoder_states", False)
+        if self.reuse_encoder_states and not all(
+                isinstance(getattr(model, "encoder", None), EncoderStreamingSupport) for model in self.models):
+            self.logger.warning("The encoder does not support the reuse of its states, so it is disabled.")
+            self.reuse_encoder_states = False
 
     def decode_fn(self, x):
         if self.bpe is not None:
@@ -92,47 +106,178 @@ class SpeechToTextProcessor:
             model.prepare_for_inference_(cfg)
         return models
 
-    def preproc_audio(self, audio_fn):
+    def get_session(self, session_id):
+        """
+        Returns the state of the streaming session with the given ID,
+        creating it if needed. The least recently used session is discarded
+        when more than *max_sessions* sessions are open.
+        """
+        if session_id not in self.sessions:
+            self.sessions[session_id] = {}
+            if len(self.sessions) > self.max_sessions:
+                discarded_id, _ = self.sessions.popitem(last=False)
+                self.logger.warning(f"Discarding the state of the streaming session {discarded_id}")
+        self.sessions.move_to_end(session_id)
+        return self.sessions[session_id]
+
+    def end_session(self, session_id):
+        """
+        Discards the state of the streaming session with the given ID.
+        """
+        session = self.sessions.pop(session_id, None)
+        if session is not None and "fbank_extractor" in session:
+            extractor = session["fbank_extractor"]
+            self.logger.info(
+                f"Streaming session {session_id} ended: {extractor.cached_frames} filterbank frames "
+                f"reused and {extractor.computed_frames} computed.")
+        if session is not None and "encoder_state" in session:
+            encoder_state = session["encoder_state"]
+            self.logger.info(
+                f"Streaming session {session_id} ended: {encoder_state.reused_frames} encoder frontend "
+                f"frames reused and {encoder_state.computed_frames} computed.")
+
+    def get_encoder_streaming_state(self, requests):
+        """
+        Returns the :py:class:`EncoderStreamingState` to be used by the encoder if the reuse of
+        the encoder states is enabled and the batch contains a single window of a streaming session.
+        Otherwise, returns None.
+        """
+        if not self.reuse_encoder_states or len(requests) != 1:
+            return None
+        _, request, _ = requests[0]
+        if request.session_id is None or request.session_id not in self.sessions:
+            return None
+        session = self.get_session(request.session_id)
+        if session.get("frame_offset", None) is None:
+            return None
+        if "encoder_state" not in session:
+            session["encoder_state"] = EncoderStreamingState()
+        session["encoder_state"].frame_offset = session["frame_offset"]
+        return session["encoder_state"]
+
+    def preproc_audio(self, audio_fn, session_id=None, stream_offset=None):
         start_time = time.time()
         waveform, sample_rate = get_waveform(audio_fn)
-        source = extract_fbank_features(torch.from_numpy(waveform), sample_rate)
-        if self.feature_transforms is not None:
-            source = self.feature_transforms(source)
-        source = torch.from_numpy(source).float()
+        source = self.preproc_waveform(waveform, sample_rate, session_id, stream_offset)
         end_time = time.time()
         self.logger.info(f"Preprocessing of {audio_fn} took {end_time - start_time} s.")
         return source
 
-    def process(self, request_id, request):
+    def preproc_pcm(self, request):
         """
-        Elaborates the provided request.
+        Extracts the features from the raw 16-bit PCM audio of the request,
+        which can be either base64-encoded in the `pcm` field or stored in the
+        region of a (memory-mapped) file identified by `pcm_path`, `pcm_offset`,
+        and `pcm_size` (in bytes), e.g. a file in /dev/shm.
+        """
+        start_time = time.time()
+        if request.pcm is not None:
+            samples = np.frombuffer(base64.b64decode(request.pcm), dtype='<i2')
+            audio_desc = "base64 PCM"
+        else:
+            samples = np.memmap(
+                request.pcm_path,
+                dtype='<i2',
+                mode='r',
+                offset=request.pcm_offset,
+                shape=(request.pcm_size // 2, ) if request.pcm_size is not None else None)
+            audio_desc = request.pcm_path
+        # Same normalization applied when reading 16-bit WAV files
+        waveform = samples.astype(np.float32) / 2 ** 15
+        source = self.preproc_waveform(waveform, request.sample_rate, request.session_id, request.stream_offset)
+        end_time = time.time()
+        self.logger.info(f"Preprocessing of {audio_desc} took {end_time - start_time} s.")
+        return source
+
+    def preproc_waveform(self, waveform, sample_rate, session_id=None, stream_offset=None):
+        """
+        Extracts the features of the waveform. If the waveform is a window of the
+        audio of a streaming session, i.e. *session_id* and *stream_offset* (the index
+        of its first sample in the stream) are set, the features already computed
+        for the previous windows of the session are reused.
+        """
+        if session_id is not None and stream_offset is not None and stream_offset >= 0:
+            session = self.get_session(session_id)
+            if "fbank_extractor" not in session or session["fbank_extractor"].sample_rate != sample_rate:
+                session["fbank_extractor"] = IncrementalFbankExtractor(sample_rate)
+            source = session["fbank_extractor"].extract(torch.from_numpy(waveform), stream_offset)
+            # the index of the first feature frame of the window in the stream, if any
+            frame_shift = session["fbank_extractor"].frame_shift
+            session["frame_offset"] = stream_offset // frame_shift if stream_offset % frame_shift == 0 else None
+        else:
+            source = extract_fbank_features(torch.from_numpy(waveform), sample_rate)
+        if self.feature_transforms is not None:
+            source = self.feature_transforms(source)
+        return torch.from_numpy(source).float()
+
+    def preproc_request(self, request_id, request):
+        """
+        Parses the provided request and extracts the features of its audio.
+        Returns the parsed request and the features.
         """
         self.logger.debug(f"Received request: ID[{request_id}] - {request}")
         parsed_request = self.request_class(**request)
+        if parsed_request.pcm is not None or parsed_request.pcm_path is not None:
+            return parsed_request, self.preproc_pcm(parsed_request)
+        if parsed_request.wav_path is None:
+            raise ValueError("The request does not contain any audio: set either wav_path, pcm, or pcm_path")
+        return parsed_request, self.preproc_audio(
+            parsed_request.wav_path, parsed_request.session_id, parsed_request.stream_offset)
+
+    def process(self, request_id, request):
+        """
+        Elaborates the provided request.
+        """
         start_time = time.time()
-        input_audio = self.preproc_audio(parsed_request.wav_path)
+        parsed_request, input_audio = self.preproc_request(request_id, request)
+        result = self.process_batch([(request_id, parsed_request, input_audio)])[0]
+        end_time = time.time()
+        self.logger.info(f"Request ID[{request_id}] processed in {end_time - start_time} s.")
+        return result
+
+    def process_batch(self, requests):
+        """
+        Elaborates a list of already preprocessed requests, i.e. a list of
+        `(request_id, parsed_request, input_audio)` triples, with a single inference step.
+        The results are returned in the same order of the requests.
+        """
+        request_ids = ", ".join(str(request_id) for request_id, _, _ in requests)
+        n_frames = torch.tensor([input_audio.shape[0] for _, _, input_audio in requests], dtype=torch.long)
+        # sort requests by descending number of frames, as done by the datasets
+        n_frames, order = n_frames.sort(descending=True)
         sample = {
+            'id': order,
             'net_input': {
-                'src_tokens': input_audio.unsqueeze(0),
-                'src_lengths': torch.Tensor([input_audio.shape[0]])
+                'src_tokens': _collate_frames([input_audio for _, _, input_audio in requests]).index_select(0, order),
+                'src_lengths': n_frames,
             }
         }
         if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug(f"Request ID[{request_id}] net input: {sample}")
+            self.logger.debug(f"Request ID[{request_ids}] net input: {sample}")
+        encoder_state = self.get_encoder_streaming_state(requests)
+        if encoder_state is not None:
+            sample['net_input']['streaming_state'] = encoder_state
+            reused_frames, computed_frames = encoder_state.reused_frames, encoder_state.computed_frames
         inference_start_time = time.time()
         sample = utils.move_to_cuda(sample) if self.use_cuda else sample
         hypos = self.task.inference_step(self.generator, self.models, sample)
         inference_end_time = time.time()
-        assert len(hypos) == 1, "generation of multiple sentences not supported"
-        hypo = hypos[0][0]  # We consider only the most likely hypothesis
+        assert len(hypos) == len(requests), \
+            f"generated {len(hypos)} outputs for a batch of {len(requests)} requests"
         self.logger.info(
-            f"Inference for Request ID[{request_id}] took: {inference_end_time - inference_start_time} s.")
+            f"Inference for Request ID[{request_ids}] took: {inference_end_time - inference_start_time} s.")
+        if encoder_state is not None:
+            self.logger.info(
+                f"Request ID[{request_ids}] reused {encoder_state.reused_frames - reused_frames} encoder "
+                f"frontend frames and computed {encoder_state.computed_frames - computed_frames}.")
 
-        result = self._postproc(request_id, hypo, parsed_request)
-        result = dataclasses.asdict(result)
-        end_time = time.time()
-        self.logger.info(f"Request ID[{request_id}] processed in {end_time - start_time} s.")
-        return result
+        results = [None] * len(requests)
+        for hypo_idx, request_idx in enumerate(order.tolist()):
+            request_id, parsed_request, _ = requests[request_idx]
+            hypo = hypos[hypo_idx][0]  # We consider only the most likely hypothesis
+            result = self._postproc(request_id, hypo, parsed_request)
+            results[request_idx] = dataclasses.asdict(result)
+        return results
 
     def _postproc(self, request_id, hypo, request):
         """
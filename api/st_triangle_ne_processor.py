@@ -11,10 +11,8 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
-import json
 import os
 import re
-import requests
 import string
 from typing import List, Optional, Tuple
 
@@ -22,12 +20,16 @@ from dataclasses import dataclass
 from thefuzz import fuzz, process
 import text_to_num
 
+from api.knowledge_graph import KnowledgeGraphClient
+from api.term_matcher import TermMatcher
 from api.st_triangle_processor import STTriangleProcessorResponse, STTriangleProcessor, STTriangleProcessorRequest
 from api.misc import stopwords
 
 
 REMOVE_NE_PATTERN = re.compile(r'</?[A-Z_]+>')
 NE_PATTERN = re.compile(r"<(.+)>([^<]+)</\1>")
+WORD_PATTERN = re.compile(r'\w*')
+WORD_CHAR_PATTERN = re.compile(r'\w')
 LINKEDDATA_URL = f'http://{os.getenv("LINKEDDATA_IP", "3.121.98.219")}/api/'
 
 
@@ -75,20 +77,29 @@ def clean_stopwords(text, lang):
     return text
 
 
-def extract_ne(text, srclang, tgtlang):
-    kg_server_response = requests.post(
-        LINKEDDATA_URL,
-        data={
-            'lang_in': translate_langcode(srclang),
-            'lang_out': translate_langcode(tgtlang),
-            'query': REMOVE_NE_PATTERN.sub('', text).replace("-", " ").replace("'", " ").strip()})
-    assert 199 < kg_server_response.status_code < 300, \
-        f"{LINKEDDATA_URL} responded {kg_server_response.status_code}: {kg_server_response.text}"
-    wikidata = json.loads(kg_server_response.text)["result"]
-    if "translations" in wikidata:
-        wikidata = wikidata["translations"]
-    else:
-        wikidata = {}
+def kg_query(text):
+    return REMOVE_NE_PATTERN.sub('', text).replace("-", " ").replace("'", " ").strip()
+
+
+def kg_queries(text, per_entity=False):
+    """
+    Returns the queries to the knowledge graph needed to translate the NEs of the *text*:
+    either one for the whole text or, if *per_entity* is set, one for each NE, which can be
+    reused by all the sentences containing the NE. No query is needed if the text contains no NE.
+    """
+    nes = ne_from_output(text)
+    if len(nes) == 0:
+        return []
+    if per_entity:
+        return list(dict.fromkeys(q for q in (kg_query(ne[0]) for ne in nes) if q))
+    return [kg_query(text)]
+
+
+def extract_ne(text, srclang, tgtlang, wikidata):
+    """
+    Returns the NEs of the *text* with their IDs and translations,
+    according to the answers of the knowledge graph (*wikidata*).
+    """
     result = []
     for ne in ne_from_output(text):
         ids = set()
@@ -150,9 +161,29 @@ def do_fuzzy_match(substring, full_string):
         return None
 
 
-def extract_nes(transcript, translation, slang, tlang, logger):
-    ne_transcript = extract_ne(transcript, slang, tlang)
-    ne_translation = extract_ne(translation, tlang, slang)
+def lookup_kg(kg_client, texts_and_langs, per_entity=False):
+    """
+    Queries the knowledge graph for the (text, lang_in, lang_out) triples of *texts_and_langs*,
+    sending all the queries concurrently, and returns the answers merged for each text.
+    """
+    queries = [
+        [(q, translate_langcode(lang_in), translate_langcode(lang_out)) for q in kg_queries(text, per_entity)]
+        for text, lang_in, lang_out in texts_and_langs]
+    answers = iter(kg_client.lookup(flatten(queries)))
+    results = []
+    for text_queries in queries:
+        wikidata = {}
+        for _ in text_queries:
+            wikidata.update(next(answers))
+        results.append(wikidata)
+    return results
+
+
+def extract_nes(transcript, translation, slang, tlang, logger, kg_client, per_entity=False):
+    transcript_wikidata, translation_wikidata = lookup_kg(
+        kg_client, [(transcript, slang, tlang), (translation, tlang, slang)], per_entity=per_entity)
+    ne_transcript = extract_ne(transcript, slang, tlang, transcript_wikidata)
+    ne_translation = extract_ne(translation, tlang, slang, translation_wikidata)
     to_be_aligned = []
     paired = []
     for (e, etype, eids, etrans) in ne_translation:
@@ -215,20 +246,32 @@ def extract_nes(transcript, translation, slang, tlang, logger):
     return paired
 
 
+def expand_to_words(text, start, end):
+    """
+    Returns the span [*start*, *end*) of the *text* extended to include
+    the whole words at its boundaries.
+    """
+    end = WORD_PATTERN.match(text, end).end()
+    # the span may exceed the text, as it is found in the lowercased text
+    prefix_end = min(start, len(text))
+    word_start = prefix_end
+    while word_start > 0 and WORD_CHAR_PATTERN.match(text, word_start - 1) is not None:
+        word_start -= 1
+    return text[start - (prefix_end - word_start):end]
+
+
 def extract_terms_from_source(transcript, translation, terms_dict, logger) -> List[Tuple[str, str]]:
     transcript = REMOVE_NE_PATTERN.sub('', transcript)
     transcript_lc = transcript.lower()
+    if not isinstance(terms_dict, TermMatcher):
+        terms_dict = TermMatcher(terms_dict)
     found = []
-    for entry in terms_dict:
+    for entry, idx in terms_dict.find(transcript_lc):
         s, ts = entry
-        if s in transcript_lc:
-            idx = transcript_lc.index(s)
-            end_of_term = len(re.split(r'\W+', transcript[idx + len(s):])[0])
-            start_of_term = len(re.split(r'\W+', transcript[:idx][::-1])[0])
-            term = transcript[idx - start_of_term:idx + len(s) + end_of_term]
-            if fuzz.WRatio(term, s) < 0.8:
-                continue
-            found.append((s, ts[0]))
+        term = expand_to_words(transcript, idx, idx + len(s))
+        if fuzz.WRatio(term, s) < 0.8:
+            continue
+        found.append((s, ts[0]))
     return found
 
 
@@ -237,24 +280,22 @@ def extract_terms(transcript, translation, terms_dict, logger) -> List[Tuple[str
     translation = REMOVE_NE_PATTERN.sub('', translation)
     transcript_lc = transcript.lower()
     translation_lc = translation.lower()
+    if not isinstance(terms_dict, TermMatcher):
+        terms_dict = TermMatcher(terms_dict)
     found = []
-    for entry in terms_dict:
+    for entry, idx in terms_dict.find(transcript_lc):
         s, ts = entry
-        if s in transcript_lc:
-            idx = transcript_lc.index(s)
-            end_of_term = len(re.split(r'\W+', transcript[idx + len(s):])[0])
-            start_of_term = len(re.split(r'\W+', transcript[:idx][::-1])[0])
-            term = transcript[idx - start_of_term:idx + len(s) + end_of_term]
-            if fuzz.WRatio(term, s) < 0.8:
-                continue
-            tgt_found = False
-            for t in ts:
-                if t in translation_lc:
-                    found.append((s, t))
-                    tgt_found = True
-                    break
-            if not tgt_found:
-                logger.debug(f"Cannot pair {term} ({s}) - {ts} in {transcript} -- {translation}")
+        term = expand_to_words(transcript, idx, idx + len(s))
+        if fuzz.WRatio(term, s) < 0.8:
+            continue
+        tgt_found = False
+        for t in ts:
+            if t in translation_lc:
+                found.append((s, t))
+                tgt_found = True
+                break
+        if not tgt_found:
+            logger.debug(f"Cannot pair {term} ({s}) - {ts} in {transcript} -- {translation}")
     return found
 
 
@@ -284,6 +325,11 @@ class STTriangleNEProcessor(STTriangleProcessor):
                 if m not in {"thousand", "thousands", "mil", "mille", "milles", "miles"}:
                     parser.NUMBERS.pop(m)
         text_to_num.lang.LANG["es"].DECIMAL_SEP = "punto"
+        self.kg_query_per_entity = int(os.getenv('KG_QUERY_PER_ENTITY', 0)) == 1
+        self.kg_client = KnowledgeGraphClient(
+            LINKEDDATA_URL,
+            cache_size=int(os.getenv('KG_CACHE_SIZE', 4096)),
+            cache_ttl=float(os.getenv('KG_CACHE_TTL', 3600)))
 
     @staticmethod
     def ne_digit_converter(nes, slang, tlang):
@@ -309,7 +355,8 @@ class STTriangleNEProcessor(STTriangleProcessor):
                 for line in f:
                     t = line.strip().split("\t")
                     new_dict.append((t[0].lower(), list(map(lambda x: x.lower(), t[1].split(",")))))
-            self.LOADED_DICTS[dict_fn] = new_dict
+            # the dictionary is compiled once, so that each request is matched in a single pass
+            self.LOADED_DICTS[dict_fn] = TermMatcher(new_dict)
         return self.LOADED_DICTS[dict_fn]
 
     def _postproc(self, request_id, hypo, request: STTriangleNEProcessorRequest):
@@ -319,7 +366,9 @@ class STTriangleNEProcessor(STTriangleProcessor):
             st_triangle_response.translation,
             request.src_lang,
             request.tgt_lang,
-            self.logger)
+            self.logger,
+            self.kg_client,
+            per_entity=self.kg_query_per_entity)
         if request.dictionary is not None:
             terms_dict = self.load_dict(request.dictionary)
             fn_extract_terms = extract_terms_from_source if self.extract_terms_from_transcript_only else extract_terms
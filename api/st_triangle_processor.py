@@ -14,6 +14,7 @@
 import math
 
 from dataclasses import dataclass
+from typing import Optional
 
 from api.speech_processor import SpeechToTextProcessor
 from fairseq import utils
@@ -25,10 +26,22 @@ class STTriangleProcessorRequest:
     """
     A data class that represents a request to be processed by the
     :py:class:`STTriangleProcessor`.
+    The audio can be provided either as a WAV file (`wav_path`), or as
+    raw 16-bit PCM, base64-encoded (`pcm`) or stored in a (memory-mapped)
+    file (`pcm_path`, `pcm_offset`, `pcm_size`).
+    When the audio is a window of a stream, `session_id` identifies the stream
+    and `stream_offset` is the index of the first sample of the window in the stream.
     """
-    wav_path: str
     src_lang: str
     tgt_lang: str
+    wav_path: Optional[str] = None
+    pcm: Optional[str] = None
+    pcm_path: Optional[str] = None
+    pcm_offset: int = 0
+    pcm_size: Optional[int] = None
+    sample_rate: int = 16000
+    session_id: Optional[str] = None
+    stream_offset: Optional[int] = None
 
 
 @dataclass
@@ -0,0 +1,107 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+
+class TermMatcher:
+    """
+    Bilingual dictionary of terms, i.e. a list of (source term, list of target terms),
+    compiled into an Aho-Corasick automaton over the source terms, so that all
+    the terms contained in a text are found with a single pass over it, regardless
+    of the size of the dictionary.
+
+    >>> matcher = TermMatcher([("heart attack", ["infarto"]), ("heart", ["cuore"]), ("game", ["gioco"])])
+    >>> matcher.find("a heart attack during the game")
+    [(('heart attack', ['infarto']), 2), (('heart', ['cuore']), 2), (('game', ['gioco']), 26)]
+    >>> matcher.find("no terms here")
+    []
+    """
+    def __init__(self, entries: List[Tuple[str, List[str]]]):
+        self.entries = entries
+        # the IDs of the entries of each (distinct) source term
+        self.entries_by_term: Dict[str, List[int]] = {}
+        for i, (term, _) in enumerate(entries):
+            self.entries_by_term.setdefault(term, []).append(i)
+        self.terms = list(self.entries_by_term.keys())
+        self._build()
+
+    def _build(self):
+        # goto function, failure links and (own) outputs of each state
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[int]] = [[]]
+        for term_id, term in enumerate(self.terms):
+            state = 0
+            for c in term:
+                next_state = self.goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][c] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(term_id)
+        # the nearest state in the chain of failure links that has outputs
+        self.dict_suffix: List[int] = [-1] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail > 0 and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(c, 0)
+                queue.append(next_state)
+            fail = self.fail[state]
+            self.dict_suffix[state] = fail if len(self.outputs[fail]) > 0 else self.dict_suffix[fail]
+
+    def first_occurrences(self, text: str) -> Dict[int, int]:
+        """
+        Returns the index of the first occurrence in the *text* of each term that it contains.
+        """
+        found = {}
+        # the empty term is contained in any text
+        for term_id in self.outputs[0]:
+            found[term_id] = 0
+        state = 0
+        for i, c in enumerate(text):
+            while state > 0 and c not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(c, 0)
+            match_state = state if len(self.outputs[state]) > 0 else self.dict_suffix[state]
+            while match_state > 0:
+                for term_id in self.outputs[match_state]:
+                    if term_id not in found:
+                        found[term_id] = i + 1 - len(self.terms[term_id])
+                match_state = self.dict_suffix[match_state]
+        return found
+
+    def find(self, text: str) -> List[Tuple[Tuple[str, List[str]], int]]:
+        """
+        Returns the entries whose source term is contained in the *text*, in the order
+        of the dictionary, together with the index of the first occurrence of the term.
+        """
+        matches = []
+        for term_id, idx in self.first_occurrences(text).items():
+            for entry_id in self.entries_by_term[self.terms[term_id]]:
+                matches.append((entry_id, idx))
+        return [(self.entries[entry_id], idx) for entry_id, idx in sorted(matches)]
+
+    def __iter__(self) -> Iterator[Tuple[str, List[str]]]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,279 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import logging
+import os
+import shutil
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from fairseq.data.audio.packed_features import code, data_file_path, dtypes, index_file_path
+
+
+logger = logging.getLogger(__name__)
+
+_HDR_MAGIC = b"PKTOPKIDX"
+_VERSION = 1
+# length of the samples whose outputs are missing (e.g. those of another shard)
+_MISSING = -1
+
+
+def teacher_outputs_prefix(root: str, split: str) -> str:
+    """Prefix of the packed teacher outputs of *split*, stored next to
+    the ``prob_idx_<split>.tsv`` they replace."""
+    return os.path.join(root, f"prob_idx_{split}")
+
+
+def exists(prefix_path: str) -> bool:
+    return os.path.isfile(index_file_path(prefix_path)) and os.path.isfile(data_file_path(prefix_path))
+
+
+def shard_prefix(prefix_path: str, shard_id: int, num_shards: int) -> str:
+    return f"{prefix_path}.{shard_id}-of-{num_shards}"
+
+
+def index_dtype(vocab_size: int) -> np.dtype:
+    """The smallest type able to store the indices of a vocabulary of *vocab_size* tokens."""
+    return np.dtype(np.int16) if vocab_size <= np.iinfo(np.int16).max + 1 else np.dtype(np.int32)
+
+
+def _record_nbytes(length: int, topk: int, idx_dtype: np.dtype, score_dtype: np.dtype) -> int:
+    nbytes = length * topk * (idx_dtype.itemsize + score_dtype.itemsize)
+    # the records are kept aligned to the itemsize of the stored types
+    return nbytes + (-nbytes % max(idx_dtype.itemsize, score_dtype.itemsize))
+
+
+def _read_index(path: str) -> Tuple[np.dtype, np.dtype, int, np.ndarray, np.ndarray]:
+    with open(path, "rb") as stream:
+        magic_test = stream.read(len(_HDR_MAGIC))
+        assert _HDR_MAGIC == magic_test, f"{path} is not an index of packed teacher outputs"
+        version = struct.unpack("<Q", stream.read(8))
+        assert (_VERSION,) == version
+        idx_code, score_code = struct.unpack("<BB", stream.read(2))
+        topk, length = struct.unpack("<QQ", stream.read(16))
+        offsets = np.frombuffer(stream.read(8 * length), dtype=np.int64)
+        lengths = np.frombuffer(stream.read(8 * length), dtype=np.int64)
+    return np.dtype(dtypes[idx_code]), np.dtype(dtypes[score_code]), topk, offsets, lengths
+
+
+def _write_index(
+        path: str, idx_dtype: np.dtype, score_dtype: np.dtype, topk: int, offsets: np.ndarray, lengths: np.ndarray):
+    # written with a temporary name, so that an interruption does not corrupt the previous index
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as index:
+        index.write(_HDR_MAGIC)
+        index.write(struct.pack("<Q", _VERSION))
+        index.write(struct.pack("<BB", code(idx_dtype), code(score_dtype)))
+        index.write(struct.pack("<QQ", topk, len(offsets)))
+        index.write(np.asarray(offsets, dtype=np.int64).tobytes(order="C"))
+        index.write(np.asarray(lengths, dtype=np.int64).tobytes(order="C"))
+    os.replace(tmp_path, path)
+
+
+class PackedTeacherOutputs(object):
+    """The top-k outputs of a teacher (the indices of the k best tokens and
+    their scores for each target position of each sample) packed in a
+    single data file. The indices (int16 or int32) and the scores (float16)
+    of a sample are stored one after the other, so that they are read with
+    a single access to the memory-mapped data file. The index contains the
+    byte offset and the number of target positions of each sample, or -1
+    if the outputs of the sample are missing (see :func:`merge_shards`).
+
+    As in :class:`fairseq.data.audio.packed_features.PackedFeatures`, each
+    process maps the data file the first time it reads from it.
+    """
+
+    def __init__(self, prefix_path: str):
+        self.prefix_path = prefix_path
+        self.idx_dtype, self.score_dtype, self.topk, self.offsets, self.lengths = _read_index(
+            index_file_path(prefix_path))
+        self._len = len(self.offsets)
+        self._data = None
+        self._pid = None
+
+    def __len__(self):
+        return self._len
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"], state["_pid"] = None, None
+        return state
+
+    def _get_data(self) -> np.ndarray:
+        if self._pid != os.getpid():
+            self._data = None
+            self._pid = os.getpid()
+        if self._data is None:
+            if os.path.getsize(data_file_path(self.prefix_path)) == 0:
+                self._data = np.empty(0, dtype=np.uint8)
+            else:
+                self._data = np.memmap(data_file_path(self.prefix_path), dtype=np.uint8, mode="r")
+        return self._data
+
+    def get(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the indices and the scores of the *index*-th sample,
+        both of shape (target length, k)."""
+        if self.lengths[index] == _MISSING:
+            raise KeyError(f"the teacher outputs of the sample {index} are missing in {self.prefix_path}")
+        n_items = int(self.lengths[index]) * self.topk
+        idx_bytes = n_items * self.idx_dtype.itemsize
+        offset = int(self.offsets[index])
+        record = self._get_data()[offset: offset + idx_bytes + n_items * self.score_dtype.itemsize]
+        idxs = np.frombuffer(record, dtype=self.idx_dtype, count=n_items)
+        scores = np.frombuffer(record, dtype=self.score_dtype, count=n_items, offset=idx_bytes)
+        shape = (int(self.lengths[index]), self.topk)
+        return idxs.reshape(shape), scores.reshape(shape)
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.get(index)
+
+
+class PackedTeacherOutputsBuilder(object):
+    """Writes the teacher outputs to be read with :class:`PackedTeacherOutputs`.
+    The indices are stored with *idx_dtype* (see :func:`index_dtype`) and the
+    scores with *score_dtype*.
+
+    The outputs can be added in any order, as each of them is appended to the
+    data file and its position is recorded at the given sample index. If
+    *num_samples* is set, the samples never added are left missing.
+    :meth:`checkpoint` writes the index of the outputs added so far, so that
+    the builder created with *resume* continues from the last checkpoint
+    (the outputs added after it are discarded).
+    """
+
+    def __init__(
+            self,
+            prefix_path: str,
+            topk: int,
+            idx_dtype=np.int32,
+            score_dtype=np.float16,
+            num_samples: int = 0,
+            resume: bool = False):
+        self.prefix_path = prefix_path
+        self.topk = topk
+        self.idx_dtype = np.dtype(idx_dtype)
+        self.score_dtype = np.dtype(score_dtype)
+        code(self.idx_dtype)
+        code(self.score_dtype)
+        self._offsets: List[int] = [0] * num_samples
+        self._lengths: List[int] = [_MISSING] * num_samples
+        self._next_offset = 0
+        if resume and exists(prefix_path):
+            self._load_checkpoint()
+            self._data_file = open(data_file_path(prefix_path), "r+b")
+            self._data_file.truncate(self._next_offset)
+            self._data_file.seek(self._next_offset)
+        else:
+            self._data_file = open(data_file_path(prefix_path), "wb")
+
+    def _load_checkpoint(self):
+        idx_dtype, score_dtype, topk, offsets, lengths = _read_index(index_file_path(self.prefix_path))
+        assert (idx_dtype, score_dtype, topk) == (self.idx_dtype, self.score_dtype, self.topk), \
+            f"the teacher outputs in {self.prefix_path} have been written with different settings"
+        assert len(offsets) == len(self._offsets), \
+            f"the teacher outputs in {self.prefix_path} have been written for {len(offsets)} samples"
+        self._offsets, self._lengths = offsets.tolist(), lengths.tolist()
+        self._next_offset = max(
+            (o + _record_nbytes(n, self.topk, self.idx_dtype, self.score_dtype)
+             for o, n in zip(self._offsets, self._lengths) if n != _MISSING),
+            default=0)
+        logger.info(f"Resuming {self.prefix_path} with the outputs of {self.num_written} samples")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def num_written(self) -> int:
+        return sum(n != _MISSING for n in self._lengths)
+
+    def has(self, index: int) -> bool:
+        """Whether the outputs of the *index*-th sample have already been added."""
+        return index < len(self._lengths) and self._lengths[index] != _MISSING
+
+    def add_item(self, idxs: np.ndarray, scores: np.ndarray, index: Optional[int] = None) -> int:
+        """Appends the (target length x k) *idxs* and *scores* of the *index*-th
+        sample (by default, the one following the last sample) and returns its index."""
+        assert idxs.shape == scores.shape and idxs.ndim == 2 and idxs.shape[1] == self.topk, \
+            f"expected indices and scores of shape (length, {self.topk}), got {idxs.shape} and {scores.shape}"
+        assert idxs.size == 0 or (
+                idxs.min() >= np.iinfo(self.idx_dtype).min and idxs.max() <= np.iinfo(self.idx_dtype).max), \
+            f"the indices do not fit into {self.idx_dtype}"
+        if index is None:
+            index = len(self._offsets)
+        if index >= len(self._offsets):
+            self._offsets.extend([0] * (index + 1 - len(self._offsets)))
+            self._lengths.extend([_MISSING] * (index + 1 - len(self._lengths)))
+        assert self._lengths[index] == _MISSING, f"the outputs of the sample {index} have already been added"
+        idxs = np.ascontiguousarray(idxs, dtype=self.idx_dtype)
+        scores = np.ascontiguousarray(scores, dtype=self.score_dtype)
+        nbytes = _record_nbytes(idxs.shape[0], self.topk, self.idx_dtype, self.score_dtype)
+        self._data_file.write(idxs.tobytes(order="C"))
+        self._data_file.write(scores.tobytes(order="C"))
+        self._data_file.write(b"\0" * (nbytes - idxs.nbytes - scores.nbytes))
+        self._offsets[index] = self._next_offset
+        self._lengths[index] = idxs.shape[0]
+        self._next_offset += nbytes
+        return index
+
+    def _write_index(self):
+        _write_index(
+            index_file_path(self.prefix_path), self.idx_dtype, self.score_dtype, self.topk,
+            self._offsets, self._lengths)
+
+    def checkpoint(self):
+        """Makes the outputs added so far readable and recoverable with *resume*."""
+        self._data_file.flush()
+        os.fsync(self._data_file.fileno())
+        self._write_index()
+
+    def finalize(self):
+        self._data_file.close()
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self._data_file.close()
+
+
+def merge_shards(shard_prefixes: List[str], prefix_path: str):
+    """Merges the teacher outputs written for disjoint subsets of the same
+    samples (e.g. by different shards of the generation) into *prefix_path*,
+    by concatenating their data files."""
+    indices = [_read_index(index_file_path(p)) for p in shard_prefixes]
+    idx_dtype, score_dtype, topk, offsets, _ = indices[0]
+    assert all(i[:3] == (idx_dtype, score_dtype, topk) and len(i[3]) == len(offsets) for i in indices), \
+        "the shards have been written with different settings"
+    merged_offsets = np.zeros(len(offsets), dtype=np.int64)
+    merged_lengths = np.full(len(offsets), _MISSING, dtype=np.int64)
+    base_offset = 0
+    with open(data_file_path(prefix_path), "wb") as data_file:
+        for shard, (_, _, _, shard_offsets, shard_lengths) in zip(shard_prefixes, indices):
+            written = shard_lengths != _MISSING
+            assert not np.any(written & (merged_lengths != _MISSING)), \
+                f"the outputs of some samples in {shard} are also in another shard"
+            merged_offsets[written] = shard_offsets[written] + base_offset
+            merged_lengths[written] = shard_lengths[written]
+            with open(data_file_path(shard), "rb") as shard_file:
+                shutil.copyfileobj(shard_file, data_file)
+            base_offset += os.path.getsize(data_file_path(shard))
+    _write_index(index_file_path(prefix_path), idx_dtype, score_dtype, topk, merged_offsets, merged_lengths)
+    num_missing = int(np.sum(merged_lengths == _MISSING))
+    if num_missing > 0:
+        logger.warning(f"The teacher outputs of {num_missing} samples are missing in {prefix_path}")
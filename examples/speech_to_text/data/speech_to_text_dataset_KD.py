@@ -3,24 +3,25 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import csv
 import logging
 import os.path as op
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
-from torch.nn import functional as F
 
+from examples.speech_to_text.data import packed_teacher_outputs
+from examples.speech_to_text.data.packed_teacher_outputs import PackedTeacherOutputs
 from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc, SpeechToTextDatasetWithSrc
 from fairseq.data import (
     ConcatDataset,
     Dictionary,
     ResamplingDataset,
-    data_utils as fairseq_data_utils,
 )
+from fairseq.data.audio.columnar_manifest import ColumnarManifest
 from fairseq.data.audio.feature_transforms import CompositeAudioFeatureTransform
 from fairseq.data.audio.speech_to_text_dataset import SpeechToTextDatasetCreator, \
-    _collate_frames, get_features_or_waveform
+    FeatureStore, _collate_padded
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +49,7 @@ class SpeechToTextDatasetKD(SpeechToTextDatasetWithSrc):
         pre_tokenizer=None,
         bpe_tokenizer=None,
         bpe_tokenizer_src=None,
+        teacher_outputs: Optional[PackedTeacherOutputs] = None,
     ):
         super().__init__(split, is_train_split, data_cfg, audio_paths, n_frames, src_texts, tgt_texts, speakers,
                          src_langs, tgt_langs, ids, tgt_dict, src_dict, pre_tokenizer, bpe_tokenizer, bpe_tokenizer_src)
@@ -68,7 +70,8 @@ class SpeechToTextDatasetKD(SpeechToTextDatasetWithSrc):
         assert (src_dict is None and src_texts is None) or (
                 src_dict is not None and src_texts is not None
         )
-        assert idxs is not None and probs is not None
+        assert teacher_outputs is not None or (idxs is not None and probs is not None)
+        assert teacher_outputs is None or len(teacher_outputs) == self.n_samples
         self.src_texts, self.tgt_texts = src_texts, tgt_texts
         self.src_langs, self.tgt_langs = src_langs, tgt_langs
         self.tgt_dict = tgt_dict
@@ -86,6 +89,9 @@ class SpeechToTextDatasetKD(SpeechToTextDatasetWithSrc):
         self.bpe_tokenizer_src = bpe_tokenizer_src
 
         self.idxs, self.probs = idxs, probs
+        self.teacher_outputs = teacher_outputs
+        if teacher_outputs is None:
+            self.idxs_store, self.probs_store = FeatureStore(idxs), FeatureStore(probs)
 
         logger.info(self.__repr__())
 
@@ -96,8 +102,14 @@ class SpeechToTextDatasetKD(SpeechToTextDatasetWithSrc):
                Optional[torch.Tensor]]:
         index, source, target, transcript = super().__getitem__(index)
 
-        idxs = get_features_or_waveform(self.idxs[index])
-        probs = get_features_or_waveform(self.probs[index])
+        if self.teacher_outputs is not None:
+            # indices and scores are read with a single access, and
+            # copied out of the (read-only) mapping by the conversion
+            idxs, probs = self.teacher_outputs.get(index)
+            idxs, probs = idxs.astype(np.int32), probs.astype(np.float32)
+        else:
+            idxs = self.idxs_store.get(index)
+            probs = self.probs_store.get(index)
         idxs = torch.from_numpy(idxs).int()
         probs = torch.from_numpy(probs).float()
 
@@ -107,94 +119,14 @@ class SpeechToTextDatasetKD(SpeechToTextDatasetWithSrc):
                                            torch.Tensor, torch.Tensor]]) -> Dict:
         if len(samples) == 0:
             return {}
-        indices = torch.tensor([i for i, _, _, _, _, _ in samples], dtype=torch.long)
-        frames = _collate_frames(
-            [s for _, s, _, _, _, _ in samples], self.data_cfg.use_audio_input
-        )
-        # sort samples by descending number of frames
-        n_frames = torch.tensor([s.size(0) for _, s, _, _, _, _ in samples], dtype=torch.long)
-        n_frames, order = n_frames.sort(descending=True)
-        indices = indices.index_select(0, order)
-        frames = frames.index_select(0, order)
-
-        target, target_lengths = None, None
-        prev_output_tokens = None
-        ntokens = None
-        if self.tgt_texts is not None:
-            target = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _, _, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            target = target.index_select(0, order)
-            target_lengths = torch.tensor(
-                [t.size(0) for _, _, t, _, _, _ in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_output_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _, _, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
-            )
-            prev_output_tokens = prev_output_tokens.index_select(0, order)
-            ntokens = sum(t.size(0) for _, _, t, _, _, _ in samples)
-
-        # Source transcripts
-        transcript, transcript_lengths = None, None
-        prev_transcript_tokens = None
-        ntokens_transcript = None
-        if self.src_texts is not None:
-            transcript = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t, _, _ in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            transcript = transcript.index_select(0, order)
-            transcript_lengths = torch.tensor(
-                [t.size(0) for _, _, _, t, _, _ in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_transcript_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t, _, _ in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
-            )
-            prev_transcript_tokens = prev_transcript_tokens.index_select(0, order)
-            ntokens_transcript = sum(t.size(0) for _, _, _, t, _, _ in samples)
-
+        out, order = self._collate(samples)
         # Add indexes and probabilities of knowledge distillation to the output
-        tgt_len = max(idx.shape[0] for _, _, _, _, idx, _ in samples)
-        pad_idx = self.tgt_dict.pad()
-        idxs, probs = [], []
-        for _, _, _, _, idx, prob in samples:
-            idxs.append(F.pad(idx, (0, 0, 0, tgt_len - idx.shape[0]), value=pad_idx))
-            probs.append(F.pad(prob, (0, 0, 0, tgt_len - prob.shape[0]), value=pad_idx))
-
-        out = {
-            "id": indices,
-            "net_input": {
-                "src_tokens": frames,
-                "src_lengths": n_frames,
-                "prev_output_tokens": prev_output_tokens,
-                "prev_transcript_tokens": prev_transcript_tokens,
-            },
-            "target": target,
-            "target_lengths": target_lengths,
-            "transcript": transcript,
-            "transcript_lengths": transcript_lengths,
-            "ntokens": ntokens,
-            "ntokens_transcript": ntokens_transcript,
-            "nsentences": len(samples),
-            # correct reordering with new batch order
-            "teacher_output": [torch.stack(idxs).index_select(0, order),
-                               torch.stack(probs).index_select(0, order)],
-        }
+        _, _, _, _, idxs, probs = zip(*samples)
+        out["teacher_output"] = [
+            _collate_padded(idxs, self.tgt_dict.pad(), order=order),
+            # the padding positions are masked in the loss
+            _collate_padded(probs, 0.0, order=order),
+        ]
         return out
 
 class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
@@ -206,8 +138,8 @@ class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
         cls,
         split_name: str,
         is_train_split,
-        samples: List[List[Dict]],
-        prob_idx: List[List[Dict]],
+        samples: Union[List[List[Dict]], List[ColumnarManifest]],
+        prob_idx: Union[List[List[Dict]], List[ColumnarManifest], List[PackedTeacherOutputs]],
         data_cfg: S2TDataConfigSrc,
         tgt_dict,
         src_dict,
@@ -215,39 +147,32 @@ class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
         bpe_tokenizer,
         bpe_tokenizer_src,
     ) -> SpeechToTextDatasetKD:
-        audio_paths, n_frames, src_texts, tgt_texts, ids = [], [], [], [], []
-        idxs, probs = [], []
-        speakers, src_langs, tgt_langs = [], [], []
-        for s in samples:
-            ids.extend([ss[cls.KEY_ID] for ss in s])
-            audio_paths.extend(
-                [op.join(data_cfg.audio_root, ss[cls.KEY_AUDIO]) for ss in s]
-            )
-            n_frames.extend([int(ss[cls.KEY_N_FRAMES]) for ss in s])
-            tgt_texts.extend([ss[cls.KEY_TGT_TEXT] for ss in s])
-            src_texts.extend(
-                [ss.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT) for ss in s]
-            )
-            speakers.extend([ss.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER) for ss in s])
-            src_langs.extend([ss.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG) for ss in s])
-            tgt_langs.extend([ss.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG) for ss in s])
-        for pi in prob_idx:
-            idxs.extend([pii[cls.KEY_IDX] for pii in pi])
-            probs.extend([pii[cls.KEY_PROB] for pii in pi])
+        columns = cls._get_columns(samples, data_cfg)
+        teacher_outputs = None
+        if len(prob_idx) == 1 and isinstance(prob_idx[0], PackedTeacherOutputs):
+            teacher_outputs = prob_idx[0]
+            idxs, probs = None, None
+        elif len(prob_idx) == 1 and isinstance(prob_idx[0], ColumnarManifest):
+            idxs, probs = prob_idx[0][cls.KEY_IDX], prob_idx[0][cls.KEY_PROB]
+        else:
+            idxs, probs = [], []
+            for pi in prob_idx:
+                idxs.extend([pii[cls.KEY_IDX] for pii in pi])
+                probs.extend([pii[cls.KEY_PROB] for pii in pi])
 
 
         return SpeechToTextDatasetKD(
             split_name,
             is_train_split,
             data_cfg,
-            audio_paths,
-            n_frames,
-            src_texts,
-            tgt_texts,
-            speakers,
-            src_langs,
-            tgt_langs,
-            ids,
+            columns["audio_paths"],
+            columns["n_frames"],
+            columns["src_texts"],
+            columns["tgt_texts"],
+            columns["speakers"],
+            columns["src_langs"],
+            columns["tgt_langs"],
+            columns["ids"],
             idxs,
             probs,
             tgt_dict,
@@ -255,6 +180,7 @@ class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
             pre_tokenizer,
             bpe_tokenizer,
             bpe_tokenizer_src,
+            teacher_outputs=teacher_outputs,
         )
 
     @classmethod
@@ -275,34 +201,16 @@ class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
         samples, prob_idx = [], []
         _splits = splits.split(",")
         for split in _splits:
-            tsv_path = op.join(root, f"{split}.tsv")
+            # the packed teacher outputs are preferred to the zipped ones
+            packed_prefix = packed_teacher_outputs.teacher_outputs_prefix(root, split)
             teacher_path = op.join(root, f"prob_idx_{split}.tsv")
-            if not op.isfile(tsv_path):
-                raise FileNotFoundError(f"Dataset not found: {tsv_path}")
-            if not op.isfile(teacher_path):
+            if not packed_teacher_outputs.exists(packed_prefix) and not op.isfile(teacher_path):
                 raise FileNotFoundError(f"Teacher dataset not found: {teacher_path}")
-            with open(tsv_path) as f:
-                reader = csv.DictReader(
-                    f,
-                    delimiter="\t",
-                    quotechar=None,
-                    doublequote=False,
-                    lineterminator="\n",
-                    quoting=csv.QUOTE_NONE,
-                )
-                samples.append([dict(e) for e in reader])
-                assert len(samples) > 0
-            with open(teacher_path) as f:
-                reader = csv.DictReader(
-                    f,
-                    delimiter="\t",
-                    quotechar=None,
-                    doublequote=False,
-                    lineterminator="\n",
-                    quoting=csv.QUOTE_NONE,
-                )
-                prob_idx.append([dict(e) for e in reader])
-                assert len(prob_idx) > 0
+            samples.append(cls._load_manifest(op.join(root, f"{split}.tsv")))
+            if packed_teacher_outputs.exists(packed_prefix):
+                prob_idx.append(PackedTeacherOutputs(packed_prefix))
+            else:
+                prob_idx.append(ColumnarManifest.from_tsv(teacher_path))
 
         datasets = [
             cls._from_list(
@@ -319,6 +227,9 @@ class SpeechToTextDatasetCreatorKD(SpeechToTextDatasetCreator):
             )
             for name, s, p_i in zip(_splits, samples, prob_idx)
         ]
+        for name, d in zip(_splits, datasets):
+            d.load_binarized_tokens(op.join(root, f"{name}.tsv"))
+            d.load_token_lengths(op.join(root, f"{name}.tsv"))
 
         if is_train_split and len(_splits) > 1 and data_cfg.sampling_alpha != 1.0:
             # temperature-based sampling
@@ -12,20 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License
 import logging
-import os.path as op
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
-from torch.nn import functional as F
 
 from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc, \
     SpeechToTextDatasetCreatorWithSrc, SpeechToTextDatasetWithSrc
-from fairseq.data import (
-    Dictionary,
-    data_utils as fairseq_data_utils,
-)
-from fairseq.data.audio.speech_to_text_dataset import _collate_frames
+from fairseq.data import Dictionary
+from fairseq.data.audio.columnar_manifest import ColumnarManifest
+from fairseq.data.audio.speech_to_text_dataset import _collate_padded
 
 
 logger = logging.getLogger(__name__)
@@ -124,99 +120,17 @@ class SpeechToTextDatasetTagged(SpeechToTextDatasetWithSrc):
     ) -> Dict:
         if len(samples) == 0:
             return {}
-        indices = torch.tensor([i for i, _, _, _, _, _ in samples], dtype=torch.long)
-        frames = _collate_frames(
-            [s for _, s, _, _, _, _ in samples], self.data_cfg.use_audio_input
-        )
-        # sort samples by descending number of frames
-        n_frames = torch.tensor([s.size(0) for _, s, _, _, _, _ in samples], dtype=torch.long)
-        n_frames, order = n_frames.sort(descending=True)
-        indices = indices.index_select(0, order)
-        frames = frames.index_select(0, order)
-
-        target, target_lengths = None, None
-        prev_output_tokens = None
-        ntokens = None
-        if self.tgt_texts is not None:
-            target = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _, _, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            target = target.index_select(0, order)
-            target_lengths = torch.tensor(
-                [t.size(0) for _, _, t, _, _, _ in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_output_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _, _, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
-            )
-            prev_output_tokens = prev_output_tokens.index_select(0, order)
-            ntokens = sum(t.size(0) for _, _, t, _, _, _ in samples)
-
-        # Source transcripts
-        transcript, transcript_lengths = None, None
-        prev_transcript_tokens = None
-        ntokens_transcript = None
-        if self.src_texts is not None:
-            transcript = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t, _, _ in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            transcript = transcript.index_select(0, order)
-            transcript_lengths = torch.tensor(
-                [t.size(0) for _, _, _, t, _, _ in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_transcript_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t, _, _ in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
-            )
-            prev_transcript_tokens = prev_transcript_tokens.index_select(0, order)
-            ntokens_transcript = sum(t.size(0) for _, _, _, t, _, _ in samples)
-
+        out, order = self._collate(samples)
+        _, _, _, _, tgt_tags, src_tags = zip(*samples)
         pad_idx = 0
-        tgt_len = target.shape[1]
-        tgt_tags = []
-        for _, _, _, _, tgt_tag, _ in samples:
-            tgt_tags.append(F.pad(tgt_tag, (0, tgt_len - tgt_tag.shape[0]), value=pad_idx))
-        tgt_tags = torch.stack(tgt_tags).index_select(0, order)
-        src_len = transcript.shape[1]
-        src_tags = []
-        for _, _, _, _, _, src_tag in samples:
-            src_tags.append(F.pad(src_tag, (0, src_len - src_tag.shape[0]), value=pad_idx))
-        src_tags = torch.stack(src_tags).index_select(0, order)
-
-        out = {
-            "id": indices,
-            "net_input": {
-                "src_tokens": frames,
-                "src_lengths": n_frames,
-                "prev_output_tokens": prev_output_tokens,
-                "prev_transcript_tokens": prev_transcript_tokens,
-                "prev_target_tags": torch.roll(tgt_tags, 1),
-                "prev_transcript_tags": torch.roll(src_tags, 1),
-            },
-            "target": target,
-            "target_lengths": target_lengths,
-            "target_tags": tgt_tags,
-            "transcript": transcript,
-            "transcript_lengths": transcript_lengths,
-            "transcript_tags": src_tags,
-            "ntokens": ntokens,
-            "ntokens_transcript": ntokens_transcript,
-            "nsentences": len(samples),
-        }
+        tgt_tags = _collate_padded(
+            tgt_tags, pad_idx, order=order, pad_to_length=out["target"].shape[1])
+        src_tags = _collate_padded(
+            src_tags, pad_idx, order=order, pad_to_length=out["transcript"].shape[1])
+        out["net_input"]["prev_target_tags"] = torch.roll(tgt_tags, 1)
+        out["net_input"]["prev_transcript_tags"] = torch.roll(src_tags, 1)
+        out["target_tags"] = tgt_tags
+        out["transcript_tags"] = src_tags
         return out
 
 
@@ -226,7 +140,7 @@ class SpeechToTextDatasetTaggedCreator(SpeechToTextDatasetCreatorWithSrc):
         cls,
         split_name: str,
         is_train_split,
-        samples: List[List[Dict]],
+        samples: Union[List[List[Dict]], List[ColumnarManifest]],
         data_cfg: S2TDataConfigTagged,
         tgt_dict,
         src_dict,
@@ -234,31 +148,19 @@ class SpeechToTextDatasetTaggedCreator(SpeechToTextDatasetCreatorWithSrc):
         bpe_tokenizer,
         bpe_tokenizer_src,
     ) -> SpeechToTextDatasetTagged:
-        audio_paths, n_frames, src_texts, tgt_texts, ids = [], [], [], [], []
-        speakers, src_langs, tgt_langs = [], [], []
-        for s in samples:
-            ids.extend([ss[cls.KEY_ID] for ss in s])
-            audio_paths.extend(
-                [op.join(data_cfg.audio_root, ss[cls.KEY_AUDIO]) for ss in s]
-            )
-            n_frames.extend([int(ss[cls.KEY_N_FRAMES]) for ss in s])
-            tgt_texts.extend([ss[cls.KEY_TGT_TEXT] for ss in s])
-            src_texts.extend([ss.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT) for ss in s])
-            speakers.extend([ss.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER) for ss in s])
-            src_langs.extend([ss.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG) for ss in s])
-            tgt_langs.extend([ss.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG) for ss in s])
+        columns = cls._get_columns(samples, data_cfg)
         return SpeechToTextDatasetTagged(
             split_name,
             is_train_split,
             data_cfg,
-            audio_paths,
-            n_frames,
-            src_texts,
-            tgt_texts,
-            speakers,
-            src_langs,
-            tgt_langs,
-            ids,
+            columns["audio_paths"],
+            columns["n_frames"],
+            columns["src_texts"],
+            columns["tgt_texts"],
+            columns["speakers"],
+            columns["src_langs"],
+            columns["tgt_langs"],
+            columns["ids"],
             tgt_dict,
             src_dict,
             pre_tokenizer,
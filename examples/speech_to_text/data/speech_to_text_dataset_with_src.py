@@ -3,22 +3,23 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import csv
 import logging
 import os.path as op
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 
 from fairseq.data import (
     ConcatDataset,
     Dictionary,
     ResamplingDataset,
-    data_utils as fairseq_data_utils,
 )
+from fairseq.data.audio.columnar_manifest import ColumnarManifest
 from fairseq.data.audio.feature_transforms import CompositeAudioFeatureTransform
 from fairseq.data.audio.speech_to_text_dataset import S2TDataConfig, SpeechToTextDatasetCreator, \
-    SpeechToTextDataset, _collate_frames
+    SpeechToTextDataset, _collate_frames, _collate_target, binarized_tokens_prefix, cached_token_lengths, \
+    open_binarized_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -97,6 +98,10 @@ class SpeechToTextDatasetWithSrc(SpeechToTextDataset):
         self.pre_tokenizer = pre_tokenizer
         self.bpe_tokenizer = bpe_tokenizer
         self.bpe_tokenizer_src = bpe_tokenizer_src
+        # number of tokens of the source transcripts, see load_token_lengths
+        self.src_lens = None
+        # token IDs of the source transcripts, see load_binarized_tokens
+        self.src_tokens = None
 
         logger.info(self.__repr__())
 
@@ -107,13 +112,39 @@ class SpeechToTextDatasetWithSrc(SpeechToTextDataset):
             text = self.bpe_tokenizer_src.encode(text)
         return text
 
+    def load_binarized_tokens(self, tsv_path: str):
+        super().load_binarized_tokens(tsv_path)
+        if self.src_texts is not None:
+            self.src_tokens = open_binarized_tokens(
+                binarized_tokens_prefix(tsv_path, "src"),
+                self.src_texts,
+                self.src_dict,
+                [self.data_cfg.pre_tokenizer, self.data_cfg.bpe_tokenizer_src],
+            )
+
+    def load_token_lengths(self, tsv_path: Optional[str] = None):
+        super().load_token_lengths(tsv_path)
+        if self.src_tokens is not None:
+            self.src_lens = self.src_tokens.sizes.astype(np.int64) - 1
+        elif self.src_texts is not None:
+            self.src_lens = cached_token_lengths(
+                None if tsv_path is None else f"{tsv_path}.src_lens",
+                self.src_texts,
+                self.pre_tokenizer,
+                self.bpe_tokenizer_src,
+                tokenizer_cfgs=[self.data_cfg.pre_tokenizer, self.data_cfg.bpe_tokenizer_src],
+                num_workers=self.data_cfg.token_lengths_workers,
+            )
+
     def __getitem__(
         self, index: int
     ) -> Tuple[int, torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]:
         index, source, target = super().__getitem__(index)
 
         transcript = None
-        if self.src_texts is not None:
+        if self.src_tokens is not None:
+            transcript = self.src_tokens[index].long()
+        elif self.src_texts is not None:
             tokenized = self.tokenize_text_src(self.src_texts[index])
             transcript = self.src_dict.encode_line(
                 tokenized, add_if_not_exist=False, append_eos=True
@@ -124,66 +155,43 @@ class SpeechToTextDatasetWithSrc(SpeechToTextDataset):
     def collater(self, samples: List[Tuple[int, torch.Tensor, torch.Tensor, torch.Tensor]]) -> Dict:
         if len(samples) == 0:
             return {}
-        indices = torch.tensor([i for i, _, _, _ in samples], dtype=torch.long)
-        frames = _collate_frames(
-            [s for _, s, _, _ in samples], self.data_cfg.use_audio_input
-        )
+        out, _ = self._collate(samples)
+        return out
+
+    def _collate(self, samples: List[Tuple]) -> Tuple[Dict, torch.Tensor]:
+        """
+        Collates the first four elements of the *samples* (index, source,
+        target and transcript), and returns the batch along with the order
+        of the samples in it, which the subclasses use to collate the others.
+        """
+        indices, sources, targets, transcripts = list(zip(*samples))[:4]
+        indices = torch.tensor(indices, dtype=torch.long)
         # sort samples by descending number of frames
-        n_frames = torch.tensor([s.size(0) for _, s, _, _ in samples], dtype=torch.long)
+        n_frames = torch.tensor([s.size(0) for s in sources], dtype=torch.long)
         n_frames, order = n_frames.sort(descending=True)
         indices = indices.index_select(0, order)
-        frames = frames.index_select(0, order)
+        frames = _collate_frames(
+            sources, self.data_cfg.use_audio_input, order=order
+        )
 
         target, target_lengths = None, None
         prev_output_tokens = None
         ntokens = None
         if self.tgt_texts is not None:
-            target = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            target = target.index_select(0, order)
-            target_lengths = torch.tensor(
-                [t.size(0) for _, _, t, _ in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_output_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, t, _ in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
+            target, prev_output_tokens, target_lengths = _collate_target(
+                targets, self.tgt_dict.pad(), self.tgt_dict.eos(), order=order
             )
-            prev_output_tokens = prev_output_tokens.index_select(0, order)
-            ntokens = sum(t.size(0) for _, _, t, _ in samples)
+            ntokens = target_lengths.sum().item()
 
         # Source transcripts
         transcript, transcript_lengths = None, None
         prev_transcript_tokens = None
         ntokens_transcript = None
         if self.src_texts is not None:
-            transcript = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
+            transcript, prev_transcript_tokens, transcript_lengths = _collate_target(
+                transcripts, self.src_dict.pad(), self.src_dict.eos(), order=order
             )
-            transcript = transcript.index_select(0, order)
-            transcript_lengths = torch.tensor(
-                [t.size(0) for _, _, _, t in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_transcript_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, _, t in samples],
-                self.src_dict.pad(),
-                self.src_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
-            )
-            prev_transcript_tokens = prev_transcript_tokens.index_select(0, order)
-            ntokens_transcript = sum(t.size(0) for _, _, _, t in samples)
+            ntokens_transcript = transcript_lengths.sum().item()
 
         out = {
             "id": indices,
@@ -201,7 +209,7 @@ class SpeechToTextDatasetWithSrc(SpeechToTextDataset):
             "ntokens_transcript": ntokens_transcript,
             "nsentences": len(samples),
         }
-        return out
+        return out, order
 
 class SpeechToTextDatasetCreatorWithSrc(SpeechToTextDatasetCreator):
 
@@ -210,7 +218,7 @@ class SpeechToTextDatasetCreatorWithSrc(SpeechToTextDatasetCreator):
         cls,
         split_name: str,
         is_train_split,
-        samples: List[List[Dict]],
+        samples: Union[List[List[Dict]], List[ColumnarManifest]],
         data_cfg: S2TDataConfigSrc,
         tgt_dict,
         src_dict,
@@ -218,31 +226,19 @@ class SpeechToTextDatasetCreatorWithSrc(SpeechToTextDatasetCreator):
         bpe_tokenizer,
         bpe_tokenizer_src,
     ) -> SpeechToTextDatasetWithSrc:
-        audio_paths, n_frames, src_texts, tgt_texts, ids = [], [], [], [], []
-        speakers, src_langs, tgt_langs = [], [], []
-        for s in samples:
-            ids.extend([ss[cls.KEY_ID] for ss in s])
-            audio_paths.extend(
-                [op.join(data_cfg.audio_root, ss[cls.KEY_AUDIO]) for ss in s]
-            )
-            n_frames.extend([int(ss[cls.KEY_N_FRAMES]) for ss in s])
-            tgt_texts.extend([ss[cls.KEY_TGT_TEXT] for ss in s])
-            src_texts.extend([ss.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT) for ss in s])
-            speakers.extend([ss.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER) for ss in s])
-            src_langs.extend([ss.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG) for ss in s])
-            tgt_langs.extend([ss.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG) for ss in s])
+        columns = cls._get_columns(samples, data_cfg)
         return SpeechToTextDatasetWithSrc(
             split_name,
             is_train_split,
             data_cfg,
-            audio_paths,
-            n_frames,
-            src_texts,
-            tgt_texts,
-            speakers,
-            src_langs,
-            tgt_langs,
-            ids,
+            columns["audio_paths"],
+            columns["n_frames"],
+            columns["src_texts"],
+            columns["tgt_texts"],
+            columns["speakers"],
+            columns["src_langs"],
+            columns["tgt_langs"],
+            columns["ids"],
             tgt_dict,
             src_dict,
             pre_tokenizer,
@@ -268,20 +264,7 @@ class SpeechToTextDatasetCreatorWithSrc(SpeechToTextDatasetCreator):
         samples = []
         _splits = splits.split(",")
         for split in _splits:
-            tsv_path = op.join(root, f"{split}.tsv")
-            if not op.isfile(tsv_path):
-                raise FileNotFoundError(f"Dataset not found: {tsv_path}")
-            with open(tsv_path) as f:
-                reader = csv.DictReader(
-                    f,
-                    delimiter="\t",
-                    quotechar=None,
-                    doublequote=False,
-                    lineterminator="\n",
-                    quoting=csv.QUOTE_NONE,
-                )
-                samples.append([dict(e) for e in reader])
-                assert len(samples) > 0
+            samples.append(cls._load_manifest(op.join(root, f"{split}.tsv")))
 
         datasets = [
             cls._from_list(
@@ -297,6 +280,9 @@ class SpeechToTextDatasetCreatorWithSrc(SpeechToTextDatasetCreator):
             )
             for name, s in zip(_splits, samples)
         ]
+        for name, d in zip(_splits, datasets):
+            d.load_binarized_tokens(op.join(root, f"{name}.tsv"))
+            d.load_token_lengths(op.join(root, f"{name}.tsv"))
 
         if is_train_split and len(_splits) > 1 and data_cfg.sampling_alpha != 1.0:
             # temperature-based sampling
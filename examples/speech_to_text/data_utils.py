@@ -7,11 +7,12 @@
 import csv
 import os
 import os.path as op
+import struct
 import zipfile
 from functools import reduce
 from glob import glob
-from multiprocessing import cpu_count
-from typing import Any, Dict, List
+from multiprocessing import cpu_count, Pool
+from typing import Any, Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
@@ -109,20 +110,63 @@ def is_npy_data(data: bytes) -> bool:
     return data[0] == 147 and data[1] == 78
 
 
-def get_zip_manifest(zip_root, zip_filename):
-    zip_path = op.join(zip_root, zip_filename)
+def get_zip_members(zip_path) -> List[Tuple[str, int, int]]:
+    """
+    Returns the (filename, data offset, size) of the members of an uncompressed zip.
+    Only the central directory and the local headers are read: the offsets account
+    for the actual length of the extra field of each local header.
+    """
     with zipfile.ZipFile(zip_path, mode="r") as f:
-        info = f.infolist()
-    manifest = {}
-    for i in tqdm(info):
-        utt_id = op.splitext(i.filename)[0]
-        offset, file_size = i.header_offset + 30 + len(i.filename), i.file_size
-        manifest[utt_id] = f"{zip_filename}:{offset}:{file_size}"
-        with open(zip_path, "rb") as f:
+        info = sorted(f.infolist(), key=lambda i: i.header_offset)
+    members = []
+    with open(zip_path, "rb") as f:
+        for i in info:
+            assert i.compress_type == zipfile.ZIP_STORED, f"{i.filename} is compressed"
+            f.seek(i.header_offset)
+            header = f.read(30)
+            assert header[:4] == b"PK\x03\x04", f"invalid local header for {i.filename}"
+            filename_len, extra_len = struct.unpack("<HH", header[26:30])
+            members.append((i.filename, i.header_offset + 30 + filename_len + extra_len, i.file_size))
+    return members
+
+
+def _find_invalid_npy_members(chunk) -> List[str]:
+    zip_path, members = chunk
+    invalid = []
+    with open(zip_path, "rb") as f:
+        for filename, offset, file_size in members:
             f.seek(offset)
-            data = f.read(file_size)
-            assert len(data) > 1 and is_npy_data(data)
-    return manifest
+            # only the npy magic string (\x93NUMPY) is checked, so the rest of the payload is not read
+            data = f.read(min(file_size, 6))
+            if not (len(data) > 1 and is_npy_data(data)):
+                invalid.append(filename)
+    return invalid
+
+
+def validate_npy_members(zip_path, members: List[Tuple[str, int, int]], num_workers: int = 1, chunk_size: int = 256):
+    """
+    Checks that the *members* (as returned by :py:func:`get_zip_members`) of the zip
+    contain npy data, reading the magic string of their payloads with *num_workers* processes.
+    """
+    chunks = [(zip_path, members[i:i + chunk_size]) for i in range(0, len(members), chunk_size)]
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            results = pool.map(_find_invalid_npy_members, chunks)
+    else:
+        results = [_find_invalid_npy_members(chunk) for chunk in chunks]
+    invalid = [filename for result in results for filename in result]
+    assert len(invalid) == 0, f"{zip_path} contains invalid npy data: {', '.join(invalid[:10])}"
+
+
+def get_zip_manifest(zip_root, zip_filename, validate: bool = False, num_workers: int = 1):
+    zip_path = op.join(zip_root, zip_filename)
+    members = get_zip_members(zip_path)
+    if validate:
+        validate_npy_members(zip_path, members, num_workers=num_workers)
+    return {
+        op.splitext(filename)[0]: f"{zip_filename}:{offset}:{file_size}"
+        for filename, offset, file_size in members
+    }
 
 
 def gen_config_yaml(
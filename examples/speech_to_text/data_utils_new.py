@@ -5,16 +5,19 @@
 # LICENSE file in the root directory of this source tree.
 
 import csv
+import io
 from pathlib import Path
 import zipfile
-from functools import reduce
-from multiprocessing import cpu_count
-from typing import Any, Dict, List, Optional, Union
+from functools import lru_cache, reduce
+from multiprocessing import cpu_count, Pool
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import sentencepiece as sp
+from examples.speech_to_text.data_utils import get_zip_members, validate_npy_members
 from fairseq.data.audio.audio_utils import _get_kaldi_fbank, _get_torchaudio_fbank
+from fairseq.data.audio.packed_features import PackedFeaturesBuilder
 from tqdm import tqdm
 import regex as re
 import string
@@ -94,33 +97,300 @@ def extract_fbank_features(
         return features
 
 
-def create_zip(data_root: Path, zip_path: Path):
+class IncrementalFbankExtractor(object):
+    """
+    Stateful filterbank extractor for a stream of audio that is processed
+    with overlapping (sliding) windows, as done by the streaming server.
+
+    Each filterbank frame depends only on the samples in its 25ms window
+    (Kaldi frames are extracted with a 10ms shift and without padding at the edges),
+    so the features of the frames already computed for the previous window are kept
+    and only the frames that were not covered yet are extracted with
+    :py:func:`extract_fbank_features`. The output is the same of
+    :py:func:`extract_fbank_features` on the whole window, as long as the extraction
+    is deterministic (i.e. no dithering is applied) and the windows start at a
+    multiple of the frame shift; otherwise, the features of the window are fully recomputed.
+    """
+    FRAME_LENGTH_MS = 25
+    FRAME_SHIFT_MS = 10
+
+    def __init__(self, sample_rate: int, n_mel_bins: int = 80):
+        self.sample_rate = sample_rate
+        self.n_mel_bins = n_mel_bins
+        self.frame_length = int(sample_rate * self.FRAME_LENGTH_MS / 1000)
+        self.frame_shift = int(sample_rate * self.FRAME_SHIFT_MS / 1000)
+        # features of the frames starting at self.start_sample + i * self.frame_shift
+        self.features = None
+        self.start_sample = 0
+        # statistics on the number of frames taken from the cache and computed
+        self.cached_frames = 0
+        self.computed_frames = 0
+
+    def reset(self):
+        self.features = None
+        self.start_sample = 0
+
+    def num_frames(self, num_samples: int) -> int:
+        if num_samples < self.frame_length:
+            return 0
+        return 1 + (num_samples - self.frame_length) // self.frame_shift
+
+    def _num_reusable_frames(self, offset: int) -> int:
+        if self.features is None or offset < self.start_sample:
+            return 0
+        if (offset - self.start_sample) % self.frame_shift != 0:
+            return 0
+        first_frame = (offset - self.start_sample) // self.frame_shift
+        return max(0, len(self.features) - first_frame)
+
+    def extract(self, waveform, offset: int) -> np.ndarray:
+        """
+        Returns the filterbank features of *waveform*, which contains the audio
+        of the stream starting from the sample *offset* (counted from the beginning
+        of the stream). *waveform* is expected in the same format
+        accepted by :py:func:`extract_fbank_features`.
+        The returned features are kept for the next window, so they must not be modified in place.
+        """
+        _waveform = waveform.squeeze()
+        n_frames = self.num_frames(_waveform.shape[-1])
+        n_reused = min(self._num_reusable_frames(offset), n_frames)
+        if n_frames == 0 or n_reused == 0:
+            features = extract_fbank_features(_waveform, self.sample_rate, n_mel_bins=self.n_mel_bins)
+            n_reused = 0
+        else:
+            first_frame = (offset - self.start_sample) // self.frame_shift
+            reused = self.features[first_frame:first_frame + n_reused]
+            if n_reused < n_frames:
+                # the samples after the end of the last frame are not used
+                end_sample = (n_frames - 1) * self.frame_shift + self.frame_length
+                new_features = extract_fbank_features(
+                    _waveform[n_reused * self.frame_shift:end_sample],
+                    self.sample_rate,
+                    n_mel_bins=self.n_mel_bins)
+                assert len(new_features) == n_frames - n_reused
+                features = np.concatenate([reused, new_features], axis=0)
+            else:
+                features = reused
+        self.cached_frames += n_reused
+        self.computed_frames += n_frames - n_reused
+        # The frames before the current window are not needed anymore
+        self.features = features
+        self.start_sample = offset
+        return features
+
+
+def _last_member_manifest_path(zip_file: zipfile.ZipFile, zip_path: Path) -> str:
+    # the data of the last written member ends where the file pointer is,
+    # whatever the length of the extra field of its local header
+    info = zip_file.infolist()[-1]
+    return f"{zip_path.as_posix()}:{zip_file.fp.tell() - info.compress_size}:{info.file_size}"
+
+
+def create_zip(data_root: Path, zip_path: Path) -> Dict[str, str]:
+    """
+    Stores the .npy files of *data_root* into an uncompressed zip and returns
+    their manifest (as :py:func:`get_zip_manifest`) collected while writing it.
+    """
     paths = list(data_root.glob("*.npy"))
+    manifest = {}
     with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as f:
         for path in tqdm(paths):
             f.write(path, arcname=path.name)
+            manifest[path.stem] = _last_member_manifest_path(f, zip_path)
+    return manifest
 
 
 def is_npy_data(data: bytes) -> bool:
     return data[0] == 147 and data[1] == 78
 
 
-def get_zip_manifest(zip_path: Path, zip_root: Optional[Path] = None):
+def get_zip_manifest(
+    zip_path: Path, zip_root: Optional[Path] = None, validate: bool = False, num_workers: int = 1
+) -> Dict[str, str]:
+    """
+    Returns the paths (zip:offset:size) of the members of the zip by utterance ID, reading only
+    its central directory and local headers. If *validate* is set, the payloads are also checked
+    to contain npy data by *num_workers* processes.
+    """
     _zip_path = zip_path if zip_root is None else Path.joinpath(zip_root, zip_path)
-    with zipfile.ZipFile(_zip_path, mode="r") as f:
-        info = f.infolist()
+    members = get_zip_members(_zip_path)
+    if validate:
+        validate_npy_members(_zip_path, members, num_workers=num_workers)
+    return {
+        Path(filename).stem: f"{zip_path.as_posix()}:{offset}:{file_size}"
+        for filename, offset, file_size in members
+    }
+
+
+def add_feature_extraction_args(parser):
+    parser.add_argument("--num-workers", type=int, default=cpu_count(),
+                        help="number of processes extracting the features")
+    parser.add_argument("--extraction-chunk-size", type=int, default=32,
+                        help="number of utterances processed by a worker at a time")
+    parser.add_argument("--feature-format", type=str, default="zip", choices=["zip", "packed"],
+                        help="store the features in a fbank.zip or as packed features (fbank.bin/idx)")
+    parser.add_argument("--packed-dtype", type=str, default="float32", choices=["float32", "float16"],
+                        help="type used to store the packed features")
+
+
+class ZipFeaturesWriter(object):
+    """
+    Writes the features into an uncompressed zip, as :py:func:`create_zip` does with .npy files.
+    """
+    def __init__(self, zip_path: Path):
+        self.zip_path = zip_path
+        self.zip_file = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED)
+
+    def add(self, utt_id: str, features: np.ndarray) -> str:
+        """
+        Adds the *features* and returns their path to be written in the manifest.
+        """
+        data = io.BytesIO()
+        np.save(data, features)
+        self.zip_file.writestr(f"{utt_id}.npy", data.getvalue())
+        return _last_member_manifest_path(self.zip_file, self.zip_path)
+
+    def close(self):
+        self.zip_file.close()
+
+
+class PackedFeaturesWriter(object):
+    """
+    Writes the features as packed features (see :py:class:`PackedFeaturesBuilder`).
+    The utterance IDs are written one per line in the <prefix>.ids file.
+    """
+    def __init__(self, prefix: Path, dtype: str = "float32"):
+        self.prefix = prefix
+        self.builder = PackedFeaturesBuilder(prefix.as_posix(), dtype=dtype)
+        self.ids_file = open(prefix.as_posix() + ".ids", "w")
+
+    def add(self, utt_id: str, features: np.ndarray) -> str:
+        self.ids_file.write(utt_id + "\n")
+        return self.builder.manifest_path(self.builder.add_item(features))
+
+    def close(self):
+        self.builder.finalize()
+        self.ids_file.close()
+
+
+def get_packed_manifest(prefix: Path) -> Dict[str, str]:
+    with open(prefix.as_posix() + ".ids") as f:
+        return {utt_id.rstrip("\n"): f"{prefix.as_posix()}.bin:{i}" for i, utt_id in enumerate(f)}
+
+
+def get_features_manifest(output_prefix: Path, feature_format: str = "zip") -> Dict[str, str]:
+    """
+    Returns the paths of the features already extracted with
+    :py:func:`extract_fbank_features_parallel` in *output_prefix* (e.g. root / "fbank").
+    """
+    if feature_format == "packed":
+        return get_packed_manifest(output_prefix)
+    return get_zip_manifest(output_prefix.with_suffix(".zip"))
+
+
+_extraction_datasets = None
+_extraction_n_mel_bins = None
+
+
+def _init_extraction_worker(datasets, n_mel_bins):
+    global _extraction_datasets, _extraction_n_mel_bins
+    _extraction_datasets, _extraction_n_mel_bins = datasets, n_mel_bins
+    # the parallelism is across processes
+    import torch
+    torch.set_num_threads(1)
+
+
+def _extract_chunk(chunk: Tuple[int, int, int]) -> List[Tuple[str, np.ndarray]]:
+    dataset_idx, start, end = chunk
+    dataset = _extraction_datasets[dataset_idx]
+    results = []
+    for i in range(start, end):
+        item = dataset[i]
+        waveform, sample_rate, utt_id = item[0], item[1], item[-1]
+        results.append((utt_id, extract_fbank_features(waveform, sample_rate, n_mel_bins=_extraction_n_mel_bins)))
+    return results
+
+
+def extract_fbank_features_parallel(
+    datasets: Sequence,
+    output_prefix: Path,
+    n_mel_bins: int = 80,
+    num_workers: int = 1,
+    chunk_size: int = 32,
+    feature_format: str = "zip",
+    packed_dtype: str = "float32",
+) -> Dict[str, str]:
+    """
+    Extracts the filterbanks of all the items of the *datasets*, which are expected to be tuples
+    (waveform, sample_rate, ..., utterance_id), with a pool of *num_workers* processes that
+    process *chunk_size* consecutive items at a time. The features are written directly into
+    *output_prefix*.zip (or into the packed features *output_prefix*.bin/.idx), in the order
+    of the datasets, and the returned dictionary contains their paths by utterance ID.
+    """
+    if feature_format == "packed":
+        writer = PackedFeaturesWriter(output_prefix, dtype=packed_dtype)
+    else:
+        writer = ZipFeaturesWriter(output_prefix.with_suffix(".zip"))
+    chunks = [
+        (dataset_idx, start, min(start + chunk_size, len(dataset)))
+        for dataset_idx, dataset in enumerate(datasets)
+        for start in range(0, len(dataset), chunk_size)]
     manifest = {}
-    for i in tqdm(info):
-        utt_id = Path(i.filename).stem
-        offset, file_size = i.header_offset + 30 + len(i.filename), i.file_size
-        manifest[utt_id] = f"{zip_path.as_posix()}:{offset}:{file_size}"
-        with open(_zip_path, "rb") as f:
-            f.seek(offset)
-            data = f.read(file_size)
-            assert len(data) > 1 and is_npy_data(data)
+    progress = tqdm(total=sum(len(d) for d in datasets))
+    try:
+        if num_workers > 1:
+            with Pool(num_workers, initializer=_init_extraction_worker, initargs=(datasets, n_mel_bins)) as pool:
+                for results in pool.imap(_extract_chunk, chunks):
+                    for utt_id, features in results:
+                        manifest[utt_id] = writer.add(utt_id, features)
+                    progress.update(len(results))
+        else:
+            _init_extraction_worker(datasets, n_mel_bins)
+            for chunk in chunks:
+                results = _extract_chunk(chunk)
+                for utt_id, features in results:
+                    manifest[utt_id] = writer.add(utt_id, features)
+                progress.update(len(results))
+    finally:
+        progress.close()
+        writer.close()
     return manifest
 
 
+@lru_cache(maxsize=64)
+def get_audio_info(path: str) -> Tuple[int, int]:
+    """
+    Returns the number of samples (per channel) and the sample rate of an audio file,
+    read from its header without decoding the audio.
+    """
+    import soundfile as sf
+    try:
+        info = sf.info(path)
+        return info.frames, info.samplerate
+    except RuntimeError:
+        # formats not supported by libsndfile (e.g. mp3 in older versions)
+        import torchaudio
+        info = torchaudio.info(path)
+        return info.num_frames, info.sample_rate
+
+
+def get_num_samples(path: str, offset: int = 0, num_samples: int = -1) -> int:
+    """
+    Returns the number of samples read loading *num_samples* (-1 for all)
+    starting from *offset* from the audio file, without decoding it.
+    """
+    available = max(get_audio_info(path)[0] - offset, 0)
+    return available if num_samples < 0 else min(num_samples, available)
+
+
+def get_dataset_metadata(dataset) -> List[Tuple]:
+    """
+    Returns the items of a dataset of the preprocessing scripts without loading the audio, i.e.
+    with the number of samples of the audio in place of the waveform (see get_item_metadata).
+    """
+    return [dataset.get_item_metadata(i) for i in range(len(dataset))]
+
+
 def gen_config_yaml(
     manifest_root: Path,
     spm_filename: str,
@@ -3,6 +3,8 @@ import os.path as op
 import sys
 from argparse import Namespace
 
+from examples.speech_to_text.data import packed_teacher_outputs
+from examples.speech_to_text.data.packed_teacher_outputs import PackedTeacherOutputs, PackedTeacherOutputsBuilder
 from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc
 
 from examples.speech_to_text.data.speech_to_text_dataset_KD import SpeechToTextDatasetCreatorKD
@@ -14,6 +16,8 @@ config_yaml = sys.argv[3]
 
 tsv_path = op.join(root, f"{split}.tsv")
 teacher_path = op.join(root, f"prob_idx_{split}.tsv")
+packed_prefix = packed_teacher_outputs.teacher_outputs_prefix(root, split)
+use_packed = packed_teacher_outputs.exists(packed_prefix)
 is_train_split = split.startswith("train")
 data_cfg = S2TDataConfigSrc(op.join(root, config_yaml))
 pre_tokenizer = encoders.build_tokenizer(Namespace(**data_cfg.pre_tokenizer))
@@ -33,17 +37,20 @@ with open(tsv_path) as f:
     )
     samples = [dict(e) for e in reader]
     assert len(samples) > 0
-with open(teacher_path) as f:
-    reader = csv.DictReader(
-        f,
-        delimiter="\t",
-        quotechar=None,
-        doublequote=False,
-        lineterminator="\n",
-        quoting=csv.QUOTE_NONE,
-    )
-    prob_idx = [dict(e) for e in reader]
-    assert len(prob_idx) > 0
+if use_packed:
+    prob_idx = PackedTeacherOutputs(packed_prefix)
+else:
+    with open(teacher_path) as f:
+        reader = csv.DictReader(
+            f,
+            delimiter="\t",
+            quotechar=None,
+            doublequote=False,
+            lineterminator="\n",
+            quoting=csv.QUOTE_NONE,
+        )
+        prob_idx = [dict(e) for e in reader]
+assert len(prob_idx) > 0
 
 
 dataset = SpeechToTextDatasetCreatorKD._from_list(
@@ -60,14 +67,32 @@ dataset = SpeechToTextDatasetCreatorKD._from_list(
     )
 
 
-with open(tsv_path) as f, open(tsv_path.replace(".tsv", "_filtered.tsv"), "w") as fw, \
-        open(teacher_path) as t, open(teacher_path.replace(".tsv", "_filtered.tsv"), "w") as tw:
-    lines = f.readlines()
-    fw.write(lines[0])
-    teach_lines = t.readlines()
-    tw.write(teach_lines[0])
-    for i in range(len(dataset)):
-        s = dataset[i]
-        if s[2].shape[0] - 1 == s[4].shape[0]:
-            fw.write(lines[i+1])
-            tw.write(teach_lines[i+1])
+def is_valid(i):
+    s = dataset[i]
+    return s[2].shape[0] - 1 == s[4].shape[0]
+
+
+if use_packed:
+    with open(tsv_path) as f, open(tsv_path.replace(".tsv", "_filtered.tsv"), "w") as fw, \
+            PackedTeacherOutputsBuilder(
+                packed_teacher_outputs.teacher_outputs_prefix(root, f"{split}_filtered"),
+                prob_idx.topk,
+                idx_dtype=prob_idx.idx_dtype,
+                score_dtype=prob_idx.score_dtype) as tw:
+        lines = f.readlines()
+        fw.write(lines[0])
+        for i in range(len(dataset)):
+            if is_valid(i):
+                fw.write(lines[i+1])
+                tw.add_item(*prob_idx.get(i))
+else:
+    with open(tsv_path) as f, open(tsv_path.replace(".tsv", "_filtered.tsv"), "w") as fw, \
+            open(teacher_path) as t, open(teacher_path.replace(".tsv", "_filtered.tsv"), "w") as tw:
+        lines = f.readlines()
+        fw.write(lines[0])
+        teach_lines = t.readlines()
+        tw.write(teach_lines[0])
+        for i in range(len(dataset)):
+            if is_valid(i):
+                fw.write(lines[i+1])
+                tw.write(teach_lines[i+1])
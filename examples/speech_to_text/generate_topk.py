@@ -1,18 +1,32 @@
 import logging
-import shutil
 import sys
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
 import torch
 
-from examples.speech_to_text.data_utils_new import create_zip, get_zip_manifest, save_df_to_tsv
+from examples.speech_to_text.data.packed_teacher_outputs import PackedTeacherOutputsBuilder, index_dtype, \
+    merge_shards, shard_prefix, teacher_outputs_prefix
 from fairseq import utils, options, tasks, progress_bar, checkpoint_utils
 
 logger = logging.getLogger("fairseq_cli.generate")
 
+
+def output_prefix(args):
+    """Prefix of the teacher outputs written by the current shard."""
+    prefix = teacher_outputs_prefix(Path(args.data).absolute().as_posix(), args.gen_subset)
+    if args.num_shards > 1:
+        prefix = shard_prefix(prefix, args.shard_id, args.num_shards)
+    return prefix
+
+
 def gen_outputs(args):
+    """
+    Writes the top-k indices and scores of the samples of the current shard into prob_idx_<gen-subset>.bin/.idx
+    (prob_idx_<gen-subset>.<shard-id>-of-<num-shards>.bin/.idx if sharded), as soon as each batch is generated.
+    The indices are stored as int16 (int32 if the vocabulary does not fit) and the scores as float16.
+    With --resume, the samples already written at the last checkpoint are skipped.
+    """
     use_cuda = torch.cuda.is_available() and not args.cpu
 
     # Load dataset splits
@@ -52,12 +66,19 @@ def gen_outputs(args):
         shard_id=args.shard_id,
     ).next_epoch_itr(shuffle=False)
 
-    outputs = [None for _ in range(len(dataset))]
-    with progress_bar.build_progress_bar(args, itr) as t:
-        for sample in t:
-            s = utils.move_to_cuda(sample) if use_cuda else sample
-            if 'net_input' not in s:
+    prefix = output_prefix(args)
+    builder = PackedTeacherOutputsBuilder(
+        prefix,
+        args.distill_topk,
+        idx_dtype=index_dtype(len(task.target_dictionary)),
+        score_dtype=np.float16,
+        num_samples=len(dataset),
+        resume=args.resume)
+    with builder, progress_bar.build_progress_bar(args, itr) as t:
+        for n_batch, sample in enumerate(t, start=1):
+            if 'net_input' not in sample or all(builder.has(id_s) for id_s in sample['id'].tolist()):
                 continue
+            s = utils.move_to_cuda(sample) if use_cuda else sample
             # We assume the target is already present and known
             assert s['target'] is not None
             targets = s['target']
@@ -67,54 +88,32 @@ def gen_outputs(args):
                 non_padding_mask = targets.ne(task.target_dictionary.pad()).cpu().numpy().astype(bool)
             topk_idx = topk_idx.cpu().numpy()
             topk_outs = topk_outs.cpu().numpy()
-            for i, id_s in enumerate(s['id'].data):
-                outputs[id_s] = [
-                    topk_idx[i, non_padding_mask[i]].tolist(),
-                    topk_outs[i, non_padding_mask[i]].tolist()]
-    return outputs
-
-
-def save_expert_outputs(args, expert_outputs):
-    logger.info("Start saving expert outputs..")
-    src_lang = args.source_lang
-    tgt_lang = args.target_lang
-    root = Path(args.data).absolute()
-
-    idx_root = root / "idx"
-    probs_root = root / "probs"
-    idx_root.mkdir(exist_ok=True)
-    probs_root.mkdir(exist_ok=True)
-    for n, o in enumerate(expert_outputs):
-        idx_out = idx_root / f"{str(n)}.npy"
-        prob_out = probs_root / f"{str(n)}.npy"
-        np.save(idx_out.as_posix(), np.asarray(o[0], dtype=np.int32))
-        np.save(prob_out.as_posix(), np.asarray(o[1], dtype=float))
-    idx_zip_path = root / f"idx_{args.gen_subset}.{src_lang}-{tgt_lang}.{tgt_lang}.zip"
-    create_zip(idx_root, idx_zip_path)
-    logger.info("Written {}".format(idx_root.as_posix()))
-    probs_zip_path = root / f"probs_{args.gen_subset}.{src_lang}-{tgt_lang}.{tgt_lang}.zip"
-    create_zip(probs_root, probs_zip_path)
-    logger.info("Written {}".format(probs_root.as_posix()))
-
-    MANIFEST_COLUMNS = ["idx", "probs"]
-    manifest = {c: [] for c in MANIFEST_COLUMNS}
-    idx_zip_manifest = get_zip_manifest(idx_zip_path)
-    prob_zip_manifest = get_zip_manifest(probs_zip_path)
-    for n, _ in enumerate(expert_outputs):
-        manifest["idx"].append(idx_zip_manifest[str(n)])
-        manifest["probs"].append(prob_zip_manifest[str(n)])
-    df = pd.DataFrame.from_dict(manifest)
-    save_df_to_tsv(df, root / f"prob_idx_{args.gen_subset}.tsv")
-
-    shutil.rmtree(probs_root)
-    shutil.rmtree(idx_root)
+            for i, id_s in enumerate(s['id'].tolist()):
+                if not builder.has(id_s):
+                    builder.add_item(topk_idx[i, non_padding_mask[i]], topk_outs[i, non_padding_mask[i]], index=id_s)
+            if n_batch % args.checkpoint_interval == 0:
+                builder.checkpoint()
+    logger.info("Written the outputs of {} samples to {}.bin".format(builder.num_written, prefix))
+
+
+def merge_outputs(args):
+    """Merges the teacher outputs written by the --num-shards shards into prob_idx_<gen-subset>.bin/.idx."""
+    prefix = teacher_outputs_prefix(Path(args.data).absolute().as_posix(), args.gen_subset)
+    merge_shards([shard_prefix(prefix, i, args.num_shards) for i in range(args.num_shards)], prefix)
+    logger.info("Merged {} shards into {}.bin".format(args.num_shards, prefix))
 
 
 if __name__ == '__main__':
     parser = options.get_generation_parser()
     parser.add_argument('--distill-topk', default=8, type=int)
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the generation interrupted after its last checkpoint')
+    parser.add_argument('--checkpoint-interval', default=100, type=int,
+                        help='number of batches after which the written outputs are checkpointed')
+    parser.add_argument('--merge-shards', action='store_true',
+                        help='merge the outputs generated by the --num-shards shards instead of generating them')
     args = options.parse_args_and_arch(parser)
-    assert args.path is not None, '--path required for generation'
+    assert args.merge_shards or args.path is not None, '--path required for generation'
     assert not args.sampling or args.nbest == args.beam, \
         '--sampling requires --nbest to be equal to --beam'
     assert args.replace_unk is None or args.raw_text, \
@@ -129,5 +128,7 @@ if __name__ == '__main__':
         stream=sys.stdout,
     )
     logger.info(args)
-    expert_outputs = gen_outputs(args)
-    save_expert_outputs(args, expert_outputs)
\ No newline at end of file
+    if args.merge_shards:
+        merge_outputs(args)
+    else:
+        gen_outputs(args)
\ No newline at end of file
@@ -0,0 +1,213 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import math
+from typing import Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+from examples.speech_to_text.modules.triangle_transformer_layer import TriangleTransformerDecoderLayer
+from examples.speech_to_text.twophase_sequence_generator import TwoPhaseSequenceGenerator
+from fairseq.models.fairseq_encoder import EncoderOut
+
+
+class AuxiliaryDecoderState(object):
+    """
+    The transcripts that the auxiliary decoder has generated greedily so far,
+    one for each sentence of the batch.
+    """
+    def __init__(self, encoder_outs: List[EncoderOut], tokens: Tensor, max_len: int, num_models: int):
+        self.encoder_outs = encoder_outs
+        self.incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]] = [{} for _ in range(num_models)]
+        # bsz x (max_len + 2), starting with the BOS and padded after the EOS
+        self.tokens = tokens
+        self.tags: Optional[Tensor] = None
+        # bsz x (max_len + 1) x C, allocated at the first step in the type of the decoder outputs
+        self.outputs: Optional[Tensor] = None
+        self.scores = torch.zeros(tokens.size(0), device=tokens.device)
+        # length of each transcript including the EOS, 0 while it is being generated
+        self.lengths = torch.zeros(tokens.size(0), dtype=torch.long, device=tokens.device)
+        self.max_len = max_len
+        # number of decoding steps done so far
+        self.step = 0
+        self.finished = False
+
+
+class JointSequenceGenerator(TwoPhaseSequenceGenerator):
+    """
+    Generates transcripts and translations of a given source audio in a single
+    pass, interleaving the steps of the auxiliary and of the target decoder.
+
+    Instead of waiting for the beam search of the transcripts to be over, as
+    :class:`TwoPhaseSequenceGenerator` does, the transcript is generated
+    greedily and kept *aux_lookahead* steps ahead of the beam search of the
+    translation, which attends to the part of the transcript generated so far.
+    Lower values of *aux_lookahead* start the translation earlier at the cost
+    of conditioning its first tokens on shorter transcript prefixes: with an
+    *aux_lookahead* not lower than the length of the transcripts, the
+    translation is the same as the one of the two-phase generation over the
+    greedy transcript.
+    """
+    def __init__(self, models, src_dict, tgt_dict, aux_lookahead=1, **kwargs):
+        super().__init__(models, src_dict, tgt_dict, **kwargs)
+        assert aux_lookahead >= 1, "the auxiliary decoder has to be at least one step ahead"
+        assert not self.match_source_len, "the length of the transcript is not known in advance"
+        self.aux_lookahead = aux_lookahead
+
+    def _generate(
+            self,
+            sample: Dict[str, Dict[str, Tensor]],
+            prefix_tokens: Optional[Tensor] = None,
+            constraints: Optional[Tensor] = None,
+            bos_token: Optional[int] = None,
+    ):
+        net_input = sample["net_input"]
+        src_tokens = net_input["src_tokens"]
+        bsz, src_len = src_tokens.size()[:2]
+        beam_size = self.beam_size
+        # the length of the transcript is not known when the translation starts,
+        # so the maximum length of both is computed from the source audio
+        max_len = min(
+            int(self.max_len_a * src_len + self.max_len_b),
+            # exclude the EOS marker
+            self.model.max_decoder_positions() - 1,
+        )
+        encoder_outs = self.model.forward_encoder(net_input)
+
+        aux_tokens = torch.full(
+            (bsz, max_len + 2), self.src_pad, dtype=torch.long, device=src_tokens.device)
+        aux_tokens[:, 0] = self.src_eos if bos_token is None else bos_token
+        aux_state = AuxiliaryDecoderState(encoder_outs, aux_tokens, max_len, self.model.models_size)
+        while not aux_state.finished and aux_state.step < self.aux_lookahead:
+            self._aux_step(aux_state)
+
+        new_order = torch.arange(bsz).view(-1, 1).repeat(1, beam_size).view(-1)
+        new_order = new_order.to(src_tokens.device).long()
+        encoder_outs = self.model.reorder_encoder_out(encoder_outs, new_order)
+        # all the beams of a sentence attend to the same transcript,
+        # so only the first one is expanded at the first step
+        prev_scores = torch.zeros(bsz, beam_size, 1, device=src_tokens.device)
+        prev_scores[:, 1:] = -math.inf
+        src_tokens, src_tags, auxiliary_outputs = self._auxiliary_inputs(aux_state, list(range(bsz)), beam_size)
+        finalized = self._search_tgt(
+            src_tokens, src_tags, auxiliary_outputs, prev_scores, encoder_outs, max_len,
+            prefix_tokens=prefix_tokens, bos_token=bos_token, aux_state=aux_state)
+
+        # the translations can be over before the transcripts
+        while not aux_state.finished:
+            self._aux_step(aux_state)
+        aux_scores = aux_state.scores
+        if self.normalize_scores:
+            aux_scores = aux_scores / aux_state.lengths.float() ** self.len_penalty
+        for sent in range(len(finalized)):
+            aux_length = aux_state.lengths[sent]
+            for hypo in finalized[sent]:
+                hypo["aux_tokens"] = aux_state.tokens[sent, 1: aux_length + 1]
+                if aux_state.tags is not None:
+                    hypo["aux_tags"] = aux_state.tags[sent, 1: aux_length + 1]
+                # as in the two-phase generation, the score of the transcript
+                # is added to the first step of the translation
+                hypo["positional_scores"][0] += aux_scores[sent]
+                if self.normalize_scores:
+                    hypo["score"] = hypo["score"] + aux_scores[sent] / len(hypo["tokens"]) ** self.len_penalty
+                else:
+                    hypo["score"] = hypo["score"] + aux_scores[sent]
+            finalized[sent].sort(key=lambda h: h["score"].item(), reverse=True)
+        return finalized
+
+    def _aux_step(self, aux_state: AuxiliaryDecoderState):
+        """Generates the next token of the transcripts greedily."""
+        step = aux_state.step
+        lprobs, aux_out, _, aux_tags_lprobs = self.model.forward_auxiliary_decoder(
+            aux_state.tokens[:, : step + 1],
+            aux_state.encoder_outs,
+            aux_state.incremental_states,
+            aux_state.tags[:, : step + 1] if aux_state.tags is not None else None,
+            self.temperature
+        )
+        if aux_state.outputs is None:
+            aux_state.outputs = aux_out.new_zeros(
+                aux_state.tokens.size(0), aux_state.max_len + 1, aux_out.shape[-1])
+            if aux_tags_lprobs is not None:
+                aux_state.tags = torch.zeros_like(aux_state.tokens)
+        aux_state.outputs[:, step] = aux_out.squeeze(1)
+        lprobs[lprobs != lprobs] = torch.tensor(-math.inf).to(lprobs)
+        lprobs[:, self.src_pad] = -math.inf  # never select pad
+        lprobs[:, self.src_unk] -= self.unk_penalty  # apply unk penalty
+        if step >= aux_state.max_len:
+            lprobs[:, : self.src_eos] = -math.inf
+            lprobs[:, self.src_eos + 1:] = -math.inf
+        elif step < self.min_len:
+            lprobs[:, self.src_eos] = -math.inf
+        if self.no_repeat_ngram_size > 0:
+            lprobs = self._no_repeat_ngram(aux_state.tokens, lprobs, aux_state.tokens.size(0), 1, step)
+
+        next_scores, next_tokens = lprobs.max(dim=-1)
+        unfinished = aux_state.lengths.eq(0)
+        aux_state.tokens[:, step + 1] = next_tokens.masked_fill(~unfinished, self.src_pad)
+        aux_state.scores += next_scores.masked_fill(~unfinished, 0.0).to(aux_state.scores)
+        aux_state.lengths.masked_fill_(unfinished & next_tokens.eq(self.src_eos), step + 1)
+        if aux_state.tags is not None:
+            aux_state.tags[:, step + 1] = torch.argmax(aux_tags_lprobs, dim=-1)
+        aux_state.step += 1
+        aux_state.finished = bool(aux_state.lengths.ne(0).all())
+
+    def _auxiliary_inputs(self, aux_state: AuxiliaryDecoderState, sents: List[int], beam_size: int):
+        """Returns the transcripts generated so far for each beam of *sents*,
+        with their tags and auxiliary decoder outputs."""
+        beam_sents = torch.tensor(sents, device=aux_state.tokens.device).repeat_interleave(beam_size)
+        src_tokens = aux_state.tokens[:, 1: aux_state.step + 1].index_select(0, beam_sents)
+        src_tags = None
+        if aux_state.tags is not None:
+            src_tags = aux_state.tags[:, 1: aux_state.step + 1].index_select(0, beam_sents)
+        auxiliary_outputs = aux_state.outputs[:, : aux_state.step].index_select(0, beam_sents)
+        return src_tokens, src_tags, auxiliary_outputs
+
+    def _update_auxiliary_inputs(
+        self,
+        step: int,
+        aux_state: AuxiliaryDecoderState,
+        finished: List[bool],
+        beam_size: int,
+        src_tokens: Tensor,
+        src_tags: Optional[Tensor],
+        auxiliary_outputs: Tensor,
+        incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]],
+    ):
+        """Advances the transcripts up to *aux_lookahead* steps ahead of the
+        translation, so that the target decoder attends also to the new
+        auxiliary outputs. With incremental decoding, only the key/value
+        projections of the new outputs are computed and appended to the cached
+        ones, so the inputs are returned unchanged: the transcripts of the
+        final hypotheses are set when the generation is over."""
+        aux_step = aux_state.step
+        while not aux_state.finished and aux_state.step < step + self.aux_lookahead:
+            self._aux_step(aux_state)
+        if aux_state.step == aux_step:
+            return src_tokens, src_tags, auxiliary_outputs
+        # the translations that are over have been removed from the batch
+        sents = [i for i, f in enumerate(finished) if not f]
+        if not self.model.has_incremental_states():
+            return self._auxiliary_inputs(aux_state, sents, beam_size)
+        # beams are reordered only within the same sentence, which attend to the same transcript
+        beam_sents = torch.tensor(sents, device=aux_state.tokens.device).repeat_interleave(beam_size)
+        new_outputs = aux_state.outputs[:, aux_step: aux_state.step].index_select(0, beam_sents)
+        new_padding_mask = aux_state.tokens[:, aux_step + 1: aux_state.step + 1].index_select(
+            0, beam_sents).eq(self.src_pad)
+        for i, model in enumerate(self.model.models):
+            for layer in model.decoder.layers:
+                if isinstance(layer, TriangleTransformerDecoderLayer):
+                    layer.extend_aux_decoder_state(
+                        incremental_states[i], new_outputs.transpose(0, 1), new_padding_mask)
+        return src_tokens, src_tags, auxiliary_outputs
@@ -24,6 +24,7 @@ from examples.speech_to_text.models.s2t_transformer_fbk import base_architecture
 from examples.speech_to_text.modules.conformer_encoder_layer import ConformerEncoderLayer
 from examples.speech_to_text.modules.ctc_support import CtcSupport
 from examples.speech_to_text.modules.encoder_pretraining_support import EncoderPretrainingSupport
+from examples.speech_to_text.modules.encoder_streaming_support import EncoderStreamingSupport
 from fairseq.data.data_utils import lengths_to_padding_mask
 from fairseq.models import (
     register_model,
@@ -91,7 +92,7 @@ class ConformerModel(S2TTransformerModel):
         return encoder
 
 
-class ConformerEncoder(FairseqEncoder, CtcSupport):
+class ConformerEncoder(FairseqEncoder, CtcSupport, EncoderStreamingSupport):
 
     def __init__(self, args, dictionary):
         super().__init__(dictionary)
@@ -125,7 +126,8 @@ class ConformerEncoder(FairseqEncoder, CtcSupport):
         return self.forward(**encoder_input)
 
     def forward(self, src_tokens, src_lengths, return_all_hiddens: bool = False, **kwargs):
-        x, input_lengths = self.subsample(src_tokens, src_lengths)
+        x, input_lengths = self.forward_frontend(
+            self.subsample, src_tokens, src_lengths, kwargs.get("streaming_state", None))
         x = self.embed_scale * x
 
         encoder_padding_mask = lengths_to_padding_mask(input_lengths)
@@ -122,6 +122,10 @@ class S2TTransformerModelConv2d(FairseqEncoderDecoderModel):
                             help='Add distance penalty to the encoder')
         parser.add_argument('--init-variance', type=float, default=1.0,
                             help='Initialization value for variance')
+        parser.add_argument('--apply-distance-penalty', action='store_true', default=False,
+                            help='If set, the distance penalty is applied also when the fused PyTorch attention '
+                                 'is used, i.e. in the encoder self-attention. Models trained without this flag '
+                                 'have been trained without the penalty, so it is disabled by default.')
         parser.add_argument("--input-feat-per-channel", type=int, default=80,
             metavar="N", help="encoder input dimension per input channel")
         parser.add_argument('--ctc-compress-strategy', type=str, default="none",
@@ -468,6 +472,7 @@ def base_architecture(args):
     args.quant_noise_pq = getattr(args, "quant_noise_pq", 0)
 
     args.distance_penalty = getattr(args, 'distance_penalty', False)
+    args.apply_distance_penalty = getattr(args, 'apply_distance_penalty', False)
     args.normalization_constant = getattr(args, 'normalization_constant', 0.5)
     args.layernorm_embedding = getattr(args, "layernorm_embedding", False)
 
@@ -168,6 +168,10 @@ class S2TTransformerModel(FairseqEncoderDecoderModel):
                             help='Add distance penalty to the encoder')
         parser.add_argument('--init-variance', type=float, default=0.0, required=False,
                             help='Initial variance for Gaussian distance penalty')
+        parser.add_argument('--apply-distance-penalty', action='store_true', default=False,
+                            help='If set, the distance penalty is applied also when the fused PyTorch attention '
+                                 'is used, i.e. in the encoder self-attention. Models trained without this flag '
+                                 'have been trained without the penalty, so it is disabled by default.')
 
     @classmethod
     def build_encoder(cls, args, dictionary):
@@ -395,6 +399,7 @@ def base_architecture(args):
 
     args.distance_penalty = getattr(args, 'distance_penalty', False)
     args.init_variance = getattr(args, 'init_variance', 0.0)
+    args.apply_distance_penalty = getattr(args, 'apply_distance_penalty', False)
 
 
 @register_model_architecture("s2t_transformer_fbk", "s2t_transformer_s_fbk")
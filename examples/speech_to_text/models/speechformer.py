@@ -26,6 +26,7 @@ from examples.speech_to_text.models.s2t_transformer_fbk import S2TTransformerMod
 from examples.speech_to_text.modules.conformer_encoder_layer import ConformerEncoderLayer
 from examples.speech_to_text.modules.ctc_support import CtcSupport
 from examples.speech_to_text.modules.encoder_pretraining_support import EncoderPretrainingSupport
+from examples.speech_to_text.modules.encoder_streaming_support import EncoderStreamingSupport
 from examples.speech_to_text.modules.speechformer_encoder_layer import SpeechformerEncoderLayer
 from fairseq.data.data_utils import lengths_to_padding_mask
 from fairseq.models import (
@@ -192,7 +193,7 @@ class SpeechformerModel(FairseqEncoderDecoderModel):
             return decoder_out
 
 
-class SpeechformerEncoder(FairseqEncoder, CtcSupport):
+class SpeechformerEncoder(FairseqEncoder, CtcSupport, EncoderStreamingSupport):
     """Speechformer encoder
     It consists of:
         - if --CNN-first-layer parameter is enabled, a block of 2 1D Convolutional layers is
@@ -284,7 +285,8 @@ class SpeechformerEncoder(FairseqEncoder, CtcSupport):
 
     def forward(self, src_tokens, src_lengths, return_all_hiddens: bool = False, **kwargs):
         if self.CNN_first_layer:
-            x, input_lengths = self.CNNblock(src_tokens, src_lengths)
+            x, input_lengths = self.forward_frontend(
+                self.CNNblock, src_tokens, src_lengths, kwargs.get("streaming_state", None))
         else:
             x = self.linear_layer(src_tokens)
             input_lengths = src_lengths
@@ -116,13 +116,17 @@ class RelativeMultiHeadAttention(nn.Module):
             value: Tensor,
             pos_embedding: Tensor,
             mask: Optional[Tensor] = None,
+            pos_embedding_projected: bool = False,
     ) -> Tensor:
         batch_size = value.size(0)
 
         query = self.query_proj(query).view(batch_size, -1, self.num_heads, self.d_head)
         key = self.key_proj(key).view(batch_size, -1, self.num_heads, self.d_head).permute(0, 2, 1, 3)
         value = self.value_proj(value).view(batch_size, -1, self.num_heads, self.d_head).permute(0, 2, 1, 3)
-        pos_embedding = self.pos_proj(pos_embedding).view(batch_size, -1, self.num_heads, self.d_head)
+        if not pos_embedding_projected:
+            pos_embedding = self.pos_proj(pos_embedding)
+        # the projected positional embeddings can be shared (batch 1) among all the elements of the batch
+        pos_embedding = pos_embedding.view(pos_embedding.size(0), -1, self.num_heads, self.d_head)
 
         # Attention weights computation using Q + u as in Transformer-XL
         content_score = torch.matmul((query + self.u_bias).transpose(1, 2), key.transpose(2, 3))
@@ -170,6 +174,9 @@ class MultiHeadedSelfAttentionModule(nn.Module):
         num_heads (int): The number of attention heads.
         dropout_p (float): probability of dropout
 
+    At inference (see :func:`make_generation_fast_`), the projections of the positional encodings, which depend
+    only on the length of the input, are cached and extended by multiples of *pos_proj_cache_bucket* positions.
+
     Inputs: inputs, mask
         x (batch, time, dim): Tensor containing input vector
         mask (batch, 1, time2) or (batch, time1, time2): Tensor containing indices to be masked
@@ -183,13 +190,38 @@ class MultiHeadedSelfAttentionModule(nn.Module):
         self.layer_norm = nn.LayerNorm(d_model)
         self.attention = RelativeMultiHeadAttention(d_model, num_heads, dropout_p)
         self.dropout = FairseqDropout(p=dropout_p, module_name=self.__class__.__name__)
+        # disabled (0) while training
+        self.pos_proj_cache_bucket = 0
+        self.pos_proj_cache: Optional[Tensor] = None
+
+    def make_generation_fast_(self, pos_proj_cache_bucket: int = 64, **kwargs):
+        self.pos_proj_cache_bucket = pos_proj_cache_bucket
+        self.pos_proj_cache = None
+
+    def projected_positional_encoding(self, length: int) -> Tensor:
+        """
+        Returns the projection of the positional encodings of the first *length* positions, (1, length, dim).
+        As the projection is applied independently to each position, the cached projection of a longer
+        sequence is sliced, so it is recomputed only when a sequence longer than all the previous ones is met.
+        """
+        weight = self.attention.pos_proj.weight
+        if self.pos_proj_cache is None or self.pos_proj_cache.size(1) < length \
+                or self.pos_proj_cache.device != weight.device or self.pos_proj_cache.dtype != weight.dtype:
+            cached_length = math.ceil(length / self.pos_proj_cache_bucket) * self.pos_proj_cache_bucket
+            cached_length = min(cached_length, self.positional_encoding.pe.size(1))
+            with torch.no_grad():
+                self.pos_proj_cache = self.attention.pos_proj(self.positional_encoding(cached_length).to(weight))
+        return self.pos_proj_cache[:, :length]
 
     def forward(self, x: Tensor, mask: Optional[Tensor] = None):
         batch_size, seq_length, _ = x.size()
-        pos_embedding = self.positional_encoding(seq_length)
-        pos_embedding = pos_embedding.repeat(batch_size, 1, 1)
-
         x = self.layer_norm(x)
-        outputs = self.attention(x, x, x, pos_embedding=pos_embedding, mask=mask)
+        if self.pos_proj_cache_bucket > 0 and not self.training:
+            pos_embedding = self.projected_positional_encoding(seq_length)
+            outputs = self.attention(x, x, x, pos_embedding=pos_embedding, mask=mask, pos_embedding_projected=True)
+        else:
+            pos_embedding = self.positional_encoding(seq_length)
+            pos_embedding = pos_embedding.repeat(batch_size, 1, 1)
+            outputs = self.attention(x, x, x, pos_embedding=pos_embedding, mask=mask)
 
         return self.dropout(outputs)
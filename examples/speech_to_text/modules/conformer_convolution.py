@@ -15,6 +15,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License
 
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor
@@ -90,3 +91,35 @@ class ConformerConvModule(nn.Module):
         x = self.second_pointwise_conv1d(x)
         x = self.dropout_module(x)
         return x.transpose(1, 2)
+
+    def make_generation_fast_(self, **kwargs):
+        """
+        At inference, the batch normalization is a fixed affine transformation
+        of each channel, which is folded into the weights and the bias of the
+        depthwise convolution. The (Sync)BatchNorm is then replaced by an identity,
+        so that no synchronization nor normalization is done on the frames.
+        """
+        if isinstance(self.batchnorm, nn.Identity) or not self.batchnorm.track_running_stats:
+            return
+        weight = self.depthwise_conv1d.weight
+        with torch.no_grad():
+            # the folding is computed in float32 also for fp16 models
+            scale = (self.batchnorm.running_var.float() + self.batchnorm.eps).rsqrt()
+            if self.batchnorm.affine:
+                scale = scale * self.batchnorm.weight.float()
+            bias = -self.batchnorm.running_mean.float() * scale
+            if self.batchnorm.affine:
+                bias = bias + self.batchnorm.bias.float()
+            folded_conv1d = nn.Conv1d(
+                in_channels=self.depthwise_conv1d.in_channels,
+                out_channels=self.depthwise_conv1d.out_channels,
+                kernel_size=self.depthwise_conv1d.kernel_size,
+                stride=self.depthwise_conv1d.stride,
+                groups=self.depthwise_conv1d.groups,
+                padding=self.depthwise_conv1d.padding,
+                bias=True,
+            ).to(device=weight.device, dtype=weight.dtype)
+            folded_conv1d.weight.copy_(weight.float() * scale.view(-1, 1, 1))
+            folded_conv1d.bias.copy_(bias)
+        self.depthwise_conv1d = folded_conv1d
+        self.batchnorm = nn.Identity()
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License
 import math
-from itertools import groupby
+from typing import NamedTuple
 
 import torch
 from torch import nn
@@ -39,8 +39,12 @@ class CtcSupport:
             "--ctc-compress-strategy",
             type=str,
             default="none",
-            choices=['none', 'avg', 'weighted', 'softmax', 'fixed'],
-            help="Strategy to use when compressing CTC output"
+            choices=['none', 'avg', 'weighted', 'softmax', 'fixed',
+                     'avg_pool', 'weighted_pool', 'softmax_pool', 'fixed_pool'],
+            help="Strategy to use when compressing CTC output. With the *_pool variants, the "
+                 "vectors of each segment are pooled directly (instead of multiplying the input "
+                 "by a dense B x T x T' matrix) and the gradient flows also through the weights "
+                 "of the weighted and softmax strategies"
         )
         parser.add_argument(
             "--ctc-compress-fixed-ratio",
@@ -67,12 +71,18 @@ class CtcSupport:
             self.ctc_fc = nn.Linear(args.encoder_embed_dim, len(src_dictionary))
             self.ctc_layer = args.ctc_encoder_layer
             if args.ctc_compress_strategy != "none":
-                self.ctc_compress_method = getattr(CTCCompressStrategy, args.ctc_compress_strategy)
+                self.set_ctc_compress_strategy(args.ctc_compress_strategy)
                 self.ctc_compress_max_out_size = args.ctc_compress_max_out_size
                 CtcSupport.FIXED_RATIO = args.ctc_compress_fixed_ratio
             else:
                 self.ctc_compress_method = "none"
 
+    def set_ctc_compress_strategy(self, strategy):
+        self.ctc_compress_pooling = strategy.endswith("_pool")
+        if self.ctc_compress_pooling:
+            strategy = strategy[:-len("_pool")]
+        self.ctc_compress_method = getattr(CTCCompressStrategy, strategy)
+
     def apply_ctc(self, x, input_lengths):
         x_ctc = self.ctc_fc(x)
         if self.ctc_compress_method != "none":
@@ -87,64 +97,101 @@ class CtcSupport:
         return encoder_out_dict
 
     def average_same_ctc_features(self, x_ctc, x, src_lengths):
-        with torch.no_grad():
-            batch_predicted = []
+        pooling = getattr(self, "ctc_compress_pooling", False)
+        # when pooling, the gradient flows also through the weights computed from the CTC probabilities
+        with torch.set_grad_enabled(pooling and torch.is_grad_enabled()):
             prob_ctc = F.softmax(x_ctc, dim=-1).transpose(0, 1)  # from T x B x D to B x T x D
-            for b in range(prob_ctc.shape[0]):
-                predicted = prob_ctc[b][: src_lengths[b]].argmax(-1).tolist()
-                batch_predicted.append([(p[0], len(list(p[1]))) for p in groupby(predicted)])
-            batch_predicted = self.ensure_max_ctc_out_len(batch_predicted)
-            weights_matrix, new_lengths = self.ctc_compress_method(
-                prob_ctc, batch_predicted, x.dtype, x.device)
+            with torch.no_grad():
+                segments = self.ctc_segments(prob_ctc.argmax(-1), src_lengths)
+            weights, segments, num_segments = self.ctc_compress_method(prob_ctc, segments)
+            weights = weights.masked_fill(~segments.mask, 0.0).to(x.dtype)
+        if pooling:
+            return self.segment_pooling(x, weights, segments, num_segments), segments.lengths
+        weights_matrix = CTCCompressStrategy.weights_to_matrix(weights, segments, num_segments)
         # x is T x B x C -> B x C x T; weights_matrix is B x T x T'
         compressed_output = x.permute(1, 2, 0).bmm(weights_matrix)  # B x C x T'
-        return compressed_output.permute(2, 0, 1), src_lengths.new(new_lengths)
+        return compressed_output.permute(2, 0, 1), segments.lengths
 
-    def ensure_max_ctc_out_len(self, batch_predicted):
+    @staticmethod
+    def segment_pooling(x, weights, segments, num_segments):
         """
-        Ensures that the output of the CTC compression is not longer than the ctc_compress_max_out_size.
-        If there are samples violating this constraints, consecutive predictions are merged
-        so to shorten the sentence.
-        E.g. if the ctc_compress_max_out_size is set to 3, and the output of the CTC compression would be
-        long 5, the first and second predictions are merged, as well as the third and the fourth. So, the
-        corresponding vectors will be merged according to the CTC compression strategy.
+        Returns the sum of the vectors of *x* (T x B x C) of each segment weighted by
+        the *weights* (B x T), i.e. the T' x B x C output of the compression, without building
+        the B x T x T' weights matrix.
+        """
+        max_len, batch_size, embed_dim = x.shape
+        # index of each time step in the T' x B output
+        output_idx = segments.segment_ids.t() * batch_size + torch.arange(batch_size, device=x.device)
+        compressed_output = x.new_zeros((num_segments * batch_size, embed_dim)).index_add(
+            0, output_idx.reshape(-1), (x * weights.t().unsqueeze(-1)).reshape(max_len * batch_size, embed_dim))
+        return compressed_output.view(num_segments, batch_size, embed_dim)
+
+    def ctc_segments(self, predicted, src_lengths):
         """
+        Returns the :py:class:`CTCSegments` obtained grouping the consecutive time steps
+        with the same CTC prediction (*predicted* is B x T). If a sample has more segments
+        than ctc_compress_max_out_size, groups of ceil(num_segments / ctc_compress_max_out_size)
+        consecutive segments are merged, and each merged segment takes the label that covers
+        most time steps (the first in case of a tie).
+        """
+        batch_size, max_len = predicted.shape
+        padding_mask = torch.arange(max_len, device=predicted.device).unsqueeze(0) >= src_lengths.unsqueeze(1)
+        # a run of equal predictions starts where the prediction changes
+        run_starts = torch.ones_like(padding_mask)
+        run_starts[:, 1:] = predicted[:, 1:] != predicted[:, :-1]
+        run_starts &= ~padding_mask
+        run_ids = run_starts.long().cumsum(dim=1) - 1
+        num_runs = run_starts.long().sum(dim=1)
         if self.ctc_compress_max_out_size > 0:
+            reduction_factor = ((num_runs + self.ctc_compress_max_out_size - 1) //
+                                self.ctc_compress_max_out_size).clamp(min=1)
+        else:
+            reduction_factor = torch.ones_like(num_runs)
+        segment_ids = (run_ids.clamp(min=0) // reduction_factor.unsqueeze(1)).masked_fill(padding_mask, 0)
+        new_lengths = (num_runs + reduction_factor - 1) // reduction_factor
+        new_max_len = int(new_lengths.max())
+        batch_idx, run_start_idx = run_starts.nonzero(as_tuple=True)
+        run_predictions = predicted[batch_idx, run_start_idx]
+        if int(reduction_factor.max()) == 1:
+            labels = predicted.new_zeros((batch_size, new_max_len))
+            labels[batch_idx, run_ids[batch_idx, run_start_idx]] = run_predictions
+        else:
+            run_lengths = predicted.new_zeros((batch_size, max_len)).scatter_add_(
+                1, run_ids.clamp(min=0), (~padding_mask).long())[batch_idx, run_ids[batch_idx, run_start_idx]]
+            labels = CtcSupport._merged_segment_labels(
+                batch_idx, segment_ids[batch_idx, run_start_idx], run_predictions, run_lengths,
+                batch_size, max_len, new_max_len)
+        return CTCSegments(segment_ids, ~padding_mask, labels, new_lengths)
 
-            def merge_sublist(elements):
-                """
-                Takes a list of Tuples (predicted_element, num_corresponding_vectors) and returns
-                a single tuple with the predicted_element having the highest number of corresponding_vectors
-                (in case of a tie, the first is returned) and the total sum of the num_corresponding_vectors
-                E.g. if the input is [(a, 3), (b, 5), (c, 6), (a, 4)], the output will be (a, 18).
-                """
-                sum_num_vectors = 0
-                max_element = None
-                max_element_cnt = 0
-                temp_dict = {}
-                for predicted_element, num_corresponding_vectors in elements:
-                    if predicted_element in temp_dict:
-                        temp_dict[predicted_element] += num_corresponding_vectors
-                    else:
-                        temp_dict[predicted_element] = num_corresponding_vectors
-                    if temp_dict[predicted_element] > max_element_cnt:
-                        max_element_cnt = temp_dict[predicted_element]
-                        max_element = predicted_element
-                    sum_num_vectors += num_corresponding_vectors
-                return max_element, sum_num_vectors
-
-            for b_idx, p in enumerate(batch_predicted):
-                pred_len = len(p)
-                if pred_len > self.ctc_compress_max_out_size:
-                    reduction_factor = math.ceil(pred_len / self.ctc_compress_max_out_size)
-                    i = 0
-                    new_p = []
-                    while i < pred_len:
-                        new_p.append(merge_sublist(p[i:i + reduction_factor]))
-                        i += reduction_factor
-                    batch_predicted[b_idx] = new_p
-
-        return batch_predicted
+    @staticmethod
+    def _merged_segment_labels(batch_idx, segment_idx, run_predictions, run_lengths, batch_size, max_len, new_max_len):
+        """
+        Returns the prediction of each segment made of several runs, i.e. the prediction
+        with the highest number of time steps in the segment. In case of a tie, the prediction
+        that first reaches that number of time steps (i.e. whose last run comes first) is returned.
+        """
+        num_runs = run_predictions.shape[0]
+        vocab_size = int(run_predictions.max()) + 1
+        segment_global_idx = batch_idx * max_len + segment_idx
+        run_idx = torch.arange(num_runs, device=run_predictions.device)
+        # the number of time steps of each prediction in each segment
+        _, segment_pred_ids = torch.unique(segment_global_idx * vocab_size + run_predictions, return_inverse=True)
+        pred_lengths = run_lengths.new_zeros(num_runs).scatter_add_(0, segment_pred_ids, run_lengths)[segment_pred_ids]
+        # the last run of each prediction in each segment
+        sorted_runs = torch.sort(segment_pred_ids * num_runs + run_idx)[1]
+        is_last = torch.ones(num_runs, dtype=torch.bool, device=run_predictions.device)
+        is_last[sorted_runs[:-1]] = segment_pred_ids[sorted_runs[:-1]] != segment_pred_ids[sorted_runs[1:]]
+        # the best run of a segment has the highest length and then the lowest index
+        score = pred_lengths * num_runs + (num_runs - 1 - run_idx)
+        score_range = (int(pred_lengths.max()) + 1) * num_runs
+        candidates = is_last.nonzero(as_tuple=True)[0]
+        sorted_candidates = candidates[torch.sort(segment_global_idx[candidates] * score_range + score[candidates])[1]]
+        is_best = torch.ones_like(sorted_candidates, dtype=torch.bool)
+        is_best[:-1] = segment_global_idx[sorted_candidates[:-1]] != segment_global_idx[sorted_candidates[1:]]
+        best_runs = sorted_candidates[is_best]
+        labels = run_predictions.new_zeros((batch_size, new_max_len))
+        labels[batch_idx[best_runs], segment_idx[best_runs]] = run_predictions[best_runs]
+        return labels
 
     def reorder_ctc(self, reordered_dict, encoder_out, new_order):
         if self.ctc_flag:
@@ -155,73 +202,83 @@ class CtcSupport:
         return reordered_dict
 
 
+class CTCSegments(NamedTuple):
+    """
+    The segments of consecutive time steps that are compressed into a single vector.
+    """
+    segment_ids: torch.Tensor  # B x T: the index of the segment of each time step (0 for padding)
+    mask: torch.Tensor  # B x T: True for the non-padding time steps
+    labels: torch.Tensor  # B x T': the CTC prediction of each segment
+    lengths: torch.Tensor  # B: the number of segments of each sample
+
+
 class CTCCompressStrategy:
+    """
+    Each strategy returns the weight (B x T) of each time step in the vector of its segment,
+    together with the (possibly redefined) :py:class:`CTCSegments` and the number of output vectors.
+    """
     @staticmethod
-    def new_lengths(batch_predicted):
-        return [len(p) for p in batch_predicted]
+    def segment_sum(values, segments, num_segments):
+        """
+        Returns the sum of the *values* (B x T) of the time steps of each segment (B x T').
+        """
+        return values.new_zeros((values.shape[0], num_segments)).scatter_add(
+            1, segments.segment_ids, values.masked_fill(~segments.mask, 0.0))
+
+    @staticmethod
+    def normalize(weights, segments, num_segments):
+        """
+        Normalizes the *weights* (B x T) so that they sum to 1 in each segment.
+        """
+        return weights / CTCCompressStrategy.segment_sum(weights, segments, num_segments).gather(
+            1, segments.segment_ids)
+
+    @staticmethod
+    def weights_to_matrix(weights, segments, num_segments):
+        """
+        Returns the B x T x T' matrix that contains the *weights* (B x T) of each time step
+        in the column of its segment.
+        """
+        weights_matrix = weights.new_zeros((weights.shape[0], weights.shape[1], num_segments))
+        return weights_matrix.scatter_(
+            2, segments.segment_ids.unsqueeze(-1), weights.masked_fill(~segments.mask, 0.0).unsqueeze(-1))
+
+    @staticmethod
+    def prediction_probs(prob_ctc, segments):
+        """
+        Returns the probability (B x T) of the prediction of its segment for each time step.
+        """
+        labels = segments.labels.gather(1, segments.segment_ids)
+        return prob_ctc.gather(2, labels.unsqueeze(-1)).squeeze(-1)
 
     @staticmethod
-    def avg(prob_ctc, predicted, dtype, device):
-        new_lengths = CTCCompressStrategy.new_lengths(predicted)
-        new_maxlen = max(new_lengths)
-        weights_matrix = torch.zeros((prob_ctc.shape[0], prob_ctc.shape[1], new_maxlen), dtype=dtype)
-        for b_idx, pred in enumerate(predicted):
-            processed_inputs_cnt = 0
-            for t_idx, same in enumerate(pred):
-                new_processed_inputs_cnt = processed_inputs_cnt + same[1]
-                weights_matrix[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, t_idx] = 1.0 / same[1]
-                processed_inputs_cnt = new_processed_inputs_cnt
-        return weights_matrix.to(device), new_lengths
+    def avg(prob_ctc, segments):
+        new_maxlen = int(segments.lengths.max())
+        weights = CTCCompressStrategy.normalize(segments.mask.to(prob_ctc.dtype), segments, new_maxlen)
+        return weights, segments, new_maxlen
 
     @staticmethod
-    def weighted(prob_ctc, predicted, dtype, device):
-        new_lengths = CTCCompressStrategy.new_lengths(predicted)
-        new_maxlen = max(new_lengths)
-        weights_matrix = torch.zeros((prob_ctc.shape[0], prob_ctc.shape[1], new_maxlen), dtype=dtype, device=device)
-        for b_idx, pred in enumerate(predicted):
-            processed_inputs_cnt = 0
-            for t_idx, same in enumerate(pred):
-                new_processed_inputs_cnt = processed_inputs_cnt + same[1]
-                # Get the probabilities of the prediction for the different time steps as weight
-                weights = prob_ctc[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, same[0]]
-                weights_matrix[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, t_idx] = \
-                    weights / weights.sum()
-                processed_inputs_cnt = new_processed_inputs_cnt
-        return weights_matrix, new_lengths
+    def weighted(prob_ctc, segments):
+        new_maxlen = int(segments.lengths.max())
+        # Get the probabilities of the prediction for the different time steps as weight
+        weights = CTCCompressStrategy.prediction_probs(prob_ctc, segments)
+        return CTCCompressStrategy.normalize(weights, segments, new_maxlen), segments, new_maxlen
 
     @staticmethod
-    def softmax(prob_ctc, predicted, dtype, device):
-        new_lengths = CTCCompressStrategy.new_lengths(predicted)
-        new_maxlen = max(new_lengths)
-        weights_matrix = torch.zeros((prob_ctc.shape[0], prob_ctc.shape[1], new_maxlen), dtype=dtype, device=device)
-        for b_idx, pred in enumerate(predicted):
-            processed_inputs_cnt = 0
-            for t_idx, same in enumerate(pred):
-                new_processed_inputs_cnt = processed_inputs_cnt + same[1]
-                # Get the probabilities of the prediction for the different time steps as weight
-                weights = F.softmax(prob_ctc[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, same[0]])
-                weights_matrix[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, t_idx] = \
-                    weights / weights.sum()
-                processed_inputs_cnt = new_processed_inputs_cnt
-        return weights_matrix, new_lengths
+    def softmax(prob_ctc, segments):
+        new_maxlen = int(segments.lengths.max())
+        # Get the probabilities of the prediction for the different time steps as weight,
+        # normalized with a softmax over the segment (probabilities are in [0, 1], so exp is safe)
+        weights = CTCCompressStrategy.prediction_probs(prob_ctc, segments).exp()
+        return CTCCompressStrategy.normalize(weights, segments, new_maxlen), segments, new_maxlen
 
     @staticmethod
-    def fixed(prob_ctc, predicted, dtype, device):
+    def fixed(prob_ctc, segments):
         new_maxlen = math.ceil(prob_ctc.shape[1] / CtcSupport.FIXED_RATIO)
-        weights_matrix = torch.zeros((prob_ctc.shape[0], prob_ctc.shape[1], new_maxlen), dtype=dtype)
-        new_lengths = []
-        for b_idx, pred in enumerate(predicted):
-            original_len = sum(x[1] for x in pred)
-            new_len = 0
-            for new_t_idx in range(new_maxlen):
-                processed_inputs_cnt = new_t_idx * CtcSupport.FIXED_RATIO
-                processed_inputs_cnt_end = processed_inputs_cnt + CtcSupport.FIXED_RATIO
-                if processed_inputs_cnt_end > original_len:
-                    processed_inputs_cnt_end = original_len
-                weights_matrix[b_idx, processed_inputs_cnt:processed_inputs_cnt_end, new_t_idx] = \
-                    1.0 / (processed_inputs_cnt_end - processed_inputs_cnt)
-                new_len += 1
-                if processed_inputs_cnt_end == original_len:
-                    break
-            new_lengths.append(new_len)
-        return weights_matrix.to(device), new_lengths
+        original_lengths = segments.mask.long().sum(dim=1)
+        time_steps = torch.arange(prob_ctc.shape[1], device=prob_ctc.device).unsqueeze(0)
+        fixed_segments = segments._replace(
+            segment_ids=(time_steps // CtcSupport.FIXED_RATIO).masked_fill(~segments.mask, 0),
+            lengths=(original_lengths + CtcSupport.FIXED_RATIO - 1) // CtcSupport.FIXED_RATIO)
+        weights = CTCCompressStrategy.normalize(segments.mask.to(prob_ctc.dtype), fixed_segments, new_maxlen)
+        return weights, fixed_segments, new_maxlen
@@ -0,0 +1,83 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import math
+from typing import Dict, Tuple
+
+import torch
+from torch import nn, Tensor
+from torch.nn import Parameter
+
+
+class DistancePenalty(nn.Module):
+    """
+    Base class of the penalties subtracted by the
+    :class:`~examples.speech_to_text.modules.local_attention.LocalAttention`
+    to the attention weights, as a function of the distance between the
+    positions of the queries and of the keys.
+
+    The distance matrix does not depend on the input, so it is built once for
+    each device and dtype at the maximum length met so far and then sliced.
+    The penalty returned by *forward* is broadcast over the batch (and the
+    heads), i.e. it has shape `(tgt_len, src_len)` or `(num_heads, tgt_len, src_len)`.
+    """
+    def __init__(self):
+        super().__init__()
+        self._cache: Dict[Tuple[torch.device, torch.dtype], Tensor] = {}
+
+    def distance_function(self, distances: Tensor) -> Tensor:
+        """Transformation of the (float32) distances that is cached with them."""
+        return distances
+
+    def cached_distances(self, tgt_len: int, src_len: int, like: Tensor) -> Tensor:
+        key = (like.device, like.dtype)
+        cached = self._cache.get(key, None)
+        if cached is None or cached.size(0) < tgt_len or cached.size(1) < src_len:
+            max_len = max(tgt_len, src_len) if cached is None else max(tgt_len, src_len, cached.size(0))
+            positions = torch.arange(max_len, device=like.device, dtype=torch.float)
+            distances = torch.abs(positions.unsqueeze(1) - positions.unsqueeze(0))
+            cached = self.distance_function(distances).to(like.dtype)
+            self._cache[key] = cached
+        return cached[:tgt_len, :src_len]
+
+    def forward(self, tgt_len: int, src_len: int, attn_weights: Tensor) -> Tensor:
+        raise NotImplementedError
+
+
+class LogPenalty(DistancePenalty):
+    def __init__(self, *input):
+        super().__init__()
+
+    def distance_function(self, distances: Tensor) -> Tensor:
+        # log(0) = -inf, so the penalty of the same position is 0
+        return torch.max(torch.zeros_like(distances), torch.log(distances))
+
+    def forward(self, tgt_len: int, src_len: int, attn_weights: Tensor) -> Tensor:
+        return self.cached_distances(tgt_len, src_len, attn_weights)
+
+
+class GaussPenalty(DistancePenalty):
+    def __init__(self, args):
+        super().__init__()
+        self.variance = Parameter(torch.Tensor(args.encoder_attention_heads).fill_(args.init_variance))
+
+    def forward(self, tgt_len: int, src_len: int, attn_weights: Tensor) -> Tensor:
+        # d^2 / (2 * var^2), computed as a square not to overflow with low precision dtypes
+        distances = self.cached_distances(tgt_len, src_len, attn_weights).unsqueeze(0)
+        return (distances / (math.sqrt(2) * self.variance).view(-1, 1, 1)) ** 2
+
+
+PENALTIES = {
+    "log": LogPenalty,
+    "gauss": GaussPenalty
+}
@@ -0,0 +1,173 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import logging
+import uuid
+from typing import List, Optional, Tuple
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+
+class EncoderStreamingState(object):
+    """
+    State of a streaming session, i.e. of a stream of audio that is processed
+    with overlapping windows. Before each window, *frame_offset* has to be set to the
+    index (in the stream) of the first feature frame of the window.
+    The state is passed to the encoders in the `streaming_state` field of the net input
+    and each encoder stores its caches in it.
+    """
+    def __init__(self):
+        self.frame_offset: Optional[int] = None
+        self.frontend_caches = {}
+
+    @property
+    def reused_frames(self) -> int:
+        return sum(c.reused_frames for c in self.frontend_caches.values())
+
+    @property
+    def computed_frames(self) -> int:
+        return sum(c.computed_frames for c in self.frontend_caches.values())
+
+
+class FrontendCache(object):
+    """
+    Cache of the outputs of a convolutional frontend (a stack of 1D convolutions
+    followed by pointwise operations, like the :py:class:`Conv1dSubsampler`) for the last
+    window of a stream. The output positions of a new window whose receptive field
+    lies entirely in the part of the input shared with the previous window (and
+    verified to be identical) are taken from the cache, while the others are recomputed.
+    Hence, the result is the same of running the frontend on the whole window.
+    """
+    def __init__(self, layers: List[Tuple[int, int, int]]):
+        # (kernel size, stride, padding) of each convolution
+        self.layers = layers
+        self.total_stride = 1
+        for _, stride, _ in layers:
+            self.total_stride *= stride
+        self.frame_offset = None
+        self.input = None
+        self.output = None
+        self.reused_frames = 0
+        self.computed_frames = 0
+
+    def exact_range(self, start: Optional[int], end: Optional[int], length: int) -> Tuple[int, int, int]:
+        """
+        Given that the input frames in [*start*, *end*) of an input of *length* frames
+        are known, returns the range of output positions that can be computed exactly
+        and the output length. A None *start* (*end*) means that the left (right)
+        boundary of the known frames is the boundary of the input, so the padding is known as well.
+        """
+        for kernel_size, stride, padding in self.layers:
+            out_length = (length + 2 * padding - kernel_size) // stride + 1
+            if start is not None:
+                start = max(0, -(-(start + padding) // stride))
+            if end is not None:
+                end = min(out_length, (end - kernel_size + padding) // stride + 1)
+            length = out_length
+        return (start if start is not None else 0), (end if end is not None else length), length
+
+    def _reusable_range(self, x: torch.Tensor, frame_offset: int) -> Tuple[int, int]:
+        if self.input is None or frame_offset is None or self.frame_offset is None:
+            return 0, 0
+        shift = frame_offset - self.frame_offset
+        if shift < 0 or shift % self.total_stride != 0 or shift >= self.input.shape[0]:
+            return 0, 0
+        overlap = min(x.shape[0], self.input.shape[0] - shift)
+        if x.dtype != self.input.dtype or x.device != self.input.device:
+            return 0, 0
+        mismatches = (x[:overlap] != self.input[shift:shift + overlap]).any(dim=-1).nonzero()
+        matched = mismatches[0].item() if len(mismatches) > 0 else overlap
+        same_end = matched == x.shape[0] and matched == self.input.shape[0] - shift
+        start, end, _ = self.exact_range(
+            None if shift == 0 else 0, None if same_end else matched, x.shape[0])
+        # the cached positions are shifted by the number of output positions between the two windows
+        out_shift = shift // self.total_stride
+        end = min(end, self.output.shape[0] - out_shift)
+        return start, end
+
+    def forward(self, frontend: nn.Module, x: torch.Tensor, frame_offset: Optional[int]) -> torch.Tensor:
+        """
+        Returns the output of *frontend* (T' x C') for the input *x* (T x C)
+        of a single window, reusing the outputs cached for the previous window.
+        """
+        start, end = self._reusable_range(x, frame_offset)
+        _, _, out_length = self.exact_range(None, None, x.shape[0])
+
+        def run(in_start, in_end):
+            out, _ = frontend(
+                x[in_start:in_end].unsqueeze(0),
+                torch.tensor([in_end - in_start], dtype=torch.long, device=x.device))
+            return out[:, 0]
+
+        if end - start <= 0:
+            output = run(0, x.shape[0])
+            self.computed_frames += out_length
+        else:
+            shift = (frame_offset - self.frame_offset) // self.total_stride
+            pieces = []
+            if start > 0:
+                # the smallest prefix of the input whose outputs cover the positions before start
+                in_end = start * self.total_stride
+                while self.exact_range(None, in_end, x.shape[0])[1] < start and in_end < x.shape[0]:
+                    in_end += self.total_stride
+                in_end = min(in_end, x.shape[0])
+                head = run(0, in_end)
+                pieces.append(head[:start])
+                self.computed_frames += start
+            pieces.append(self.output[start + shift:end + shift])
+            self.reused_frames += end - start
+            if end < out_length:
+                # the largest suffix of the input (starting at a multiple of the total stride)
+                # whose outputs cover the positions after end
+                in_start = end * self.total_stride
+                while in_start > 0 and self.exact_range(in_start, None, x.shape[0])[0] > end:
+                    in_start -= self.total_stride
+                tail = run(in_start, x.shape[0])
+                out_start = in_start // self.total_stride
+                pieces.append(tail[end - out_start:])
+                self.computed_frames += out_length - end
+            output = torch.cat(pieces, dim=0)
+        assert output.shape[0] == out_length
+        self.frame_offset = frame_offset
+        self.input = x
+        self.output = output
+        return output
+
+
+class EncoderStreamingSupport:
+    """
+    This class adds to the encoders the reuse of the outputs of their convolutional frontend
+    across the overlapping windows of a stream (see :py:class:`FrontendCache`).
+    It is enabled by passing an :py:class:`EncoderStreamingState` as `streaming_state` in the net input
+    and it supports only batches made of a single window.
+
+    The outputs of the encoder layers are not cached, as they attend to the whole window
+    and so change every time new audio is added. Moreover, the frontend outputs can be reused
+    only if the features of the overlapping audio are identical, which is not the case
+    when they are normalized with window-level statistics (e.g. `utterance_cmvn`).
+    """
+
+    def forward_frontend(self, frontend: nn.Module, src_tokens, src_lengths, streaming_state=None):
+        if streaming_state is None or src_tokens.shape[0] != 1 or self.training:
+            return frontend(src_tokens, src_lengths)
+        if getattr(self, "_streaming_state_id", None) is None:
+            self._streaming_state_id = str(uuid.uuid4())
+        if self._streaming_state_id not in streaming_state.frontend_caches:
+            streaming_state.frontend_caches[self._streaming_state_id] = FrontendCache([
+                (conv.kernel_size[0], conv.stride[0], conv.padding[0]) for conv in frontend.conv_layers])
+        cache = streaming_state.frontend_caches[self._streaming_state_id]
+        x = cache.forward(frontend, src_tokens[0, :int(src_lengths[0])], streaming_state.frame_offset)
+        return x.unsqueeze(1), frontend.get_out_seq_lens_tensor(src_lengths)
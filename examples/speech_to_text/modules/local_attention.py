@@ -22,6 +22,11 @@ class LocalAttention(nn.Module):
     """Multi-headed attention.
 
     See "Attention Is All You Need" for more details.
+
+    The *penalty* of the distance between the positions is not applied by the fused
+    PyTorch implementation, which is used when there is no incremental state (e.g. in
+    the encoder self-attention), unless *always_apply_penalty* is set. It is disabled
+    by default, as the existing models have been trained without the penalty.
     """
 
     def __init__(
@@ -38,7 +43,8 @@ class LocalAttention(nn.Module):
         encoder_decoder_attention=False,
         q_noise=0.0,
         qn_block_size=8,
-        penalty=None
+        penalty=None,
+        always_apply_penalty=False,
     ):
         super().__init__()
         self.embed_dim = embed_dim
@@ -91,6 +97,7 @@ class LocalAttention(nn.Module):
         self.onnx_trace = False
 
         self.penalty = penalty
+        self.always_apply_penalty = always_apply_penalty
 
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
@@ -159,6 +166,7 @@ class LocalAttention(nn.Module):
             and not is_tpu  # don't use PyTorch version on TPUs
             and incremental_state is None
             and not static_kv
+            and not (self.penalty is not None and self.always_apply_penalty)
             # A workaround for quantization to work. Otherwise JIT compilation
             # treats bias in linear module as method.
             and not torch.jit.is_scripting()
@@ -351,8 +359,11 @@ class LocalAttention(nn.Module):
             attn_weights = attn_weights.view(bsz * self.num_heads, tgt_len, src_len)
 
         # Local attention
-        pos_diff = torch.abs(torch.arange(tgt_len).unsqueeze(1) - torch.arange(src_len).unsqueeze(0)).float().cuda()
-        attn_weights = attn_weights - self.penalty(pos_diff, bsz)
+        if self.penalty is not None:
+            # the penalty is broadcast over the batch
+            attn_weights = attn_weights.view(bsz, self.num_heads, tgt_len, src_len)
+            attn_weights = attn_weights - self.penalty(tgt_len, src_len, attn_weights)
+            attn_weights = attn_weights.view(bsz * self.num_heads, tgt_len, src_len)
 
         if before_softmax:
             return attn_weights, v
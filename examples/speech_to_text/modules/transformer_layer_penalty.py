@@ -3,10 +3,8 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import torch
-import torch.nn as nn
-from torch.nn import Parameter
 from fairseq.modules import TransformerEncoderLayer
+from examples.speech_to_text.modules.distance_penalty import PENALTIES, GaussPenalty, LogPenalty  # noqa
 from examples.speech_to_text.modules.local_attention import LocalAttention
 
 class TransformerEncoderLayerPenalty(TransformerEncoderLayer):
@@ -19,30 +17,7 @@ class TransformerEncoderLayerPenalty(TransformerEncoderLayer):
                 self_attention=True,
                 q_noise=self.quant_noise,
                 qn_block_size=self.quant_noise_block_size,
-                penalty=PENALTIES[args.distance_penalty](args))
+                penalty=PENALTIES[args.distance_penalty](args),
+                always_apply_penalty=getattr(args, "apply_distance_penalty", False))
         else:
             return super().build_self_attention(embed_dim, args)
-
-
-class LogPenalty(nn.Module):
-    def __init__(self, *input):
-        super().__init__()
-
-    def forward(self, position_distances, batch_size):
-        return torch.max(torch.zeros_like(position_distances), torch.log(position_distances))
-
-
-class GaussPenalty(nn.Module):
-    def __init__(self, args):
-        super().__init__()
-        self.variance = Parameter(torch.Tensor(args.encoder_attention_heads).fill_(args.init_variance))
-
-    def forward(self, position_distances, batch_size):
-        num = (position_distances * position_distances).unsqueeze(0)
-        denom = (2 * self.variance * self.variance).unsqueeze(1).unsqueeze(2).repeat(batch_size, 1, 1)
-        return num / denom
-
-PENALTIES = {
-    "log": LogPenalty,
-    "gauss": GaussPenalty
-}
@@ -46,6 +46,71 @@ class TriangleTransformerDecoderLayer(TransformerDecoderLayer):
         self.aux_decoder_attn_layer_norm = LayerNorm(self.embed_dim, export=False)
         self.fc_concat = nn.Linear(self.embed_dim * 2, self.embed_dim)
 
+    def reorder_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        new_order: Tensor,
+    ):
+        """
+        Reorders the key/value projections of the auxiliary decoder outputs
+        cached in the incremental state by the *aux_decoder_attn*.
+
+        Differently from the encoder outputs, which are the same for all the
+        beams of a sentence, each beam attends to a different auxiliary
+        hypothesis, so its static key/value have to follow the selected beams.
+        :class:`MultiheadAttention` skips the reordering of encoder-decoder
+        attention states when the batch size does not change, hence they are
+        reordered here, before the attention module is visited.
+        """
+        input_buffer = self.aux_decoder_attn._get_input_buffer(incremental_state)
+        if "prev_key" not in input_buffer:
+            return
+        for k in input_buffer.keys():
+            input_buffer_k = input_buffer[k]
+            if input_buffer_k is not None:
+                input_buffer[k] = input_buffer_k.index_select(0, new_order)
+        self.aux_decoder_attn._set_input_buffer(incremental_state, input_buffer)
+
+    def extend_aux_decoder_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        aux_decoder_out: Tensor,
+        aux_decoder_padding_mask: Optional[Tensor] = None,
+    ):
+        """
+        Appends the key/value projections of *aux_decoder_out* (of shape
+        `(new_len, batch, embed_dim)`), i.e. of the outputs generated by the
+        auxiliary decoder after the ones already attended to, to those cached
+        in the incremental state. This is needed when the auxiliary decoder
+        outputs grow during the generation, i.e. when the transcript is
+        generated jointly with the translation.
+        """
+        input_buffer = self.aux_decoder_attn._get_input_buffer(incremental_state)
+        if "prev_key" not in input_buffer:
+            # they will be computed with the others at the next step
+            return
+        assert self.aux_decoder_attn.bias_k is None and not self.aux_decoder_attn.add_zero_attn
+        new_len, bsz, _ = aux_decoder_out.size()
+        num_heads, head_dim = self.aux_decoder_attn.num_heads, self.aux_decoder_attn.head_dim
+        k = self.aux_decoder_attn.k_proj(aux_decoder_out).view(new_len, bsz, num_heads, head_dim)
+        v = self.aux_decoder_attn.v_proj(aux_decoder_out).view(new_len, bsz, num_heads, head_dim)
+        prev_key = input_buffer["prev_key"]
+        assert prev_key is not None and input_buffer["prev_value"] is not None
+        # saved states are stored with shape (bsz, num_heads, seq_len, head_dim)
+        input_buffer["prev_key"] = torch.cat([prev_key, k.permute(1, 2, 0, 3)], dim=2)
+        input_buffer["prev_value"] = torch.cat([input_buffer["prev_value"], v.permute(1, 2, 0, 3)], dim=2)
+        prev_key_padding_mask = input_buffer.get("prev_key_padding_mask", None)
+        if prev_key_padding_mask is not None or aux_decoder_padding_mask is not None:
+            if prev_key_padding_mask is None:
+                prev_key_padding_mask = torch.zeros(
+                    bsz, prev_key.size(2), dtype=torch.bool, device=aux_decoder_out.device)
+            if aux_decoder_padding_mask is None:
+                aux_decoder_padding_mask = torch.zeros(
+                    bsz, new_len, dtype=torch.bool, device=aux_decoder_out.device)
+            input_buffer["prev_key_padding_mask"] = torch.cat(
+                [prev_key_padding_mask, aux_decoder_padding_mask.to(prev_key_padding_mask)], dim=1)
+        self.aux_decoder_attn._set_input_buffer(incremental_state, input_buffer)
+
     def forward(
         self,
         x,
@@ -159,7 +224,9 @@ class TriangleTransformerDecoderLayer(TransformerDecoderLayer):
             )
             x_1 = self.dropout_module(x_1)
 
-            # Here we compute the cross attention with the output of the auxiliary decoder
+            # Here we compute the cross attention with the output of the auxiliary decoder.
+            # As for the encoder attention, its key/value projections are computed at the
+            # first step and then kept in the incremental state (static_kv)
             x_2, aux_dec_attn = self.aux_decoder_attn(
                 query=x_2,
                 key=aux_decoder_out,
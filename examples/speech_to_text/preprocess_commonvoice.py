@@ -7,19 +7,19 @@
 import argparse
 import logging
 from pathlib import Path
-import shutil
 from tempfile import NamedTemporaryFile
 from typing import Optional, Tuple
 
 import pandas as pd
 import torchaudio
 from examples.speech_to_text.data_utils_new import (
-    create_zip,
-    extract_fbank_features,
+    add_feature_extraction_args,
+    extract_fbank_features_parallel,
     filter_manifest_df,
     gen_config_yaml_with_src,
     gen_vocab,
-    get_zip_manifest,
+    get_audio_info,
+    get_dataset_metadata,
     load_df_from_tsv,
     save_df_to_tsv,
     asr_normalize,
@@ -90,6 +90,13 @@ class CommonVoice(Dataset):
         _id = data["path"].replace(".mp3", "")
         return waveform, sample_rate, sentence, speaker_id, _id
 
+    def get_item_metadata(self, n: int) -> Tuple[int, int, str, str, str]:
+        """Same as __getitem__, but with the number of samples (read from the
+        header of the audio) in place of the waveform."""
+        data = self.data[n]
+        num_samples, sample_rate = get_audio_info((self.root / "clips" / data["path"]).as_posix())
+        return num_samples, sample_rate, data["sentence"], data["client_id"], data["path"].replace(".mp3", "")
+
     def __len__(self) -> int:
         return len(self.data)
 
@@ -99,22 +106,15 @@ def process(args):
     if not root.is_dir():
         raise NotADirectoryError(f"{root} does not exist")
     # Extract features
-    feature_root = root / "fbank"
-    feature_root.mkdir(exist_ok=True)
+    datasets = []
     for split in CommonVoice.SPLITS:
         print(f"Fetching split {split}...")
-        dataset = CommonVoice(root, split, args.src_lang)
-        print("Extracting log mel filter bank features...")
-        for waveform, sample_rate, _, _, utt_id in tqdm(dataset):
-            extract_fbank_features(
-                waveform, sample_rate, feature_root / f"{utt_id}.npy", args.n_mel_bins
-            )
-    # Pack features into ZIP
-    zip_path = root / "fbank.zip"
-    print("ZIPing features...")
-    create_zip(feature_root, zip_path)
-    print("Fetching ZIP manifest...")
-    zip_manifest = get_zip_manifest(zip_path)
+        datasets.append(CommonVoice(root, split, args.src_lang))
+    print("Extracting log mel filter bank features...")
+    features_manifest = extract_fbank_features_parallel(
+        datasets, root / "fbank", args.n_mel_bins, num_workers=args.num_workers,
+        chunk_size=args.extraction_chunk_size, feature_format=args.feature_format,
+        packed_dtype=args.packed_dtype)
     # Generate TSV manifest
     print("Generating manifest...")
     train_text = []
@@ -123,10 +123,10 @@ def process(args):
     for split in CommonVoice.SPLITS:
         manifest = {c: [] for c in MANIFEST_COLUMNS}
         dataset = CommonVoice(root, split, args.src_lang)
-        for wav, sr, src_utt, speaker_id, utt_id in tqdm(dataset):
+        for num_samples, sr, src_utt, speaker_id, utt_id in tqdm(get_dataset_metadata(dataset)):
             manifest["id"].append(utt_id)
-            manifest["audio"].append(zip_manifest[utt_id])
-            duration_ms = int(wav.size(1) / sr * 1000)
+            manifest["audio"].append(features_manifest[utt_id])
+            duration_ms = int(num_samples / sr * 1000)
             manifest["n_frames"].append(int(1 + (duration_ms - 25) / 10))
             manifest["src_text"].append(asr_normalize(src_utt))
             manifest["tgt_text"].append(asr_normalize(src_utt))
@@ -178,8 +178,6 @@ def process(args):
         specaugment_policy="ld",
         n_mel_bins=args.n_mel_bins,
     )
-    # Clean up
-    shutil.rmtree(feature_root)
 
 
 def main():
@@ -202,6 +200,7 @@ def main():
                         help="absolute path to fairseq target vocabulary file [.txt]")
     parser.add_argument("--vocab-file-src", default="none", type=str,
                         help="absolute path to fairseq source vocabulary file [.txt]")
+    add_feature_extraction_args(parser)
     args = parser.parse_args()
 
     process(args)
@@ -5,7 +5,6 @@
 
 import argparse
 import logging
-import shutil
 from itertools import groupby
 from pathlib import Path
 from tempfile import NamedTemporaryFile
@@ -19,11 +18,13 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 
 from examples.speech_to_text.data_utils_new import (
-    create_zip,
-    extract_fbank_features,
+    add_feature_extraction_args,
+    extract_fbank_features_parallel,
     gen_config_yaml_with_src,
     gen_vocab,
-    get_zip_manifest,
+    get_dataset_metadata,
+    get_features_manifest,
+    get_num_samples,
     save_df_to_tsv, asr_normalize, filter_train_manifest_df,
 )
 from fairseq.data.audio.audio_utils import get_waveform
@@ -82,6 +83,10 @@ class YamlDataset(Dataset):
         waveform = torch.from_numpy(waveform)
         return waveform, sr, src_utt, tgt_utt, spk_id, utt_id
 
+    def get_item_metadata(self, n: int) -> Tuple[int, int, str, str, str, str]:
+        wav_path, offset, n_frames, sr, src_utt, tgt_utt, spk_id, utt_id = self.data[n]
+        return get_num_samples(wav_path, offset, n_frames), sr, src_utt, tgt_utt, spk_id, utt_id
+
     def __len__(self) -> int:
         return len(self.data)
 
@@ -93,24 +98,20 @@ def process(args):
         print(f"{data_dir.as_posix()} does not exist. Skipped.")
 
     # Extract features
+    feature_prefix = save_root / "fbank"
     if not args.no_filterbank_extraction:
-        feature_root = save_root / "fbank"
-        feature_root.mkdir(exist_ok=True)
+        datasets = []
         for split in args.splits:
             print(f"Fetching split {split}...")
-            dataset = YamlDataset(data_dir.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang)
-            print("Extracting log mel filter bank features...")
-            for waveform, sample_rate, _, _, _, utt_id in tqdm(dataset):
-                extract_fbank_features(
-                    waveform, sample_rate, feature_root / f"{utt_id}.npy", args.n_mel_bins
-                )
-    # Pack features into ZIP
-    zip_path = save_root / "fbank.zip"
-    if not args.no_filterbank_extraction:
-        print("ZIPing features...")
-        create_zip(feature_root, zip_path)
-    print("Fetching ZIP manifest...")
-    zip_manifest = get_zip_manifest(zip_path)
+            datasets.append(YamlDataset(data_dir.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang))
+        print("Extracting log mel filter bank features...")
+        features_manifest = extract_fbank_features_parallel(
+            datasets, feature_prefix, args.n_mel_bins, num_workers=args.num_workers,
+            chunk_size=args.extraction_chunk_size, feature_format=args.feature_format,
+            packed_dtype=args.packed_dtype)
+    else:
+        print("Fetching features manifest...")
+        features_manifest = get_features_manifest(feature_prefix, args.feature_format)
     # Generate TSV manifest
     print("Generating manifest...")
     train_text = []
@@ -119,10 +120,10 @@ def process(args):
         is_train_split = split.startswith("train")
         manifest = {c: [] for c in MANIFEST_COLUMNS}
         dataset = YamlDataset(data_dir.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang)
-        for wav, sr, src_utt, tgt_utt, speaker_id, utt_id in tqdm(dataset):
+        for num_samples, sr, src_utt, tgt_utt, speaker_id, utt_id in tqdm(get_dataset_metadata(dataset)):
             manifest["id"].append(utt_id)
-            manifest["audio"].append(zip_manifest[utt_id])
-            duration_ms = int(wav.size(1) / sr * 1000)
+            manifest["audio"].append(features_manifest[utt_id])
+            duration_ms = int(num_samples / sr * 1000)
             manifest["n_frames"].append(int(1 + (duration_ms - 25) / 10))
             manifest["src_text"].append(asr_normalize(src_utt) if args.src_normalize else src_utt)
             if args.task == "asr":
@@ -181,9 +182,6 @@ def process(args):
         specaugment_policy="ld",
         n_mel_bins=args.n_mel_bins,
     )
-    # Clean up
-    if not args.no_filterbank_extraction:
-        shutil.rmtree(feature_root)
 
 
 def main():
@@ -206,6 +204,7 @@ def main():
                         help="absolute path to fairseq source vocabulary file [.txt]")
     parser.add_argument("--no-filterbank-extraction", action="store_true",
                         help="no mel filterbanks feature extraction")
+    add_feature_extraction_args(parser)
     args = parser.parse_args()
 
     process(args)
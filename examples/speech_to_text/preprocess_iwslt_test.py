@@ -5,7 +5,6 @@
 
 import argparse
 import logging
-import shutil
 from itertools import groupby
 from pathlib import Path
 from typing import Tuple
@@ -18,9 +17,10 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 
 from examples.speech_to_text.data_utils_new import (
-    create_zip,
-    extract_fbank_features,
-    get_zip_manifest,
+    add_feature_extraction_args,
+    extract_fbank_features_parallel,
+    get_dataset_metadata,
+    get_num_samples,
     save_df_to_tsv, asr_normalize,
 )
 from fairseq.data.audio.audio_utils import get_waveform
@@ -75,6 +75,10 @@ class YamlDataset(Dataset):
         waveform = torch.from_numpy(waveform)
         return waveform, sr, src_utt, tgt_utt, utt_id
 
+    def get_item_metadata(self, n: int) -> Tuple[int, int, str, str, str]:
+        wav_path, offset, n_frames, sr, src_utt, tgt_utt, utt_id = self.data[n]
+        return get_num_samples(wav_path, offset, n_frames), sr, src_utt, tgt_utt, utt_id
+
     def __len__(self) -> int:
         return len(self.data)
 
@@ -85,31 +89,24 @@ def process(args):
         print(f"{cur_root.as_posix()} does not exist. Skipped.")
 
     # Extract features
-    feature_root = cur_root / "fbank"
-    feature_root.mkdir(exist_ok=True)
+    datasets = []
     for split in args.splits:
         print(f"Fetching split {split}...")
-        dataset = YamlDataset(cur_root.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang)
-        print("Extracting log mel filter bank features...")
-        for waveform, sample_rate, _, _, utt_id in tqdm(dataset):
-            extract_fbank_features(
-                waveform, sample_rate, feature_root / f"{utt_id}.npy", args.n_mel_bins
-            )
-    # Pack features into ZIP
-    zip_path = cur_root / "fbank.zip"
-    print("ZIPing features...")
-    create_zip(feature_root, zip_path)
-    print("Fetching ZIP manifest...")
-    zip_manifest = get_zip_manifest(zip_path)
+        datasets.append(YamlDataset(cur_root.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang))
+    print("Extracting log mel filter bank features...")
+    features_manifest = extract_fbank_features_parallel(
+        datasets, cur_root / "fbank", args.n_mel_bins, num_workers=args.num_workers,
+        chunk_size=args.extraction_chunk_size, feature_format=args.feature_format,
+        packed_dtype=args.packed_dtype)
     # Generate TSV manifest
     print("Generating manifest...")
     for split in args.splits:
         manifest = {c: [] for c in MANIFEST_COLUMNS}
         dataset = YamlDataset(cur_root.as_posix(), args.wav_dir, split, args.src_lang, args.tgt_lang)
-        for wav, sr, src_utt, tgt_utt, utt_id in tqdm(dataset):
+        for num_samples, sr, src_utt, tgt_utt, utt_id in tqdm(get_dataset_metadata(dataset)):
             manifest["id"].append(utt_id)
-            manifest["audio"].append(zip_manifest[utt_id])
-            duration_ms = int(wav.size(1) / sr * 1000)
+            manifest["audio"].append(features_manifest[utt_id])
+            duration_ms = int(num_samples / sr * 1000)
             manifest["n_frames"].append(int(1 + (duration_ms - 25) / 10))
             if args.task == "asr":
                 manifest["src_text"].append(asr_normalize(src_utt) if args.src_normalize else src_utt)
@@ -120,8 +117,6 @@ def process(args):
         df = pd.DataFrame.from_dict(manifest)
         #df = filter_manifest_df(df, is_train_split=False)
         save_df_to_tsv(df, cur_root / f"{split}_{args.task}_src.tsv")
-    # Clean up
-    shutil.rmtree(feature_root)
 
 
 def main():
@@ -141,6 +136,7 @@ def main():
                         help="absolute path to fairseq target vocabulary file [.txt]")
     parser.add_argument("--vocab-file-src", default="none", type=str,
                         help="absolute path to fairseq source vocabulary file [.txt]")
+    add_feature_extraction_args(parser)
     args = parser.parse_args()
 
     process(args)
@@ -6,18 +6,21 @@
 
 import argparse
 import logging
+import os
 from pathlib import Path
-import shutil
 from tempfile import NamedTemporaryFile
+from typing import Tuple
 
 import pandas as pd
 from examples.speech_to_text.data_utils_new import (
-    create_zip,
-    extract_fbank_features,
+    add_feature_extraction_args,
+    extract_fbank_features_parallel,
     gen_vocab,
-    get_zip_manifest,
+    get_audio_info,
+    get_dataset_metadata,
     save_df_to_tsv, gen_config_yaml_with_src, asr_normalize,
 )
+from torch import Tensor
 from torchaudio.datasets import LIBRISPEECH
 from tqdm import tqdm
 
@@ -37,39 +40,53 @@ SPLITS = [
 MANIFEST_COLUMNS = ["id", "audio", "n_frames", "src_text", "tgt_text", "speaker"]
 
 
+class LibriSpeech(LIBRISPEECH):
+    """
+    LibriSpeech split whose items are (waveform, sample_rate, utterance, speaker_id, sample_id).
+    """
+    def __getitem__(self, n: int) -> Tuple[Tensor, int, str, int, str]:
+        wav, sample_rate, utt, spk_id, chapter_no, utt_no = super().__getitem__(n)
+        return wav, sample_rate, utt, spk_id, f"{spk_id}-{chapter_no}-{utt_no}"
+
+    def get_item_metadata(self, n: int) -> Tuple[int, int, str, int, str]:
+        sample_id = self._walker[n]
+        spk_id, chapter_no, _ = sample_id.split("-")
+        chapter_dir = os.path.join(self._path, spk_id, chapter_no)
+        num_samples, sample_rate = get_audio_info(os.path.join(chapter_dir, sample_id + self._ext_audio))
+        with open(os.path.join(chapter_dir, f"{spk_id}-{chapter_no}{self._ext_txt}")) as f:
+            for line in f:
+                line_id, utt = line.strip().split(" ", 1)
+                if line_id == sample_id:
+                    break
+            else:
+                raise FileNotFoundError(f"Transcript not found for {sample_id}")
+        return num_samples, sample_rate, utt, int(spk_id), sample_id
+
+
 def process(args):
     out_root = Path(args.output_root).absolute()
     out_root.mkdir(exist_ok=True)
     # Extract features
-    feature_root = out_root / "fbank_asr"
-    feature_root.mkdir(exist_ok=True)
+    datasets = []
     for split in SPLITS:
         print(f"Fetching split {split}...")
-        dataset = LIBRISPEECH(out_root.as_posix(), url=split, download=True)
-        print("Extracting log mel filter bank features...")
-        for wav, sample_rate, _, spk_id, chapter_no, utt_no in tqdm(dataset):
-            sample_id = f"{spk_id}-{chapter_no}-{utt_no}"
-            extract_fbank_features(
-                wav, sample_rate, feature_root / f"{sample_id}.npy", args.n_mel_bins
-            )
-    # Pack features into ZIP
-    zip_path = out_root / "fbank.zip"
-    print("ZIPing features...")
-    create_zip(feature_root, zip_path)
-    print("Fetching ZIP manifest...")
-    zip_manifest = get_zip_manifest(zip_path)
+        datasets.append(LibriSpeech(out_root.as_posix(), url=split, download=True))
+    print("Extracting log mel filter bank features...")
+    features_manifest = extract_fbank_features_parallel(
+        datasets, out_root / "fbank", args.n_mel_bins, num_workers=args.num_workers,
+        chunk_size=args.extraction_chunk_size, feature_format=args.feature_format,
+        packed_dtype=args.packed_dtype)
     # Generate TSV manifest
     print("Generating manifest...")
     train_text = []
     train_text_src = []
     for split in SPLITS:
         manifest = {c: [] for c in MANIFEST_COLUMNS}
-        dataset = LIBRISPEECH(out_root.as_posix(), url=split)
-        for wav, sample_rate, utt, spk_id, chapter_no, utt_no in tqdm(dataset):
-            sample_id = f"{spk_id}-{chapter_no}-{utt_no}"
+        dataset = LibriSpeech(out_root.as_posix(), url=split)
+        for num_samples, sample_rate, utt, spk_id, sample_id in tqdm(get_dataset_metadata(dataset)):
             manifest["id"].append(sample_id)
-            manifest["audio"].append(zip_manifest[sample_id])
-            duration_ms = int(wav.size(1) / sample_rate * 1000)
+            manifest["audio"].append(features_manifest[sample_id])
+            duration_ms = int(num_samples / sample_rate * 1000)
             manifest["n_frames"].append(int(1 + (duration_ms - 25) / 10))
             manifest["src_text"].append(asr_normalize(utt))
             manifest["tgt_text"].append(asr_normalize(utt))
@@ -120,8 +137,6 @@ def process(args):
         specaugment_policy="ld",
         n_mel_bins=args.n_mel_bins,
     )
-    # Clean up
-    shutil.rmtree(feature_root)
 
 
 def main():
@@ -140,6 +155,7 @@ def main():
                         help="absolute path to fairseq target vocabulary file [.txt]")
     parser.add_argument("--vocab-file-src", default="none", type=str,
                         help="absolute path to fairseq source vocabulary file [.txt]")
+    add_feature_extraction_args(parser)
     args = parser.parse_args()
 
     process(args)
@@ -8,7 +8,6 @@ import argparse
 import logging
 import os
 from pathlib import Path
-import shutil
 from itertools import groupby
 from tempfile import NamedTemporaryFile
 from typing import Tuple
@@ -16,12 +15,13 @@ from typing import Tuple
 import pandas as pd
 import torchaudio
 from examples.speech_to_text.data_utils_new import (
-    create_zip,
-    extract_fbank_features,
+    add_feature_extraction_args,
+    extract_fbank_features_parallel,
     filter_manifest_df,
     gen_config_yaml_with_src,
     gen_vocab,
-    get_zip_manifest,
+    get_dataset_metadata,
+    get_num_samples,
     load_df_from_tsv,
     save_df_to_tsv, asr_normalize,
 )
@@ -93,6 +93,10 @@ class MUSTC(Dataset):
         waveform, _ = torchaudio.load(wav_path, offset=offset, num_frames=n_frames)
         return waveform, sr, src_utt, tgt_utt, spk_id, utt_id
 
+    def get_item_metadata(self, n: int) -> Tuple[int, int, str, str, str, str]:
+        wav_path, offset, n_frames, sr, src_utt, tgt_utt, spk_id, utt_id = self.data[n]
+        return get_num_samples(wav_path, offset, n_frames), sr, src_utt, tgt_utt, spk_id, utt_id
+
     def __len__(self) -> int:
         return len(self.data)
 
@@ -105,22 +109,15 @@ def process(args):
             print(f"{cur_root.as_posix()} does not exist. Skipped.")
             continue
         # Extract features
-        feature_root = cur_root / "fbank"
-        feature_root.mkdir(exist_ok=True)
+        datasets = []
         for split in MUSTC.SPLITS:
             print(f"Fetching split {split}...")
-            dataset = MUSTC(root.as_posix(), lang, split)
-            print("Extracting log mel filter bank features...")
-            for waveform, sample_rate, _, _, _, utt_id in tqdm(dataset):
-                extract_fbank_features(
-                    waveform, sample_rate, feature_root / f"{utt_id}.npy", args.n_mel_bins
-                )
-        # Pack features into ZIP
-        zip_path = cur_root / "fbank.zip"
-        print("ZIPing features...")
-        create_zip(feature_root, zip_path)
-        print("Fetching ZIP manifest...")
-        zip_manifest = get_zip_manifest(zip_path)
+            datasets.append(MUSTC(root.as_posix(), lang, split))
+        print("Extracting log mel filter bank features...")
+        features_manifest = extract_fbank_features_parallel(
+            datasets, cur_root / "fbank", args.n_mel_bins, num_workers=args.num_workers,
+            chunk_size=args.extraction_chunk_size, feature_format=args.feature_format,
+            packed_dtype=args.packed_dtype)
         # Generate TSV manifest
         print("Generating manifest...")
         train_text = []
@@ -129,10 +126,10 @@ def process(args):
             is_train_split = split.startswith("train")
             manifest = {c: [] for c in MANIFEST_COLUMNS}
             dataset = MUSTC(args.data_root, lang, split)
-            for wav, sr, src_utt, tgt_utt, speaker_id, utt_id in tqdm(dataset):
+            for num_samples, sr, src_utt, tgt_utt, speaker_id, utt_id in tqdm(get_dataset_metadata(dataset)):
                 manifest["id"].append(utt_id)
-                manifest["audio"].append(zip_manifest[utt_id])
-                duration_ms = int(wav.size(1) / sr * 1000)
+                manifest["audio"].append(features_manifest[utt_id])
+                duration_ms = int(num_samples / sr * 1000)
                 manifest["n_frames"].append(int(1 + (duration_ms - 25) / 10))
                 manifest["src_text"].append(asr_normalize(src_utt) if args.task == "asr" or args.asr_source else src_utt)
                 manifest["tgt_text"].append(asr_normalize(src_utt) if args.task == "asr" else tgt_utt)
@@ -184,8 +181,6 @@ def process(args):
             specaugment_policy="ld",
             n_mel_bins=args.n_mel_bins,
         )
-        # Clean up
-        shutil.rmtree(feature_root)
 
 
 def process_joint(args):
@@ -248,6 +243,7 @@ def main():
                         help="absolute path to fairseq target vocabulary file [.txt]")
     parser.add_argument("--vocab-file-src", default="none", type=str,
                         help="absolute path to fairseq source vocabulary file [.txt]")
+    add_feature_extraction_args(parser)
     args = parser.parse_args()
 
     if args.joint:
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3 -u
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import argparse
+import math
+import time
+from itertools import groupby
+
+import torch
+from torch.nn import functional as F
+
+from examples.speech_to_text.modules.ctc_support import CtcSupport
+
+
+class CtcCompressor(CtcSupport):
+    """
+    Minimal module applying the CTC compression, as done by the encoders.
+    """
+    def __init__(self, strategy, max_out_size=-1, fixed_ratio=4):
+        self.set_ctc_compress_strategy(strategy)
+        self.ctc_compress_max_out_size = max_out_size
+        CtcSupport.FIXED_RATIO = fixed_ratio
+
+
+def reference_ensure_max_ctc_out_len(batch_predicted, max_out_size):
+    """
+    Ensures that the output of the CTC compression is not longer than *max_out_size*.
+    *batch_predicted* contains for each sample the list of (prediction, number of time steps)
+    of the CTC output. If there are samples violating this constraints, consecutive predictions
+    are merged so to shorten the sentence.
+    E.g. if *max_out_size* is set to 3, and the output of the CTC compression would be
+    long 5, the first and second predictions are merged, as well as the third and the fourth.
+    This is the loop-based reference of the merging done by :py:meth:`CtcSupport.ctc_segments`.
+    """
+    if max_out_size > 0:
+
+        def merge_sublist(elements):
+            """
+            Takes a list of Tuples (predicted_element, num_corresponding_vectors) and returns
+            a single tuple with the predicted_element having the highest number of corresponding_vectors
+            (in case of a tie, the first is returned) and the total sum of the num_corresponding_vectors
+            E.g. if the input is [(a, 3), (b, 5), (c, 6), (a, 4)], the output will be (a, 18).
+            """
+            sum_num_vectors = 0
+            max_element = None
+            max_element_cnt = 0
+            temp_dict = {}
+            for predicted_element, num_corresponding_vectors in elements:
+                if predicted_element in temp_dict:
+                    temp_dict[predicted_element] += num_corresponding_vectors
+                else:
+                    temp_dict[predicted_element] = num_corresponding_vectors
+                if temp_dict[predicted_element] > max_element_cnt:
+                    max_element_cnt = temp_dict[predicted_element]
+                    max_element = predicted_element
+                sum_num_vectors += num_corresponding_vectors
+            return max_element, sum_num_vectors
+
+        for b_idx, p in enumerate(batch_predicted):
+            pred_len = len(p)
+            if pred_len > max_out_size:
+                reduction_factor = math.ceil(pred_len / max_out_size)
+                i = 0
+                new_p = []
+                while i < pred_len:
+                    new_p.append(merge_sublist(p[i:i + reduction_factor]))
+                    i += reduction_factor
+                batch_predicted[b_idx] = new_p
+
+    return batch_predicted
+
+
+def reference_average_same_ctc_features(compressor, strategy, x_ctc, x, src_lengths):
+    """
+    The loop-based implementation of the CTC compression,
+    used as a reference for the tensorized one.
+    """
+    if strategy.endswith("_pool"):
+        strategy = strategy[:-len("_pool")]
+    with torch.no_grad():
+        batch_predicted = []
+        prob_ctc = F.softmax(x_ctc, dim=-1).transpose(0, 1)
+        for b in range(prob_ctc.shape[0]):
+            predicted = prob_ctc[b][: src_lengths[b]].argmax(-1).tolist()
+            batch_predicted.append([(p[0], len(list(p[1]))) for p in groupby(predicted)])
+        batch_predicted = reference_ensure_max_ctc_out_len(
+            batch_predicted, compressor.ctc_compress_max_out_size)
+        if strategy == "fixed":
+            new_maxlen = math.ceil(prob_ctc.shape[1] / CtcSupport.FIXED_RATIO)
+            new_lengths = [math.ceil(sum(p[1] for p in pred) / CtcSupport.FIXED_RATIO) for pred in batch_predicted]
+        else:
+            new_lengths = [len(p) for p in batch_predicted]
+            new_maxlen = max(new_lengths)
+        weights_matrix = torch.zeros((prob_ctc.shape[0], prob_ctc.shape[1], new_maxlen), dtype=x.dtype)
+        for b_idx, pred in enumerate(batch_predicted):
+            if strategy == "fixed":
+                original_len = sum(p[1] for p in pred)
+                pred = [
+                    (None, min(CtcSupport.FIXED_RATIO, original_len - i))
+                    for i in range(0, original_len, CtcSupport.FIXED_RATIO)]
+            processed_inputs_cnt = 0
+            for t_idx, same in enumerate(pred):
+                new_processed_inputs_cnt = processed_inputs_cnt + same[1]
+                if strategy in {"avg", "fixed"}:
+                    weights = torch.ones(same[1]) / same[1]
+                else:
+                    weights = prob_ctc[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, same[0]]
+                    if strategy == "softmax":
+                        weights = F.softmax(weights, dim=0)
+                    weights = weights / weights.sum()
+                weights_matrix[b_idx, processed_inputs_cnt:new_processed_inputs_cnt, t_idx] = weights
+                processed_inputs_cnt = new_processed_inputs_cnt
+        weights_matrix = weights_matrix.to(x.device)
+    compressed_output = x.permute(1, 2, 0).bmm(weights_matrix)
+    return compressed_output.permute(2, 0, 1), src_lengths.new(new_lengths)
+
+
+def fake_ctc_output(batch_size, max_len, vocab_size, avg_run_length, device):
+    """
+    Returns CTC scores whose predictions repeat for *avg_run_length* time steps on average.
+    """
+    src_lengths = torch.randint(max_len // 2, max_len + 1, (batch_size,), device=device)
+    src_lengths[0] = max_len
+    run_changes = torch.rand(batch_size, max_len, device=device) < 1.0 / avg_run_length
+    predictions = (run_changes.long().cumsum(dim=1) * 7919) % vocab_size
+    x_ctc = torch.randn(max_len, batch_size, vocab_size, device=device)
+    x_ctc += 10.0 * F.one_hot(predictions, vocab_size).transpose(0, 1).float()
+    return x_ctc, src_lengths
+
+
+def timeit(fn, num_runs, device):
+    """
+    Returns the average time (in seconds) of a run of *fn* and its peak memory (in MB, only on GPU).
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats(device)
+        base_memory = torch.cuda.memory_allocated(device)
+    fn()
+    peak_memory = float("nan")
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak_memory = (torch.cuda.max_memory_allocated(device) - base_memory) / 2 ** 20
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / num_runs, peak_memory
+
+
+def main(args):
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    for strategy in args.strategies:
+        compressor = CtcCompressor(strategy, max_out_size=args.max_out_size)
+        for max_len in args.lengths:
+            x_ctc, src_lengths = fake_ctc_output(
+                args.batch_size, max_len, args.vocab_size, args.avg_run_length, device)
+            x = torch.randn(max_len, args.batch_size, args.embed_dim, device=device)
+            out, lengths = compressor.average_same_ctc_features(x_ctc, x, src_lengths)
+            ref_out, ref_lengths = reference_average_same_ctc_features(compressor, strategy, x_ctc, x, src_lengths)
+            assert torch.equal(lengths, ref_lengths)
+            max_diff = (out - ref_out).abs().max().item()
+            ref_time, ref_memory = timeit(lambda: reference_average_same_ctc_features(
+                compressor, strategy, x_ctc, x, src_lengths), args.num_runs, device)
+            new_time, new_memory = timeit(lambda: compressor.average_same_ctc_features(
+                x_ctc, x, src_lengths), args.num_runs, device)
+            print(f"{strategy:>13} T={max_len:<5} loops {ref_time * 1000:9.2f} ms {ref_memory:8.1f} MB | "
+                  f"tensorized {new_time * 1000:9.2f} ms {new_memory:8.1f} MB | "
+                  f"speedup {ref_time / new_time:6.1f}x | max abs diff {max_diff:.2e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the CTC compression.")
+    parser.add_argument("--strategies", nargs="+", default=[
+        "avg", "weighted", "softmax", "fixed", "avg_pool", "weighted_pool", "softmax_pool", "fixed_pool"])
+    parser.add_argument("--lengths", nargs="+", type=int, default=[250, 750, 1500, 3000])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--vocab-size", type=int, default=8000)
+    parser.add_argument("--embed-dim", type=int, default=512)
+    parser.add_argument("--avg-run-length", type=float, default=3.0)
+    parser.add_argument("--max-out-size", type=int, default=-1)
+    parser.add_argument("--num-runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    main(parser.parse_args())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3 -u
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+"""
+Compares the two-phase generation of triangle models with the joint generation
+(see :class:`JointSequenceGenerator`) for several values of the lookahead of
+the auxiliary decoder, reporting the decoding time and the quality of the
+translations and transcripts. It accepts the same arguments of
+`generate_dualdecoder.py`, in addition to `--lookaheads`, e.g.:
+
+    python examples/speech_to_text/scripts/benchmark_triangle_decoding.py $data \\
+        --user-dir examples/speech_to_text --config-yaml $config --gen-subset $split \\
+        --task speech_translation_dualdecoding --path $model --beam 5 --max-tokens 10000 \\
+        --lookaheads 1 2 4 8
+"""
+import ast
+import time
+
+import sacrebleu
+import torch
+
+from fairseq import checkpoint_utils, options, tasks, utils
+from fairseq.dataclass.utils import convert_namespace_to_omegaconf
+
+
+def decode(task, cfg, generator, models, samples, use_cuda):
+    """
+    Returns the time (in seconds) spent generating the outputs of *samples*,
+    and the best translation and transcript of each sentence, sorted by id.
+    """
+    tokenizer = task.build_tokenizer(cfg.tokenizer)
+    bpe = task.build_bpe(cfg.bpe)
+
+    def to_string(dictionary, tokens):
+        x = dictionary.string(tokens.int().cpu(), cfg.common_eval.post_process)
+        if bpe is not None:
+            x = bpe.decode(x)
+        if tokenizer is not None:
+            x = tokenizer.decode(x)
+        return x
+
+    outputs = {}
+    elapsed = 0.0
+    for sample in samples:
+        if use_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        hypos = task.inference_step(generator, models, sample)
+        if use_cuda:
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - start
+        for i, sample_id in enumerate(sample['id'].tolist()):
+            outputs[sample_id] = (
+                to_string(task.target_dictionary, hypos[i][0]["tokens"]),
+                to_string(task.source_dictionary, hypos[i][0]["aux_tokens"]),
+                to_string(task.target_dictionary, utils.strip_pad(sample["target"][i], task.target_dictionary.pad()))
+                if sample["target"] is not None else None,
+            )
+    return elapsed, [outputs[i] for i in sorted(outputs.keys())]
+
+
+def main(args):
+    cfg = convert_namespace_to_omegaconf(args)
+    utils.import_user_module(cfg.common)
+    use_cuda = torch.cuda.is_available() and not cfg.common.cpu
+    task = tasks.setup_task(cfg.task)
+    models, saved_cfg = checkpoint_utils.load_model_ensemble(
+        utils.split_paths(cfg.common_eval.path),
+        arg_overrides=ast.literal_eval(cfg.common_eval.model_overrides),
+        task=task,
+    )
+    task.load_dataset(cfg.dataset.gen_subset, task_cfg=saved_cfg.task)
+    for model in models:
+        if cfg.common.fp16:
+            model.half()
+        if use_cuda:
+            model.cuda()
+        model.prepare_for_inference_(cfg)
+    itr = task.get_batch_iterator(
+        dataset=task.dataset(cfg.dataset.gen_subset),
+        max_tokens=cfg.dataset.max_tokens,
+        max_sentences=cfg.dataset.batch_size,
+        max_positions=utils.resolve_max_positions(task.max_positions(), *[m.max_positions() for m in models]),
+        ignore_invalid_inputs=cfg.dataset.skip_invalid_size_inputs_valid_test,
+        seed=cfg.common.seed,
+    ).next_epoch_itr(shuffle=False)
+    samples = [utils.move_to_cuda(s) if use_cuda else s for s in itr if 'net_input' in s]
+
+    two_phase_time, two_phase_outputs = decode(
+        task, cfg, task.build_dualdecoding_generator(models, cfg.generation), models, samples, use_cuda)
+    references = [o[2] for o in two_phase_outputs]
+    has_references = all(r is not None for r in references)
+
+    def report(name, elapsed, outputs):
+        translations = [o[0] for o in outputs]
+        bleu = sacrebleu.corpus_bleu(translations, [references]).score if has_references else float("nan")
+        same_translations = sum(o[0] == t[0] for o, t in zip(outputs, two_phase_outputs)) / len(outputs)
+        same_transcripts = sum(o[1] == t[1] for o, t in zip(outputs, two_phase_outputs)) / len(outputs)
+        print(f"{name:>14} | {elapsed:8.2f} s | speedup {two_phase_time / elapsed:5.2f}x | BLEU {bleu:6.2f} | "
+              f"same translation {same_translations * 100:6.2f}% | same transcript {same_transcripts * 100:6.2f}%")
+
+    report("two-phase", two_phase_time, two_phase_outputs)
+    for lookahead in args.lookaheads:
+        generator = task.build_dualdecoding_generator(models, cfg.generation, aux_lookahead=lookahead)
+        elapsed, outputs = decode(task, cfg, generator, models, samples, use_cuda)
+        report(f"joint (k={lookahead})", elapsed, outputs)
+
+
+def cli_main():
+    parser = options.get_generation_parser()
+    parser.add_argument("--lookaheads", nargs="+", type=int, default=[1, 2, 4, 8],
+                        help="lookaheads of the auxiliary decoder to benchmark")
+    args = options.parse_args_and_arch(parser)
+    main(args)
+
+
+if __name__ == '__main__':
+    cli_main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3 -u
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import argparse
+import csv
+import logging
+import os
+import os.path as op
+from argparse import Namespace
+
+from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc
+from fairseq.data import Dictionary, encoders, indexed_dataset
+from fairseq.data.audio.speech_to_text_dataset import binarized_tokens_fingerprint_path, binarized_tokens_prefix, \
+    texts_fingerprint
+
+logger = logging.getLogger("binarize_texts")
+
+
+def binarize(texts, prefix, dictionary, pre_tokenizer, bpe_tokenizer, tokenizer_cfgs):
+    """
+    Writes the token IDs of the *texts* (followed by the EOS, as done by the datasets)
+    into the *prefix*.bin/.idx files, and the fingerprint of the texts, of the *dictionary*
+    and of the tokenizers (defined by *tokenizer_cfgs*), which the datasets check before
+    reading the token IDs.
+    """
+    builder = indexed_dataset.make_builder(
+        indexed_dataset.data_file_path(prefix), impl="mmap", vocab_size=len(dictionary))
+    for text in texts:
+        if pre_tokenizer is not None:
+            text = pre_tokenizer.encode(text)
+        if bpe_tokenizer is not None:
+            text = bpe_tokenizer.encode(text)
+        builder.add_item(dictionary.encode_line(text, add_if_not_exist=False, append_eos=True))
+    builder.finalize(indexed_dataset.index_file_path(prefix))
+    with open(binarized_tokens_fingerprint_path(prefix), "w") as f:
+        f.write(texts_fingerprint(texts, tokenizer_cfgs, op.dirname(prefix), dictionary))
+    logger.info(f"Written {len(texts)} sentences to {prefix}")
+
+
+def main(args):
+    data_cfg = S2TDataConfigSrc(op.join(args.data_root, args.config_yaml))
+    pre_tokenizer = encoders.build_tokenizer(Namespace(**data_cfg.pre_tokenizer))
+    tgt_dict = Dictionary.load(op.join(args.data_root, data_cfg.vocab_filename))
+    bpe_tokenizer = encoders.build_bpe(Namespace(**data_cfg.bpe_tokenizer))
+    src_dict, bpe_tokenizer_src = None, None
+    if op.isfile(op.join(args.data_root, data_cfg.vocab_filename_src)):
+        src_dict = Dictionary.load(op.join(args.data_root, data_cfg.vocab_filename_src))
+        bpe_tokenizer_src = encoders.build_bpe(Namespace(**data_cfg.bpe_tokenizer_src))
+    for split in args.splits:
+        tsv_path = op.join(args.data_root, f"{split}.tsv")
+        with open(tsv_path) as f:
+            reader = csv.DictReader(
+                f,
+                delimiter="\t",
+                quotechar=None,
+                doublequote=False,
+                lineterminator="\n",
+                quoting=csv.QUOTE_NONE,
+            )
+            samples = [dict(e) for e in reader]
+        binarize(
+            [s["tgt_text"] for s in samples],
+            binarized_tokens_prefix(tsv_path, "tgt"),
+            tgt_dict,
+            pre_tokenizer,
+            bpe_tokenizer,
+            [data_cfg.pre_tokenizer, data_cfg.bpe_tokenizer])
+        if src_dict is not None and len(samples) > 0 and "src_text" in samples[0]:
+            binarize(
+                [s["src_text"] for s in samples],
+                binarized_tokens_prefix(tsv_path, "src"),
+                src_dict,
+                pre_tokenizer,
+                bpe_tokenizer_src,
+                [data_cfg.pre_tokenizer, data_cfg.bpe_tokenizer_src])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    )
+    parser = argparse.ArgumentParser(
+        description="Binarizes the target texts (and the source transcripts) of the TSVs of a speech dataset, "
+                    "so that the datasets read their token IDs instead of tokenizing them at each epoch. "
+                    "The binarized files are ignored (and have to be regenerated) whenever the TSVs, "
+                    "the vocabularies, or the tokenizers change.")
+    parser.add_argument('--data-root', type=str, required=True, help="directory containing the TSVs")
+    parser.add_argument('--config-yaml', type=str, default="config.yaml",
+                        help="config of the dataset, defining the vocabularies and the tokenizers")
+    parser.add_argument('--splits', type=str, nargs='+', required=True, help="name of the TSVs to binarize")
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3 -u
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import argparse
+import csv
+import logging
+import os
+
+from fairseq.data.audio.packed_features import PackedFeaturesBuilder
+from fairseq.data.audio.speech_to_text_dataset import get_features_or_waveform
+
+
+def convert(data_root, tsvs_in, tsvs_out, output_prefix, dtype):
+    """
+    Packs the features referred to in the audio column of the *tsvs_in* (e.g. the entries
+    of a fbank.zip) into the packed features *output_prefix*.bin/.idx, and writes
+    the *tsvs_out*, i.e. the same manifests whose audio column refers to the packed features.
+    The paths are relative to the *data_root*, as in the config yaml of the datasets.
+    """
+    logging.basicConfig(
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=os.environ.get("LOGLEVEL", "INFO").upper(),
+    )
+    logger = logging.getLogger("zip_to_packed_features")
+    assert len(tsvs_in) == len(tsvs_out), "an output TSV must be set for each input TSV"
+    # the features shared by more manifests (e.g. ASR and ST ones) are packed once
+    packed_paths = {}
+    with PackedFeaturesBuilder(os.path.join(data_root, output_prefix), dtype=dtype) as builder:
+        for tsv_in, tsv_out in zip(tsvs_in, tsvs_out):
+            with open(tsv_in, 'r') as in_f, open(tsv_out, 'w') as out_f:
+                reader = csv.DictReader(
+                    in_f,
+                    delimiter="\t",
+                    quotechar=None,
+                    doublequote=False,
+                    lineterminator="\n",
+                    quoting=csv.QUOTE_NONE,
+                )
+                writer = csv.DictWriter(
+                    out_f,
+                    fieldnames=reader.fieldnames,
+                    delimiter="\t",
+                    quotechar=None,
+                    doublequote=False,
+                    lineterminator="\n",
+                    quoting=csv.QUOTE_NONE,
+                )
+                writer.writeheader()
+                for sample in reader:
+                    audio = sample['audio']
+                    if audio not in packed_paths:
+                        features = get_features_or_waveform(os.path.join(data_root, audio))
+                        packed_paths[audio] = builder.manifest_path(builder.add_item(features), output_prefix)
+                    sample['audio'] = packed_paths[audio]
+                    writer.writerow(sample)
+            logger.info(f"Written {tsv_out}")
+    logger.info(f"Packed {len(packed_paths)} features into {output_prefix}.bin")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts the features referred to by TSV manifests (e.g. in a fbank.zip) "
+                    "into packed features.")
+    parser.add_argument('--data-root', type=str, default="",
+                        help="directory the paths of the audio column are relative to")
+    parser.add_argument('--tsv-in', type=str, nargs='+', required=True, help="input manifests")
+    parser.add_argument('--tsv-out', type=str, nargs='+', required=True,
+                        help="output manifests, one for each input manifest")
+    parser.add_argument('--output-prefix', type=str, default="fbank",
+                        help="prefix (relative to --data-root) of the .bin and .idx files to write")
+    parser.add_argument('--dtype', type=str, default="float32", choices=["float32", "float16"],
+                        help="type used to store the features")
+    args = parser.parse_args()
+    convert(args.data_root, args.tsv_in, args.tsv_out, args.output_prefix, args.dtype)
@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 import logging
 
+from examples.speech_to_text.joint_sequence_generator import JointSequenceGenerator
 from examples.speech_to_text.tasks.speech_to_text_ctc import SpeechToTextCtcTask
 from examples.speech_to_text.twophase_sequence_generator import TwoPhaseSequenceGenerator
 from fairseq.tasks import register_task
@@ -18,11 +19,22 @@ class SpeechTranslationDualDecodingTask(SpeechToTextCtcTask):
     Task for training dual-decoder models for joint speech translation and recognition.
     """
 
+    @staticmethod
+    def add_args(parser):
+        SpeechToTextCtcTask.add_args(parser)
+        parser.add_argument(
+            "--aux-lookahead", type=int, default=None,
+            help="if set, the transcript is generated greedily and the translation starts when "
+                 "the transcript has this number of tokens, keeping it this number of steps ahead "
+                 "(JointSequenceGenerator), instead of being generated after the beam search "
+                 "of the transcript is over (TwoPhaseSequenceGenerator)")
+
     def build_generator(self, models, args):
-        return TwoPhaseSequenceGenerator(
-            models,
-            self.source_dictionary,
-            self.target_dictionary,
+        return self.build_dualdecoding_generator(
+            models, args, aux_lookahead=getattr(self.args, "aux_lookahead", None))
+
+    def build_dualdecoding_generator(self, models, args, aux_lookahead=None):
+        generator_kwargs = dict(
             beam_size=getattr(args, "beam", 5),
             max_len_a=getattr(args, "max_len_a", 0),
             max_len_b=getattr(args, "max_len_b", 200),
@@ -34,4 +46,17 @@ class SpeechTranslationDualDecodingTask(SpeechToTextCtcTask):
             match_source_len=getattr(args, "match_source_len", False),
             no_repeat_ngram_size=getattr(args, "no_repeat_ngram_size", 0),
         )
-
+        if aux_lookahead is not None:
+            return JointSequenceGenerator(
+                models,
+                self.source_dictionary,
+                self.target_dictionary,
+                aux_lookahead=aux_lookahead,
+                **generator_kwargs,
+            )
+        return TwoPhaseSequenceGenerator(
+            models,
+            self.source_dictionary,
+            self.target_dictionary,
+            **generator_kwargs,
+        )
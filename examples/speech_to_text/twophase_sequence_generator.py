@@ -4,7 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 import torch
 
@@ -171,60 +171,32 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
 
     def _generate_tgt(
         self,
-        aux_nbest: List[List[Dict[str, Tensor]]],
+        aux_nbest: Dict[str, Optional[Tensor]],
         encoder_outs: List[EncoderOut],
         prefix_tokens: Optional[Tensor] = None,
         bos_token: Optional[int] = None,
     ):
-        incremental_states = torch.jit.annotate(
-            List[Dict[str, Dict[str, Optional[Tensor]]]],
-            [
-                torch.jit.annotate(Dict[str, Dict[str, Optional[Tensor]]], {})
-                for i in range(self.model.models_size)
-            ],
-        )
         # bsz: total number of sentences in beam
-        bsz = len(aux_nbest)
-        beam_size = self.beam_size
-        max_aux_len = max([cand["tokens"].shape[0] for sent in aux_nbest for cand in sent])
-        src_tokens = (
-            torch.zeros(bsz, beam_size, max_aux_len).long().fill_(self.src_pad).to(
-                aux_nbest[0][0]["tokens"].device)
-        )
-        src_tags = (
-            torch.zeros(bsz, beam_size, max_aux_len).long().to(
-                aux_nbest[0][0]["tokens"].device)
-        )
-        for i_batch in range(len(aux_nbest)):
-            for i_best in range(len(aux_nbest[i_batch])):
-                cand = aux_nbest[i_batch][i_best]
-                src_tokens[i_batch, i_best, :cand["tokens"].shape[0]] = cand["tokens"]
-                if cand["aux_tags"] is not None:
-                    src_tags[i_batch, i_best, :cand["aux_tags"].shape[0]] = cand["aux_tags"]
-                else:
-                    src_tags = None
-
-        src_tokens = src_tokens.view(bsz * beam_size, -1)
+        aux_tokens = aux_nbest["tokens"]
+        assert aux_tokens is not None
+        bsz, beam_size = aux_tokens.size(0), aux_tokens.size(1)
+        # the n-best of the auxiliary decoder are already packed, so they
+        # are only trimmed to the longest hypothesis
+        max_aux_len = int(aux_nbest["lengths"].max())
+        src_tokens = aux_tokens[:, :, :max_aux_len].reshape(bsz * beam_size, max_aux_len)
+        src_tags = aux_nbest["aux_tags"]
         if src_tags is not None:
-            src_tags = src_tags.view(bsz * beam_size, -1)
+            src_tags = src_tags[:, :, :max_aux_len].reshape(bsz * beam_size, max_aux_len)
         # length of the source text being the character length except EndOfSentence and pad
         src_lengths = (
             (src_tokens.ne(self.src_eos) & src_tokens.ne(self.src_pad)).long().sum(dim=1)
         )
         src_len = src_tokens.size()[1]
 
-        auxiliary_outputs = torch.zeros(
-            bsz, beam_size, max_aux_len, aux_nbest[0][0]["auxiliary_out"].shape[1]).float().fill_(
-            self.src_pad).to(src_tokens.device)
-        for i_batch in range(len(aux_nbest)):
-            for i_best in range(len(aux_nbest[i_batch])):
-                cand = aux_nbest[i_batch][i_best]
-                auxiliary_outputs[i_batch, i_best, :cand["auxiliary_out"].shape[0], :] = cand["auxiliary_out"]
-
-        auxiliary_outputs = auxiliary_outputs.view(bsz * beam_size, max_aux_len, -1)
+        auxiliary_outputs = aux_nbest["auxiliary_out"]
+        auxiliary_outputs = auxiliary_outputs[:, :, :max_aux_len].reshape(bsz * beam_size, max_aux_len, -1)
 
-        prev_scores = torch.stack(
-            [cand["score"] for sent in aux_nbest for cand in sent]).view(bsz, beam_size, 1)
+        prev_scores = aux_nbest["scores"].view(bsz, beam_size, 1)
 
         if self.match_source_len:
             max_len = src_lengths.max().item()
@@ -234,10 +206,45 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
                 # exclude the EOS marker
                 self.model.max_decoder_positions() - 1,
             )
+        return self._search_tgt(
+            src_tokens, src_tags, auxiliary_outputs, prev_scores, encoder_outs, max_len,
+            prefix_tokens=prefix_tokens, bos_token=bos_token)
+
+    def _search_tgt(
+        self,
+        src_tokens: Tensor,
+        src_tags: Optional[Tensor],
+        auxiliary_outputs: Tensor,
+        prev_scores: Tensor,
+        encoder_outs: List[EncoderOut],
+        max_len: int,
+        prefix_tokens: Optional[Tensor] = None,
+        bos_token: Optional[int] = None,
+        aux_state: Optional[Any] = None,
+    ):
+        """Beam search of the target decoder over the auxiliary hypotheses
+        *src_tokens* (bsz * beam_size x src_len), whose auxiliary decoder
+        outputs are *auxiliary_outputs* (bsz * beam_size x src_len x C).
+        *prev_scores* (bsz x beam_size x 1) are the scores of the auxiliary
+        hypotheses, added at the first step. *aux_state* is passed to
+        :meth:`_update_auxiliary_inputs` before each step.
+        """
+        incremental_states = torch.jit.annotate(
+            List[Dict[str, Dict[str, Optional[Tensor]]]],
+            [
+                torch.jit.annotate(Dict[str, Dict[str, Optional[Tensor]]], {})
+                for i in range(self.model.models_size)
+            ],
+        )
+        bsz = prev_scores.size(0)
+        beam_size = prev_scores.size(1)
+        # length of the source text being the character length except EndOfSentence and pad
+        src_lengths = (
+            (src_tokens.ne(self.src_eos) & src_tokens.ne(self.src_pad)).long().sum(dim=1)
+        )
         assert (
             self.min_len <= max_len
         ), "min_len cannot be larger than max_len, please adjust these!"
-        # compute the encoder output for each beam
 
         # initialize buffers
         scores = (
@@ -302,7 +309,14 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
                 if src_tags is not None:
                     src_tags = src_tags.index_select(0, reorder_state)
                 prev_scores = prev_scores.view(-1).index_select(0, reorder_state).view(-1, beam_size, 1)
-                auxiliary_outputs = auxiliary_outputs.index_select(0, reorder_state)
+                if not self.model.has_incremental_states():
+                    # otherwise, the key/value projections of the auxiliary outputs
+                    # are cached and reordered in the incremental states
+                    auxiliary_outputs = auxiliary_outputs.index_select(0, reorder_state)
+            if aux_state is not None:
+                src_tokens, src_tags, auxiliary_outputs = self._update_auxiliary_inputs(
+                    step, aux_state, finished, beam_size, src_tokens, src_tags, auxiliary_outputs,
+                    incremental_states)
 
             lprobs, avg_attn_scores, tags_lprobs = self.model.forward_decoder(
                 tokens[:, : step + 1],
@@ -516,6 +530,22 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
 
         return finalized
 
+    def _update_auxiliary_inputs(
+        self,
+        step: int,
+        aux_state: Any,
+        finished: List[bool],
+        beam_size: int,
+        src_tokens: Tensor,
+        src_tags: Optional[Tensor],
+        auxiliary_outputs: Tensor,
+        incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]],
+    ):
+        """Returns the auxiliary tokens, tags and decoder outputs that the
+        target decoder attends to at *step*. In the two-phase generation they
+        are complete since the first step, so they are returned unchanged."""
+        return src_tokens, src_tags, auxiliary_outputs
+
     def _generate_aux(
         self,
         sample: Dict[str, Dict[str, Tensor]],
@@ -572,11 +602,10 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
             torch.zeros(bsz, beam_size).to(src_tokens).eq(-1)
         )  # forward and backward-compatible False mask
 
-        # list of completed sentences
-        finalized = torch.jit.annotate(
-            List[List[Dict[str, Tensor]]],
-            [torch.jit.annotate(List[Dict[str, Tensor]], []) for i in range(bsz)],
-        )  # contains lists of dictionaries of information about the hypothesis being finalized at each step
+        # completed hypotheses, packed as tensors of shape bsz x beam_size x ... (see finalize_aux_hypos)
+        aux_nbest: Dict[str, Optional[Tensor]] = {}
+        # number of hypotheses finalized for each sentence
+        num_finalized = [0 for i in range(bsz)]
 
         finished = [
             False for i in range(bsz)
@@ -620,10 +649,10 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
             )
             if step == 0:
                 # We need to initialize this here as we don't know the last dimension (C)
-                # until we do the first step
-                aux_outputs = (
-                    torch.zeros(max_len + 1, bsz * beam_size, aux_out.shape[-1]).to(src_tokens).float()
-                )
+                # and the type of the outputs (e.g. fp16) until we do the first step
+                aux_outputs = aux_out.new_zeros(max_len + 1, bsz * beam_size, aux_out.shape[-1])
+                aux_nbest = self._init_aux_nbest(
+                    bsz, beam_size, max_len + 1, aux_out, lprobs, with_tags=aux_tags_lprobs is not None)
             # Assign the auxiliary outputs for this decoding step (only the current decoding step is returned)
             aux_outputs[step] = aux_out.squeeze(1)
             lprobs[lprobs != lprobs] = torch.tensor(-math.inf).to(lprobs)
@@ -706,13 +735,11 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
                     eos_bbsz_idx,
                     eos_scores,
                     aux_tokens,
-                    encoder_outs,
                     aux_outputs,
-                    scores,
-                    finalized,
+                    aux_nbest,
+                    num_finalized,
                     finished,
                     beam_size,
-                    attn,
                     aux_tags,
                     src_lengths,
                     max_len,
@@ -816,19 +843,35 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
             # reorder incremental state in decoder
             reorder_state = active_bbsz_idx
 
-        # sort by score descending
-        # for sent in range(len(finalized)):
-        #     # make into beam container
-        #     BCList = [
-        #         BeamContainer(elem["score"].item(), elem) for elem in finalized[sent]
-        #     ]
-        #     BCList.sort()
-        #     BCList.reverse()
-        #     finalized[sent] = torch.jit.annotate(
-        #         List[Dict[str, Tensor]], [x.elem for x in BCList]
-        #     )
+        return aux_nbest
 
-        return finalized
+    def _init_aux_nbest(
+        self,
+        bsz: int,
+        beam_size: int,
+        max_len: int,
+        aux_out: Tensor,
+        lprobs: Tensor,
+        with_tags: bool,
+    ) -> Dict[str, Optional[Tensor]]:
+        """Allocates on the device the buffers where :meth:`finalize_aux_hypos`
+        packs the n-best hypotheses of the auxiliary decoder, which are read
+        by the second phase without any further copy:
+         - *tokens*: bsz x beam_size x max_len, padded with the source pad;
+         - *lengths*: bsz x beam_size;
+         - *aux_tags*: bsz x beam_size x max_len (None if the model does not predict tags);
+         - *auxiliary_out*: bsz x beam_size x max_len x C, in the type of the auxiliary decoder outputs;
+         - *scores*: bsz x beam_size.
+        """
+        return {
+            "tokens": torch.full(
+                (bsz, beam_size, max_len), self.src_pad, dtype=torch.long, device=aux_out.device),
+            "lengths": torch.zeros(bsz, beam_size, dtype=torch.long, device=aux_out.device),
+            "aux_tags": torch.zeros(
+                bsz, beam_size, max_len, dtype=torch.long, device=aux_out.device) if with_tags else None,
+            "auxiliary_out": aux_out.new_full((bsz, beam_size, max_len, aux_out.shape[-1]), self.src_pad),
+            "scores": lprobs.new_zeros(bsz, beam_size),
+        }
 
     def _prefix_tokens(
         self, step: int, lprobs, scores, tokens, prefix_tokens, beam_size: int, pad, eos
@@ -865,50 +908,24 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
         bbsz_idx,
         eos_scores,
         tokens,
-        encoder_outs,
         decoder_out,
-        scores,
-        finalized: List[List[Dict[str, Tensor]]],
+        aux_nbest: Dict[str, Optional[Tensor]],
+        num_finalized: List[int],
         finished: List[bool],
         beam_size: int,
-        attn: Optional[Tensor],
         aux_tags: Optional[Tensor],
         src_lengths,
         max_len: int,
         eos,
     ):
-        """Finalize hypothesis, store finalized information in `finalized`, and change `finished` accordingly.
+        """Finalize hypothesis, pack them into the `aux_nbest` buffers (see `_init_aux_nbest`),
+        and change `num_finalized` and `finished` accordingly.
         Returns number of sentences being finalized.
         Args:
             bbsz_idx (Tensor):
         """
         assert bbsz_idx.numel() == eos_scores.numel()
 
-        # clone relevant token and attention tensors
-        tokens_clone = tokens.index_select(0, bbsz_idx)[
-            :, 1 : step + 2
-        ]  # skip the first index, which is EOS
-        decoder_out_clone = decoder_out.index_select(1, bbsz_idx)[: step + 1].transpose(0, 1)
-        encoder_outs_clone = self.model.reorder_encoder_out(encoder_outs, bbsz_idx)
-
-        tokens_clone[:, step] = eos
-        attn_clone = (
-            attn.index_select(0, bbsz_idx)[:, :, 1 : step + 2]
-            if attn is not None
-            else None
-        )
-        aux_tags_clone = (
-            aux_tags.index_select(0, bbsz_idx)[:, 1: step + 2]
-            if aux_tags is not None
-            else None
-        )
-
-        # compute scores per token position
-        pos_scores = scores.index_select(0, bbsz_idx)[:, : step + 1]
-        pos_scores[:, step] = eos_scores
-        # convert from cumulative to per-position scores
-        pos_scores[:, 1:] = pos_scores[:, 1:] - pos_scores[:, :-1]
-
         # normalize sentence-level scores
         if self.normalize_scores:
             eos_scores /= (step + 1) ** self.len_penalty
@@ -923,43 +940,47 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
 
         # set() is not supported in script export
         sents_seen: Dict[str, Optional[Tensor]] = {}
-        for i in range(bbsz_idx.size()[0]):
-            idx = bbsz_idx[i]
-            score = eos_scores[i]
+        # the hypotheses to keep, and the sentence and position in the n-best where they go
+        keep_idxs: List[int] = []
+        keep_sents: List[int] = []
+        keep_slots: List[int] = []
+        for i, idx in enumerate(bbsz_idx.tolist()):
             unfin_idx = idx // beam_size
             sent = unfin_idx + cum_unfin[unfin_idx]
             # Cannot create dict for key type '(int, int)' in torchscript.
             # The workaround is to cast int to string
-            seen = str(sent.item()) + "_" + str(unfin_idx.item())
+            seen = str(sent) + "_" + str(unfin_idx)
             if seen not in sents_seen:
                 sents_seen[seen] = None
 
-            if self.match_source_len and step > src_lengths[unfin_idx]:
-                score = torch.tensor(-math.inf).to(score)
-
-            if len(finalized[sent]) < beam_size:
-                if attn_clone is not None:
-                    # remove padding tokens from attn scores
-                    hypo_attn = attn_clone[i]
-                else:
-                    hypo_attn = torch.empty(0)
-                if aux_tags_clone is not None:
-                    aux_hypo_tags = aux_tags_clone[i]
-                else:
-                    aux_hypo_tags = None
-                finalized[sent].append(
-                    {
-                        "tokens": tokens_clone[i],
-                        "auxiliary_out": decoder_out_clone[i],
-                        "encoder_outs": self.model.reorder_encoder_out(
-                            encoder_outs_clone, torch.tensor([i], dtype=torch.long).to(tokens_clone.device)),
-                        "score": score,
-                        "attention": hypo_attn,  # src_len x tgt_len
-                        "alignment": torch.empty(0),
-                        "positional_scores": pos_scores[i],
-                        "aux_tags": aux_hypo_tags,
-                    }
-                )
+            if num_finalized[sent] < beam_size:
+                keep_idxs.append(i)
+                keep_sents.append(sent)
+                keep_slots.append(num_finalized[sent])
+                num_finalized[sent] += 1
+
+        if len(keep_idxs) > 0:
+            keep = torch.tensor(keep_idxs, dtype=torch.long, device=bbsz_idx.device)
+            sents = torch.tensor(keep_sents, dtype=torch.long, device=bbsz_idx.device)
+            slots = torch.tensor(keep_slots, dtype=torch.long, device=bbsz_idx.device)
+            kept_bbsz_idx = bbsz_idx.index_select(0, keep)
+            kept_scores = eos_scores.index_select(0, keep)
+            if self.match_source_len:
+                kept_scores = kept_scores.masked_fill(
+                    src_lengths.index_select(0, kept_bbsz_idx // beam_size) < step, -math.inf)
+
+            # skip the first index, which is EOS
+            tokens_clone = tokens.index_select(0, kept_bbsz_idx)[:, 1: step + 2]
+            tokens_clone[:, step] = eos
+            # copy all the kept hypotheses at once in their position of the n-best
+            aux_nbest["tokens"][sents, slots, : step + 1] = tokens_clone
+            aux_nbest["lengths"][sents, slots] = step + 1
+            aux_nbest["auxiliary_out"][sents, slots, : step + 1] = \
+                decoder_out[: step + 1].index_select(1, kept_bbsz_idx).transpose(0, 1)
+            aux_nbest["scores"][sents, slots] = kept_scores.to(aux_nbest["scores"])
+            if aux_tags is not None and aux_nbest["aux_tags"] is not None:
+                aux_nbest["aux_tags"][sents, slots, : step + 1] = \
+                    aux_tags.index_select(0, kept_bbsz_idx)[:, 1: step + 2]
 
         newly_finished: List[int] = []
         for seen in sents_seen.keys():
@@ -967,7 +988,7 @@ class TwoPhaseSequenceGenerator(SequenceGenerator):
             sent: int = int(float(seen.split("_")[0]))
             unfin_idx: int = int(float(seen.split("_")[1]))
             if not finished[sent] and self.is_finished(
-                step, unfin_idx, max_len, len(finalized[sent]), beam_size
+                step, unfin_idx, max_len, num_finalized[sent], beam_size
             ):
                 finished[sent] = True
                 newly_finished.append(unfin_idx)
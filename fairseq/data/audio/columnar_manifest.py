@@ -0,0 +1,225 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import csv
+import json
+import logging
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+_HDR_MAGIC = b"S2TCOLS\x00"
+_VERSION = 1
+_ALIGNMENT = 8
+
+
+class StringColumn(Sequence):
+    """A column of strings stored as UTF-8 bytes one after the other in a
+    single array, together with the array of their offsets. Compared to a list
+    of strings, there are no per-string Python objects, so the column takes
+    less memory and its pages are not copied by the forked processes (e.g.
+    the DataLoader workers), as no reference counter is updated on access."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        assert offsets.ndim == 1 and len(offsets) > 0
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "StringColumn":
+        data = bytearray()
+        offsets = array("q", [0])
+        for s in strings:
+            data += s.encode("utf-8")
+            offsets.append(len(data))
+        return cls(np.frombuffer(bytes(data), dtype=np.uint8), np.array(offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _get(self, index: int) -> str:
+        return self.data[self.offsets[index]: self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, index) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"index {index} out of range")
+        return self._get(index)
+
+    def __iter__(self):
+        data = self.data.tobytes() if len(self.data) > 0 else b""
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+
+def cache_file_path(tsv_path: str) -> str:
+    return tsv_path + ".columns"
+
+
+class ColumnarManifest(object):
+    """The columns of a TSV manifest, where the integer columns (e.g.
+    n_frames) are NumPy arrays and the others are :class:`StringColumn`.
+
+    :meth:`from_tsv` caches the columns in a binary file next to the TSV,
+    which is memory-mapped (read-only) by the following loads, so that the
+    processes loading the same manifest share the same pages.
+    """
+
+    def __init__(self, columns: Dict[str, Union[StringColumn, np.ndarray]]):
+        lengths = {len(c) for c in columns.values()}
+        assert len(lengths) <= 1, "all the columns must have the same length"
+        self.columns = columns
+        self._len = lengths.pop() if len(lengths) > 0 else 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, name: str):
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> Union[StringColumn, np.ndarray]:
+        return self.columns[name]
+
+    def get(self, name: str, default: Optional[str] = None) -> Union[StringColumn, np.ndarray]:
+        """Returns the column *name*, or a column filled with *default* if it is missing."""
+        if name in self.columns:
+            return self.columns[name]
+        return StringColumn.from_strings(default for _ in range(len(self)))
+
+    @classmethod
+    def read_tsv(cls, tsv_path: str, int_columns: Iterable[str] = ()) -> "ColumnarManifest":
+        """Reads the columns of the TSV. As with :class:`csv.DictReader`, the empty
+        lines are skipped and the values exceeding the header are ignored, while
+        the rows with fewer values than the header are not accepted."""
+        int_columns = set(int_columns)
+        with open(tsv_path) as f:
+            reader = csv.reader(
+                f,
+                delimiter="\t",
+                quotechar=None,
+                doublequote=False,
+                lineterminator="\n",
+                quoting=csv.QUOTE_NONE,
+            )
+            names = next(reader, [])
+            values = [array("q") if n in int_columns else bytearray() for n in names]
+            offsets = [array("q", [0]) for _ in names]
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                if len(row) < len(names):
+                    raise ValueError(
+                        f"line {reader.line_num} of {tsv_path} contains {len(row)} values "
+                        f"instead of {len(names)}: {row}")
+                for i, value in enumerate(row[:len(names)]):
+                    if names[i] in int_columns:
+                        values[i].append(int(value))
+                    else:
+                        values[i] += value.encode("utf-8")
+                        offsets[i].append(len(values[i]))
+        columns = {}
+        for name, column_values, column_offsets in zip(names, values, offsets):
+            if name in int_columns:
+                columns[name] = np.array(column_values, dtype=np.int64)
+            else:
+                columns[name] = StringColumn(
+                    np.frombuffer(bytes(column_values), dtype=np.uint8),
+                    np.array(column_offsets, dtype=np.int64),
+                )
+        return cls(columns)
+
+    def _arrays(self):
+        for name, column in self.columns.items():
+            if isinstance(column, StringColumn):
+                yield name, "str", [column.data, column.offsets]
+            else:
+                yield name, "int", [column]
+
+    def save(self, path: str, tsv_stat: os.stat_result):
+        header = {"tsv_size": tsv_stat.st_size, "tsv_mtime_ns": tsv_stat.st_mtime_ns, "columns": []}
+        arrays = []
+        offset = 0
+        for name, kind, column_arrays in self._arrays():
+            entries = []
+            for a in column_arrays:
+                entries.append({"dtype": a.dtype.str, "length": len(a), "offset": offset})
+                arrays.append(a)
+                offset += -(-a.nbytes // _ALIGNMENT) * _ALIGNMENT
+            header["columns"].append({"name": name, "kind": kind, "arrays": entries})
+        encoded_header = json.dumps(header).encode("utf-8")
+        encoded_header += b" " * (-len(encoded_header) % _ALIGNMENT)
+        # written with a temporary name, as more processes may load the same manifest
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HDR_MAGIC)
+            f.write(struct.pack("<Q", _VERSION))
+            f.write(struct.pack("<Q", len(encoded_header)))
+            f.write(encoded_header)
+            for a in arrays:
+                f.write(a.tobytes(order="C"))
+                f.write(b"\0" * (-a.nbytes % _ALIGNMENT))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, tsv_stat: Optional[os.stat_result] = None) -> Optional["ColumnarManifest"]:
+        """Loads the columns saved in *path*, or returns None if they have been
+        saved from a TSV that differs (in size or modification time) from *tsv_stat*."""
+        with open(path, "rb") as f:
+            if f.read(len(_HDR_MAGIC)) != _HDR_MAGIC:
+                return None
+            (version,) = struct.unpack("<Q", f.read(8))
+            if version != _VERSION:
+                return None
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if tsv_stat is not None and (
+                header["tsv_size"] != tsv_stat.st_size or header["tsv_mtime_ns"] != tsv_stat.st_mtime_ns):
+            return None
+        data_offset = len(_HDR_MAGIC) + 16 + header_len
+        buffer = None
+        if os.path.getsize(path) > data_offset:
+            buffer = np.memmap(path, dtype=np.uint8, mode="r", offset=data_offset)
+
+        def read_array(entry):
+            dtype = np.dtype(entry["dtype"])
+            if entry["length"] == 0:
+                return np.empty(0, dtype=dtype)
+            return np.frombuffer(buffer, dtype=dtype, count=entry["length"], offset=entry["offset"])
+
+        columns = {}
+        for column in header["columns"]:
+            arrays = [read_array(entry) for entry in column["arrays"]]
+            columns[column["name"]] = StringColumn(*arrays) if column["kind"] == "str" else arrays[0]
+        return cls(columns)
+
+    @classmethod
+    def from_tsv(cls, tsv_path: str, int_columns: Iterable[str] = (), cache: bool = True) -> "ColumnarManifest":
+        """Reads the TSV manifest, or its cached columns if they are up to date."""
+        if not cache:
+            return cls.read_tsv(tsv_path, int_columns)
+        cache_path = cache_file_path(tsv_path)
+        tsv_stat = os.stat(tsv_path)
+        if os.path.isfile(cache_path):
+            manifest = cls.load(cache_path, tsv_stat)
+            if manifest is not None and not any(
+                    isinstance(manifest.columns.get(c), StringColumn) for c in int_columns):
+                return manifest
+        manifest = cls.read_tsv(tsv_path, int_columns)
+        try:
+            manifest.save(cache_path, tsv_stat)
+        except OSError as e:
+            logger.warning(f"Cannot cache the columns of {tsv_path} in {cache_path}: {e}")
+        return manifest
@@ -0,0 +1,161 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+
+_HDR_MAGIC = b"PKFEATIDX"
+_VERSION = 1
+dtypes = {
+    1: np.float16,
+    2: np.float32,
+    3: np.float64,
+    4: np.int32,
+    5: np.int64,
+    6: np.int16,
+}
+
+
+def code(dtype) -> int:
+    for k, v in dtypes.items():
+        if np.dtype(v) == np.dtype(dtype):
+            return k
+    raise ValueError(dtype)
+
+
+def index_file_path(prefix_path: str) -> str:
+    return prefix_path + ".idx"
+
+
+def data_file_path(prefix_path: str) -> str:
+    return prefix_path + ".bin"
+
+
+class PackedFeatures(object):
+    """Features (2-D arrays, e.g. filterbanks of shape n_frames x n_mel_bins)
+    packed in a single data file, similarly to
+    :class:`fairseq.data.indexed_dataset.MMapIndexedDataset`. The data file
+    contains the arrays one after the other in C order, while the index
+    contains their offsets (in items of the stored dtype) and their shapes.
+
+    The data file is memory-mapped (copy-on-write) the first time a process
+    reads from it, so that each process (e.g. each DataLoader worker) has its
+    own mapping. The arrays stored as float32 are returned as views over the
+    mapping, while those stored as float16 are converted to float32.
+    """
+
+    def __init__(self, prefix_path: str):
+        self.prefix_path = prefix_path
+        with open(index_file_path(prefix_path), "rb") as stream:
+            magic_test = stream.read(len(_HDR_MAGIC))
+            assert _HDR_MAGIC == magic_test, (
+                f"{index_file_path(prefix_path)} is not an index of packed features"
+            )
+            version = struct.unpack("<Q", stream.read(8))
+            assert (_VERSION,) == version
+            (dtype_code,) = struct.unpack("<B", stream.read(1))
+            self.dtype = np.dtype(dtypes[dtype_code])
+            (self._len,) = struct.unpack("<Q", stream.read(8))
+            self.offsets = np.frombuffer(stream.read(8 * self._len), dtype=np.int64)
+            self.shapes = np.frombuffer(
+                stream.read(16 * self._len), dtype=np.int64
+            ).reshape(self._len, 2)
+        self._data = None
+        self._pid = None
+
+    def __len__(self):
+        return self._len
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"], state["_pid"] = None, None
+        return state
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """Number of frames (first dimension) of each array."""
+        return self.shapes[:, 0]
+
+    def _get_data(self) -> np.ndarray:
+        if self._pid != os.getpid():
+            self._data = None
+            self._pid = os.getpid()
+        if self._data is None:
+            if os.path.getsize(data_file_path(self.prefix_path)) == 0:
+                self._data = np.empty(0, dtype=self.dtype)
+            else:
+                self._data = np.memmap(
+                    data_file_path(self.prefix_path), dtype=self.dtype, mode="c"
+                )
+        return self._data
+
+    def get(self, index: int) -> np.ndarray:
+        shape = self.shapes[index]
+        offset = self.offsets[index]
+        array = self._get_data()[offset: offset + shape[0] * shape[1]].reshape(shape)
+        if self.dtype == np.float16:
+            array = array.astype(np.float32)
+        return array
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.get(index)
+
+
+class PackedFeaturesBuilder(object):
+    """Writes the features to be read with :class:`PackedFeatures`.
+    The features are converted to *dtype*, e.g. float16 halves the size of
+    the files at the cost of some precision."""
+
+    def __init__(self, prefix_path: str, dtype=np.float32):
+        self.prefix_path = prefix_path
+        self.dtype = np.dtype(dtype)
+        code(self.dtype)
+        self._data_file = open(data_file_path(prefix_path), "wb")
+        self._offsets: List[int] = []
+        self._shapes: List[Tuple[int, int]] = []
+        self._next_offset = 0
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add_item(self, features: np.ndarray) -> int:
+        """Appends the (2-D) *features* and returns their index."""
+        assert features.ndim == 2, "only 2-D features can be packed"
+        features = np.ascontiguousarray(features, dtype=self.dtype)
+        self._data_file.write(features.tobytes(order="C"))
+        self._offsets.append(self._next_offset)
+        self._shapes.append(features.shape)
+        self._next_offset += features.size
+        return len(self._offsets) - 1
+
+    def manifest_path(self, index: int, prefix_path: str = None) -> str:
+        """Returns the path of the *index*-th features to be written in the
+        manifests, using *prefix_path* (e.g. a relative path) if given."""
+        return f"{data_file_path(prefix_path or self.prefix_path)}:{index}"
+
+    def finalize(self):
+        self._data_file.close()
+        with open(index_file_path(self.prefix_path), "wb") as index:
+            index.write(_HDR_MAGIC)
+            index.write(struct.pack("<Q", _VERSION))
+            index.write(struct.pack("<B", code(self.dtype)))
+            index.write(struct.pack("<Q", len(self._offsets)))
+            index.write(np.array(self._offsets, dtype=np.int64).tobytes(order="C"))
+            index.write(
+                np.array(self._shapes, dtype=np.int64).reshape(-1, 2).tobytes(order="C")
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self._data_file.close()
@@ -3,12 +3,16 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import csv
+import hashlib
 import io
+import json
 import logging
+import mmap
+import os
 import os.path as op
 import re
-from typing import Dict, List, Optional, Tuple
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -17,10 +21,12 @@ from fairseq.data import (
     Dictionary,
     FairseqDataset,
     ResamplingDataset,
-    data_utils as fairseq_data_utils,
 )
 from fairseq.data.audio.audio_utils import get_fbank, get_waveform
+from fairseq.data.audio.columnar_manifest import ColumnarManifest, StringColumn
 from fairseq.data.audio.feature_transforms import CompositeAudioFeatureTransform
+from fairseq.data.audio.packed_features import PackedFeatures
+from fairseq.data.indexed_dataset import MMapIndexedDataset
 
 
 logger = logging.getLogger(__name__)
@@ -105,6 +111,12 @@ class S2TDataConfig(object):
         the root path. Set this to empty string when using absolute paths."""
         return self.config.get("audio_root", "")
 
+    @property
+    def token_lengths_workers(self):
+        """Number of processes computing the number of tokens of the texts
+        when the dataset is loaded (the lengths are cached next to the TSV)."""
+        return self.config.get("token_lengths_workers", min(8, os.cpu_count() or 1))
+
     def get_feature_transforms(self, split, is_train):
         """Split-specific feature transforms. Allowing train set wildcard `_train`,
         evaluation set wildcard `_eval` and general wildcard `*` for matching."""
@@ -149,6 +161,10 @@ def get_features_or_waveform_from_uncompressed_zip(
 ):
     assert path.endswith(".zip")
     data = read_from_uncompressed_zip(path, byte_offset, byte_size)
+    return get_features_or_waveform_from_bytes(data, path, need_waveform=need_waveform)
+
+
+def get_features_or_waveform_from_bytes(data: bytes, path, need_waveform=False):
     f = io.BytesIO(data)
     if is_npy_data(data):
         features_or_waveform = np.load(f)
@@ -165,8 +181,9 @@ def get_features_or_waveform(path: str, need_waveform=False):
     offset and length.
 
     Args:
-        path (str): File path in the format of "<.npy/.wav/.flac path>" or
-        "<zip path>:<byte offset>:<byte length>".
+        path (str): File path in the format of "<.npy/.wav/.flac path>",
+        "<zip path>:<byte offset>:<byte length>" or
+        "<packed features .bin path>:<index>".
         need_waveform (bool): return waveform instead of features.
 
     Returns:
@@ -180,6 +197,9 @@ def get_features_or_waveform(path: str, need_waveform=False):
         if need_waveform:
             return get_waveform(_path)
         return get_features_from_npy_or_audio(_path)
+    elif len(extra) == 1:
+        assert not need_waveform, "packed features do not contain waveforms"
+        features_or_waveform = open_packed_features(_path).get(int(extra[0]))
     elif len(extra) == 2:
         extra = [int(i) for i in extra]
         features_or_waveform = get_features_or_waveform_from_uncompressed_zip(
@@ -191,25 +211,340 @@ def get_features_or_waveform(path: str, need_waveform=False):
     return features_or_waveform
 
 
+def open_packed_features(path: str) -> PackedFeatures:
+    if not path.endswith(".bin"):
+        raise ValueError(f"Invalid path of packed features: {path}")
+    return PackedFeatures(path[: -len(".bin")])
+
+
+def parse_npy_header(data) -> Tuple[Tuple[int, ...], bool, np.dtype, int]:
+    """Parse the header of the .npy file contained in a bytes-like object.
+
+    Returns:
+        the shape, the Fortran order flag and the dtype of the array,
+        and the offset of the array data.
+    """
+    version = (data[6], data[7])
+    if version == (1, 0):
+        data_offset = 10 + int.from_bytes(data[8:10], "little")
+    else:
+        data_offset = 12 + int.from_bytes(data[8:12], "little")
+    header = io.BytesIO(data[:data_offset])
+    np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    return shape, fortran_order, dtype, data_offset
+
+
+class FeatureStore(object):
+    """Reads the speech features (or waveforms) of a list of paths in the
+    formats accepted by :func:`get_features_or_waveform`.
+
+    The "<zip path>:<byte offset>:<byte length>" paths are parsed once into
+    integer arrays, and each uncompressed ZIP file is memory-mapped the first
+    time a process reads it, so that the .npy features are returned as views
+    over the mapping without system calls or copies. The mapping is
+    copy-on-write, so the views are writable but the file is never modified.
+    Each process (e.g. each DataLoader worker) opens its own mappings.
+    The "<packed features .bin path>:<index>" paths are read in the same way
+    from the :class:`~fairseq.data.audio.packed_features.PackedFeatures`.
+    The other paths are read with :func:`get_features_or_waveform`.
+    """
+
+    def __init__(self, paths: List[str]):
+        self.zip_paths: List[str] = []
+        self.packed_features: List[PackedFeatures] = []
+        zip_ids_by_path: Dict[str, int] = {}
+        packed_ids_by_path: Dict[str, int] = {}
+        self.other_paths: Dict[int, str] = {}
+        # the ID of the zip of each path, or -1 - the ID of its packed features
+        self.file_ids = np.zeros(len(paths), dtype=np.int32)
+        self.offsets = np.zeros(len(paths), dtype=np.int64)
+        self.sizes = np.zeros(len(paths), dtype=np.int64)
+        for i, path in enumerate(paths):
+            _path, *extra = path.split(":")
+            if len(extra) == 2:
+                file_id = zip_ids_by_path.get(_path)
+                if file_id is None:
+                    if not op.exists(_path):
+                        raise FileNotFoundError(f"File not found: {_path}")
+                    file_id = len(self.zip_paths)
+                    zip_ids_by_path[_path] = file_id
+                    self.zip_paths.append(_path)
+                self.file_ids[i] = file_id
+                self.offsets[i], self.sizes[i] = int(extra[0]), int(extra[1])
+            elif len(extra) == 1:
+                file_id = packed_ids_by_path.get(_path)
+                if file_id is None:
+                    file_id = -1 - len(self.packed_features)
+                    packed_ids_by_path[_path] = file_id
+                    self.packed_features.append(open_packed_features(_path))
+                self.file_ids[i] = file_id
+                self.offsets[i] = int(extra[0])
+            else:
+                self.other_paths[i] = path
+        self._mmaps = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mmaps"], state["_pid"] = None, None
+        return state
+
+    def _get_mmap(self, zip_id: int) -> mmap.mmap:
+        if self._pid != os.getpid():
+            # the mappings of the parent process are not reused after a fork
+            self._mmaps = [None] * len(self.zip_paths)
+            self._pid = os.getpid()
+        zip_mmap = self._mmaps[zip_id]
+        if zip_mmap is None:
+            with open(self.zip_paths[zip_id], "rb") as f:
+                zip_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._mmaps[zip_id] = zip_mmap
+        return zip_mmap
+
+    def get(self, index: int, need_waveform=False):
+        if index in self.other_paths:
+            return get_features_or_waveform(
+                self.other_paths[index], need_waveform=need_waveform
+            )
+        file_id = int(self.file_ids[index])
+        if file_id < 0:
+            assert not need_waveform, "packed features do not contain waveforms"
+            return self.packed_features[-1 - file_id].get(int(self.offsets[index]))
+        offset, size = int(self.offsets[index]), int(self.sizes[index])
+        data = memoryview(self._get_mmap(file_id))[offset: offset + size]
+        if not is_npy_data(data):
+            return get_features_or_waveform_from_bytes(
+                bytes(data), self.zip_paths[file_id], need_waveform=need_waveform
+            )
+        shape, fortran_order, dtype, data_offset = parse_npy_header(data)
+        features = np.frombuffer(
+            data, dtype=dtype, count=int(np.prod(shape)), offset=data_offset
+        )
+        return features.reshape(shape, order="F" if fortran_order else "C")
+
+
+_lengths_tokenizers = None
+
+
+def _init_token_lengths_worker(pre_tokenizer, bpe_tokenizer):
+    global _lengths_tokenizers
+    _lengths_tokenizers = (pre_tokenizer, bpe_tokenizer)
+
+
+def _token_lengths(texts: List[str]) -> List[int]:
+    pre_tokenizer, bpe_tokenizer = _lengths_tokenizers
+    lengths = []
+    for text in texts:
+        if pre_tokenizer is not None:
+            text = pre_tokenizer.encode(text)
+        if bpe_tokenizer is not None:
+            text = bpe_tokenizer.encode(text)
+        lengths.append(len(text.split(" ")))
+    return lengths
+
+
+def compute_token_lengths(
+    texts: List[str], pre_tokenizer=None, bpe_tokenizer=None, num_workers: int = 1, chunk_size: int = 10000
+) -> np.ndarray:
+    """Returns the number of tokens of the *texts* after the pre-tokenization
+    and the subword tokenization, computed by *num_workers* processes."""
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if num_workers > 1 and len(chunks) > 1:
+        with Pool(
+            min(num_workers, len(chunks)),
+            initializer=_init_token_lengths_worker,
+            initargs=(pre_tokenizer, bpe_tokenizer),
+        ) as pool:
+            lengths = pool.map(_token_lengths, chunks)
+    else:
+        _init_token_lengths_worker(pre_tokenizer, bpe_tokenizer)
+        lengths = [_token_lengths(chunk) for chunk in chunks]
+    return np.array([length for chunk in lengths for length in chunk], dtype=np.int64)
+
+
+def _tokenizers_fingerprint(tokenizer_cfgs: List[Dict], data_root: Optional[str] = None) -> bytes:
+    """The configurations of the tokenizers, together with the content
+    of the files they refer to (e.g. the sentencepiece models). Relative
+    paths are looked up both in the working directory and in *data_root*."""
+    fingerprint = hashlib.sha1(json.dumps(tokenizer_cfgs, sort_keys=True).encode())
+    for cfg in tokenizer_cfgs:
+        for value in cfg.values():
+            if not isinstance(value, str):
+                continue
+            paths = [value]
+            if data_root and not op.isabs(value):
+                paths.append(op.join(data_root, value))
+            for path in paths:
+                if op.isfile(path):
+                    with open(path, "rb") as f:
+                        fingerprint.update(f.read())
+    return fingerprint.digest()
+
+
+def texts_fingerprint(
+    texts: Sequence[str],
+    tokenizer_cfgs: Optional[List[Dict]] = None,
+    data_root: Optional[str] = None,
+    dictionary: Optional[Dictionary] = None,
+) -> str:
+    """Hash of the *texts*, of the tokenizers (see :func:`_tokenizers_fingerprint`)
+    and, if given, of the symbols of the *dictionary*."""
+    key = hashlib.sha1(_tokenizers_fingerprint(tokenizer_cfgs or [], data_root))
+    key.update("\n".join(texts).encode("utf-8"))
+    if dictionary is not None:
+        key.update("\n".join(dictionary.symbols).encode("utf-8"))
+    return key.hexdigest()
+
+
+def cached_token_lengths(
+    cache_prefix: Optional[str],
+    texts: List[str],
+    pre_tokenizer=None,
+    bpe_tokenizer=None,
+    tokenizer_cfgs: Optional[List[Dict]] = None,
+    num_workers: int = 1,
+) -> np.ndarray:
+    """Same as :func:`compute_token_lengths`, but the lengths are stored in
+    (and then loaded from) *cache_prefix*.<hash>.npy, where the hash depends
+    on the texts and on the configuration of the tokenizers, whose files can
+    be relative to the directory of *cache_prefix* (i.e. the data root)."""
+    if cache_prefix is None:
+        return compute_token_lengths(texts, pre_tokenizer, bpe_tokenizer, num_workers)
+    key = texts_fingerprint(texts, tokenizer_cfgs, op.dirname(cache_prefix))
+    cache_path = f"{cache_prefix}.{key[:16]}.npy"
+    if op.isfile(cache_path):
+        lengths = np.load(cache_path)
+        if len(lengths) == len(texts):
+            return lengths
+    lengths = compute_token_lengths(texts, pre_tokenizer, bpe_tokenizer, num_workers)
+    try:
+        # written with a temporary name, as more processes may load the same dataset
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, lengths)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Cannot cache the token lengths in {cache_path}: {e}")
+    return lengths
+
+
+def binarized_tokens_prefix(tsv_path: str, side: str) -> str:
+    """Prefix of the token IDs of the *side* ("tgt" or "src") texts of a TSV,
+    binarized by examples/speech_to_text/scripts/binarize_texts.py."""
+    return f"{tsv_path}.{side}_tokens"
+
+
+def binarized_tokens_fingerprint_path(prefix: str) -> str:
+    """File containing the :func:`texts_fingerprint` of the texts, dictionary
+    and tokenizers from which the tokens in *prefix*.bin/.idx are obtained."""
+    return f"{prefix}.fingerprint"
+
+
+def open_binarized_tokens(
+    prefix: str,
+    texts: Sequence[str],
+    dictionary: Dictionary,
+    tokenizer_cfgs: List[Dict],
+) -> Optional[MMapIndexedDataset]:
+    """Returns the binarized token IDs of the *texts* stored in *prefix*.bin/.idx,
+    if present and obtained with the same *dictionary* and tokenizers."""
+    if not MMapIndexedDataset.exists(prefix):
+        return None
+    fingerprint_path = binarized_tokens_fingerprint_path(prefix)
+    fingerprint = None
+    if op.isfile(fingerprint_path):
+        with open(fingerprint_path) as f:
+            fingerprint = f.read().strip()
+    if fingerprint != texts_fingerprint(texts, tokenizer_cfgs, op.dirname(prefix), dictionary):
+        logger.warning(
+            f"{prefix} has not been binarized from the current texts, dictionary and tokenizers, "
+            f"so it is ignored and the texts are tokenized on the fly")
+        return None
+    tokens = MMapIndexedDataset(prefix)
+    if len(tokens) != len(texts):
+        logger.warning(f"{prefix} contains {len(tokens)} sentences instead of {len(texts)}, so it is ignored")
+        return None
+    logger.info(f"Loaded binarized tokens from {prefix}")
+    return tokens
+
+
+def _collate_padded(
+    tensors: List[torch.Tensor],
+    pad_value,
+    order: Optional[torch.Tensor] = None,
+    pad_to_length: Optional[int] = None,
+) -> torch.Tensor:
+    """
+    Convert a list of tensors, whose dimensions after the first one are the
+    same, into a single tensor padded with *pad_value*. The output is
+    allocated once and its i-th row contains ``tensors[order[i]]``, so no
+    copy is needed to reorder it.
+    Args:
+        tensors (list): list of tensors of size L[i]*...
+        order (torch.Tensor): order of the tensors in the output (default: as in the list)
+        pad_to_length (int): minimum length of the output
+    Returns:
+        tensor of size len(tensors)*len_max*... where len_max is max of L[i] (and *pad_to_length*)
+    """
+    max_len = max(t.size(0) for t in tensors)
+    max_len = max_len if pad_to_length is None else max(max_len, pad_to_length)
+    out = torch.empty(
+        (len(tensors), max_len) + tuple(tensors[0].shape[1:]),
+        dtype=tensors[0].dtype,
+    )
+    out.fill_(pad_value)
+    order = range(len(tensors)) if order is None else order.tolist()
+    for i, j in enumerate(order):
+        out[i, : tensors[j].size(0)] = tensors[j]
+    return out
+
+
 def _collate_frames(
-    frames: List[torch.Tensor], is_audio_input: bool = False
+    frames: List[torch.Tensor],
+    is_audio_input: bool = False,
+    order: Optional[torch.Tensor] = None,
 ) -> torch.Tensor:
     """
     Convert a list of 2D frames into a padded 3D tensor
     Args:
         frames (list): list of 2D frames of size L[i]*f_dim. Where L[i] is
             length of i-th frame and f_dim is static dimension of features
+        order (torch.Tensor): order of the frames in the output (see :func:`_collate_padded`)
     Returns:
         3D tensor of size len(frames)*len_max*f_dim where len_max is max of L[i]
     """
-    max_len = max(frame.size(0) for frame in frames)
-    if is_audio_input:
-        out = frames[0].new_zeros((len(frames), max_len))
-    else:
-        out = frames[0].new_zeros((len(frames), max_len, frames[0].size(1)))
-    for i, v in enumerate(frames):
-        out[i, : v.size(0)] = v
-    return out
+    return _collate_padded(frames, 0.0, order=order)
+
+
+def _collate_target(
+    tokens: List[torch.Tensor],
+    pad_idx: int,
+    eos_idx: int,
+    order: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Collate the token sequences (ending with *eos_idx*) into the padded
+    targets, the previous output tokens (i.e. the targets shifted right
+    starting with *eos_idx*, as returned by
+    :func:`fairseq.data.data_utils.collate_tokens` with
+    ``move_eos_to_beginning=True``) and the lengths, all ordered by *order*.
+    """
+    target = _collate_padded(tokens, pad_idx, order=order)
+    order = range(len(tokens)) if order is None else order.tolist()
+    lengths = torch.tensor([tokens[j].size(0) for j in order], dtype=torch.long)
+    prev_output_tokens = torch.empty_like(target)
+    prev_output_tokens[:, 0] = eos_idx
+    prev_output_tokens[:, 1:] = target[:, :-1]
+    prev_output_tokens.masked_fill_(
+        torch.arange(target.size(1)).unsqueeze(0) >= lengths.unsqueeze(1), pad_idx)
+    return target, prev_output_tokens, lengths
 
 
 class SpeechToTextDataset(FairseqDataset):
@@ -235,6 +570,8 @@ class SpeechToTextDataset(FairseqDataset):
         self.split, self.is_train_split = split, is_train_split
         self.data_cfg = data_cfg
         self.audio_paths, self.n_frames = audio_paths, n_frames
+        self._sizes = np.asarray(n_frames, dtype=np.int64)
+        self.audio_store = FeatureStore(audio_paths)
         self.n_samples = len(audio_paths)
         assert len(n_frames) == self.n_samples > 0
         assert src_texts is None or len(src_texts) == self.n_samples
@@ -259,6 +596,10 @@ class SpeechToTextDataset(FairseqDataset):
 
         self.pre_tokenizer = pre_tokenizer
         self.bpe_tokenizer = bpe_tokenizer
+        # number of tokens of the target texts, see load_token_lengths
+        self.tgt_lens = None
+        # token IDs of the target texts, see load_binarized_tokens
+        self.tgt_tokens = None
 
         logger.info(self.__repr__())
 
@@ -290,11 +631,38 @@ class SpeechToTextDataset(FairseqDataset):
             text = self.bpe_tokenizer.encode(text)
         return text
 
+    def load_binarized_tokens(self, tsv_path: str):
+        """Reads the token IDs of the texts from the binarized files next to
+        *tsv_path*, if present, instead of tokenizing the texts on the fly."""
+        if self.tgt_texts is not None:
+            self.tgt_tokens = open_binarized_tokens(
+                binarized_tokens_prefix(tsv_path, "tgt"),
+                self.tgt_texts,
+                self.tgt_dict,
+                [self.data_cfg.pre_tokenizer, self.data_cfg.bpe_tokenizer],
+            )
+
+    def load_token_lengths(self, tsv_path: Optional[str] = None):
+        """Computes once the number of tokens of the texts, which are
+        cached next to *tsv_path* (if given) for the following runs."""
+        if self.tgt_tokens is not None:
+            # the binarized sentences end with the EOS
+            self.tgt_lens = self.tgt_tokens.sizes.astype(np.int64) - 1
+        elif self.tgt_texts is not None:
+            self.tgt_lens = cached_token_lengths(
+                None if tsv_path is None else f"{tsv_path}.tgt_lens",
+                self.tgt_texts,
+                self.pre_tokenizer,
+                self.bpe_tokenizer,
+                tokenizer_cfgs=[self.data_cfg.pre_tokenizer, self.data_cfg.bpe_tokenizer],
+                num_workers=self.data_cfg.token_lengths_workers,
+            )
+
     def __getitem__(
         self, index: int
     ) -> Tuple[int, torch.Tensor, Optional[torch.Tensor]]:
-        source = get_features_or_waveform(
-            self.audio_paths[index], need_waveform=self.data_cfg.use_audio_input
+        source = self.audio_store.get(
+            index, need_waveform=self.data_cfg.use_audio_input
         )
         if self.feature_transforms is not None:
             assert not self.data_cfg.use_audio_input
@@ -302,11 +670,14 @@ class SpeechToTextDataset(FairseqDataset):
         source = torch.from_numpy(source).float()
 
         target = None
-        if self.tgt_texts is not None:
+        if self.tgt_tokens is not None:
+            target = self.tgt_tokens[index].long()
+        elif self.tgt_texts is not None:
             tokenized = self.tokenize_text(self.tgt_texts[index])
             target = self.tgt_dict.encode_line(
                 tokenized, add_if_not_exist=False, append_eos=True
             ).long()
+        if target is not None:
             if self.data_cfg.prepend_tgt_lang_tag:
                 lang_tag = self.LANG_TAG_TEMPLATE.format(self.tgt_langs[index])
                 lang_tag_idx = self.tgt_dict.index(lang_tag)
@@ -319,40 +690,24 @@ class SpeechToTextDataset(FairseqDataset):
     def collater(self, samples: List[Tuple[int, torch.Tensor, torch.Tensor]]) -> Dict:
         if len(samples) == 0:
             return {}
-        indices = torch.tensor([i for i, _, _ in samples], dtype=torch.long)
-        frames = _collate_frames(
-            [s for _, s, _ in samples], self.data_cfg.use_audio_input
-        )
+        indices, sources, targets = zip(*samples)
+        indices = torch.tensor(indices, dtype=torch.long)
         # sort samples by descending number of frames
-        n_frames = torch.tensor([s.size(0) for _, s, _ in samples], dtype=torch.long)
+        n_frames = torch.tensor([s.size(0) for s in sources], dtype=torch.long)
         n_frames, order = n_frames.sort(descending=True)
         indices = indices.index_select(0, order)
-        frames = frames.index_select(0, order)
+        frames = _collate_frames(
+            sources, self.data_cfg.use_audio_input, order=order
+        )
 
         target, target_lengths = None, None
         prev_output_tokens = None
         ntokens = None
         if self.tgt_texts is not None:
-            target = fairseq_data_utils.collate_tokens(
-                [t for _, _, t in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=False,
-            )
-            target = target.index_select(0, order)
-            target_lengths = torch.tensor(
-                [t.size(0) for _, _, t in samples], dtype=torch.long
-            ).index_select(0, order)
-            prev_output_tokens = fairseq_data_utils.collate_tokens(
-                [t for _, _, t in samples],
-                self.tgt_dict.pad(),
-                self.tgt_dict.eos(),
-                left_pad=False,
-                move_eos_to_beginning=True,
+            target, prev_output_tokens, target_lengths = _collate_target(
+                targets, self.tgt_dict.pad(), self.tgt_dict.eos(), order=order
             )
-            prev_output_tokens = prev_output_tokens.index_select(0, order)
-            ntokens = sum(t.size(0) for _, _, t in samples)
+            ntokens = target_lengths.sum().item()
 
         out = {
             "id": indices,
@@ -374,13 +729,14 @@ class SpeechToTextDataset(FairseqDataset):
     def size(self, index):
         t_len = 0
         if self.tgt_texts is not None:
-            tokenized = self.tokenize_text(self.tgt_texts[index])
-            t_len = len(tokenized.split(" "))
+            if self.tgt_lens is None:
+                self.load_token_lengths()
+            t_len = self.tgt_lens[index]
         return self.n_frames[index], t_len
 
     @property
     def sizes(self):
-        return np.array(self.n_frames)
+        return self._sizes
 
     @property
     def can_reuse_epoch_itr_across_epochs(self):
@@ -392,7 +748,7 @@ class SpeechToTextDataset(FairseqDataset):
         else:
             order = [np.arange(len(self))]
         # first by descending order of # of frames then by original/random order
-        order.append([-n for n in self.n_frames])
+        order.append(-self.sizes)
         return np.lexsort(order)
 
     def prefetch(self, indices):
@@ -409,44 +765,80 @@ class SpeechToTextDatasetCreator(object):
     # default values
     DEFAULT_SPEAKER = DEFAULT_SRC_TEXT = DEFAULT_LANG = ""
 
+    @classmethod
+    def _load_manifest(cls, tsv_path: str) -> ColumnarManifest:
+        if not op.isfile(tsv_path):
+            raise FileNotFoundError(f"Dataset not found: {tsv_path}")
+        return ColumnarManifest.from_tsv(tsv_path, int_columns=[cls.KEY_N_FRAMES])
+
+    @classmethod
+    def _get_columns(
+        cls,
+        samples: Union[List[List[Dict]], List[ColumnarManifest]],
+        data_cfg: S2TDataConfig,
+    ) -> Dict[str, Sequence]:
+        """Returns the columns of the *samples*, which are either lists of rows
+        or a single :class:`ColumnarManifest`, whose columns are used as they are."""
+        if len(samples) == 1 and isinstance(samples[0], ColumnarManifest):
+            manifest = samples[0]
+            audio_paths = manifest[cls.KEY_AUDIO]
+            if data_cfg.audio_root:
+                audio_paths = StringColumn.from_strings(
+                    op.join(data_cfg.audio_root, a) for a in audio_paths
+                )
+            return {
+                "ids": manifest[cls.KEY_ID],
+                "audio_paths": audio_paths,
+                "n_frames": manifest[cls.KEY_N_FRAMES],
+                "tgt_texts": manifest[cls.KEY_TGT_TEXT],
+                "src_texts": manifest.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT),
+                "speakers": manifest.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER),
+                "src_langs": manifest.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG),
+                "tgt_langs": manifest.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG),
+            }
+        columns = {
+            c: [] for c in [
+                "ids", "audio_paths", "n_frames", "tgt_texts", "src_texts", "speakers", "src_langs", "tgt_langs"]
+        }
+        for s in samples:
+            columns["ids"].extend([ss[cls.KEY_ID] for ss in s])
+            columns["audio_paths"].extend(
+                [op.join(data_cfg.audio_root, ss[cls.KEY_AUDIO]) for ss in s]
+            )
+            columns["n_frames"].extend([int(ss[cls.KEY_N_FRAMES]) for ss in s])
+            columns["tgt_texts"].extend([ss[cls.KEY_TGT_TEXT] for ss in s])
+            columns["src_texts"].extend(
+                [ss.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT) for ss in s]
+            )
+            columns["speakers"].extend([ss.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER) for ss in s])
+            columns["src_langs"].extend([ss.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG) for ss in s])
+            columns["tgt_langs"].extend([ss.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG) for ss in s])
+        return columns
+
     @classmethod
     def _from_list(
         cls,
         split_name: str,
         is_train_split,
-        samples: List[List[Dict]],
+        samples: Union[List[List[Dict]], List[ColumnarManifest]],
         data_cfg: S2TDataConfig,
         tgt_dict,
         pre_tokenizer,
         bpe_tokenizer,
     ) -> SpeechToTextDataset:
-        audio_paths, n_frames, src_texts, tgt_texts, ids = [], [], [], [], []
-        speakers, src_langs, tgt_langs = [], [], []
-        for s in samples:
-            ids.extend([ss[cls.KEY_ID] for ss in s])
-            audio_paths.extend(
-                [op.join(data_cfg.audio_root, ss[cls.KEY_AUDIO]) for ss in s]
-            )
-            n_frames.extend([int(ss[cls.KEY_N_FRAMES]) for ss in s])
-            tgt_texts.extend([ss[cls.KEY_TGT_TEXT] for ss in s])
-            src_texts.extend(
-                [ss.get(cls.KEY_SRC_TEXT, cls.DEFAULT_SRC_TEXT) for ss in s]
-            )
-            speakers.extend([ss.get(cls.KEY_SPEAKER, cls.DEFAULT_SPEAKER) for ss in s])
-            src_langs.extend([ss.get(cls.KEY_SRC_LANG, cls.DEFAULT_LANG) for ss in s])
-            tgt_langs.extend([ss.get(cls.KEY_TGT_LANG, cls.DEFAULT_LANG) for ss in s])
+        columns = cls._get_columns(samples, data_cfg)
         return SpeechToTextDataset(
             split_name,
             is_train_split,
             data_cfg,
-            audio_paths,
-            n_frames,
-            src_texts,
-            tgt_texts,
-            speakers,
-            src_langs,
-            tgt_langs,
-            ids,
+            columns["audio_paths"],
+            columns["n_frames"],
+            columns["src_texts"],
+            columns["tgt_texts"],
+            columns["speakers"],
+            columns["src_langs"],
+            columns["tgt_langs"],
+            columns["ids"],
             tgt_dict,
             pre_tokenizer,
             bpe_tokenizer,
@@ -486,20 +878,7 @@ class SpeechToTextDatasetCreator(object):
         samples = []
         _splits = splits.split(",")
         for split in _splits:
-            tsv_path = op.join(root, f"{split}.tsv")
-            if not op.isfile(tsv_path):
-                raise FileNotFoundError(f"Dataset not found: {tsv_path}")
-            with open(tsv_path) as f:
-                reader = csv.DictReader(
-                    f,
-                    delimiter="\t",
-                    quotechar=None,
-                    doublequote=False,
-                    lineterminator="\n",
-                    quoting=csv.QUOTE_NONE,
-                )
-                samples.append([dict(e) for e in reader])
-                assert len(samples) > 0
+            samples.append(cls._load_manifest(op.join(root, f"{split}.tsv")))
 
         datasets = [
             cls._from_list(
@@ -513,6 +892,9 @@ class SpeechToTextDatasetCreator(object):
             )
             for name, s in zip(_splits, samples)
         ]
+        for name, d in zip(_splits, datasets):
+            d.load_binarized_tokens(op.join(root, f"{name}.tsv"))
+            d.load_token_lengths(op.join(root, f"{name}.tsv"))
 
         if is_train_split and len(_splits) > 1 and data_cfg.sampling_alpha != 1.0:
             # temperature-based sampling
@@ -278,6 +278,9 @@ class EpochBatchIterator(EpochBatchIterating):
             from workers. Should always be non-negative (default: ``0``).
         disable_shuffling (bool, optional): force disable shuffling
             (default: ``False``).
+        pin_memory (bool, optional): copy the batches into pinned memory, which
+            speeds up their copy to the GPU. The copy is done in the main process,
+            so it works also with *num_workers* > 0 (default: ``False``).
     """
 
     def __init__(
@@ -293,11 +296,13 @@ class EpochBatchIterator(EpochBatchIterating):
         buffer_size=0,
         timeout=0,
         disable_shuffling=False,
+        pin_memory=False,
     ):
         assert isinstance(dataset, torch.utils.data.Dataset)
         self.dataset = dataset
         self.collate_fn = collate_fn
         self.batch_sampler = batch_sampler
+        self.pin_memory = pin_memory
         self._frozen_batches = (
             tuple(batch_sampler) if not callable(batch_sampler) else None
         )
@@ -481,6 +486,7 @@ class EpochBatchIterator(EpochBatchIterating):
             batch_sampler=batches[offset:],
             num_workers=self.num_workers,
             timeout=self.timeout,
+            pin_memory=self.pin_memory,
         )
 
         # Wrap with a BufferedIterator if needed
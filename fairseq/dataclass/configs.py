@@ -382,6 +382,13 @@ class DatasetConfig(FairseqDataclass):
     data_buffer_size: int = field(
         default=10, metadata={"help": "Number of batches to preload"}
     )
+    pin_memory: bool = field(
+        default=False,
+        metadata={
+            "help": "copy the training and validation batches into pinned memory "
+            "(in the main process) to speed up their copy to the GPU"
+        },
+    )
     train_subset: str = field(
         default="train",
         metadata={"help": "data subset to use for training (e.g. train, valid, test)"},
@@ -182,6 +182,7 @@ class FairseqTask(object):
         epoch=1,
         data_buffer_size=0,
         disable_iterator_cache=False,
+        pin_memory=False,
     ):
         """
         Get an iterator that yields batches of data from the given dataset.
@@ -214,6 +215,8 @@ class FairseqTask(object):
             disable_iterator_cache (bool, optional): don't cache the
                 EpochBatchIterator (ignores `FairseqTask::can_reuse_epoch_itr`)
                 (default: False).
+            pin_memory (bool, optional): copy the batches into pinned memory
+                (default: False).
         Returns:
             ~fairseq.iterators.EpochBatchIterator: a batched iterator over the
                 given dataset split
@@ -259,6 +262,7 @@ class FairseqTask(object):
             num_workers=num_workers,
             epoch=epoch,
             buffer_size=data_buffer_size,
+            pin_memory=pin_memory,
         )
 
         if can_reuse_epoch_itr:
@@ -442,6 +442,7 @@ class Trainer(object):
             epoch=epoch,
             data_buffer_size=self.cfg.dataset.data_buffer_size,
             disable_iterator_cache=disable_iterator_cache,
+            pin_memory=self.cfg.dataset.pin_memory and self.cuda,
         )
         self.reset_dummy_batch(batch_iterator.first_batch)
         return batch_iterator
@@ -468,6 +469,7 @@ class Trainer(object):
             num_workers=self.cfg.dataset.num_workers,
             data_buffer_size=self.cfg.dataset.data_buffer_size,
             disable_iterator_cache=disable_iterator_cache,
+            pin_memory=self.cfg.dataset.pin_memory and self.cuda,
         )
         self.reset_dummy_batch(batch_iterator.first_batch)
         return batch_iterator
@@ -0,0 +1,100 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from api.knowledge_graph import KnowledgeGraphClient
+
+
+class StubKGHandler(BaseHTTPRequestHandler):
+    # Answers with a translation for each word of the query, after a delay
+    delay = 0.2
+    queries = []
+
+    def do_POST(self):
+        data = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        query, lang_out = data['query'][0], data['lang_out'][0]
+        self.queries.append((query, data['lang_in'][0], lang_out))
+        time.sleep(self.delay)
+        translations = {
+            w: [{"uri": f"http://www.wikidata.org/entity/Q{len(w)}", "translation": {lang_out: [w.upper()]}}]
+            for w in query.split()}
+        body = json.dumps({"result": {"translations": translations}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class KnowledgeGraphClientTestCase(unittest.TestCase):
+    def setUp(self):
+        StubKGHandler.queries = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubKGHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = KnowledgeGraphClient(f'http://127.0.0.1:{self.server.server_port}/api/', cache_size=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_cached_query(self):
+        first = self.client.query("London", "ENG", "ITA")
+        self.assertEqual(["LONDON"], first["London"][0]["translation"]["ITA"])
+        self.assertEqual(first, self.client.query("London", "ENG", "ITA"))
+        self.assertEqual(1, len(StubKGHandler.queries))
+        # the languages are part of the key
+        self.client.query("London", "ENG", "SPA")
+        self.assertEqual(2, len(StubKGHandler.queries))
+
+    def test_lru_eviction(self):
+        for q in ["a", "b", "a", "c", "a", "b"]:
+            self.client.query(q, "ENG", "ITA")
+        # "b" was evicted by "c", being the least recently used
+        self.assertEqual(["a", "b", "c", "b"], [q[0] for q in StubKGHandler.queries])
+
+    def test_ttl_expiration(self):
+        with patch('api.knowledge_graph.time.monotonic') as mock_time:
+            mock_time.return_value = 0.0
+            self.client.query("London", "ENG", "ITA")
+            mock_time.return_value = self.client.cache.ttl - 1
+            self.client.query("London", "ENG", "ITA")
+            self.assertEqual(1, len(StubKGHandler.queries))
+            mock_time.return_value = self.client.cache.ttl + 1
+            self.client.query("London", "ENG", "ITA")
+            self.assertEqual(2, len(StubKGHandler.queries))
+
+    def test_concurrent_lookup(self):
+        queries = [("London", "ENG", "ITA"), ("Roma", "ITA", "ENG"), ("London", "ENG", "ITA")]
+        start = time.time()
+        results = self.client.lookup(queries)
+        elapsed = time.time() - start
+        self.assertLess(elapsed, 2 * StubKGHandler.delay)
+        # the duplicated query is sent only once
+        self.assertEqual(2, len(StubKGHandler.queries))
+        self.assertEqual(["ROMA"], results[1]["Roma"][0]["translation"]["ENG"])
+        self.assertEqual(results[0], results[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
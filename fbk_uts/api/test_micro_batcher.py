@@ -0,0 +1,124 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import json
+import unittest
+from collections import namedtuple
+
+from api.micro_batcher import MicroBatcher
+
+
+FakeAudio = namedtuple("FakeAudio", ["shape"])
+
+
+class FakeProcessor:
+    def __init__(self):
+        self.batches = []
+        self.events = []
+
+    def preproc_request(self, request_id, request):
+        if request["wav_path"] == "missing.wav":
+            raise FileNotFoundError("missing.wav")
+        return request, FakeAudio((request["n_frames"], 80))
+
+    def process_batch(self, requests):
+        self.batches.append([request_id for request_id, _, _ in requests])
+        self.events.extend(("process", request_id) for request_id, _, _ in requests)
+        return [{"translation": request["wav_path"]} for _, request, _ in requests]
+
+    def end_session(self, session_id):
+        self.events.append(("end_session", session_id))
+
+
+def request(wav_path, n_frames=10):
+    return json.dumps({"wav_path": wav_path, "n_frames": n_frames})
+
+
+class MicroBatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.processor = FakeProcessor()
+
+    def test_requests_in_window_are_batched(self):
+        batcher = MicroBatcher(self.processor, 10, 1000, 8)
+        for i in range(3):
+            batcher.put(i, request(f"{i}.wav"))
+        outputs, command = batcher.next_outputs()
+        self.assertIsNone(command)
+        self.assertEqual([[0, 1, 2]], self.processor.batches)
+        self.assertEqual(
+            [(i, {"translation": f"{i}.wav", "status": "ok"}) for i in range(3)], outputs)
+
+    def test_max_batch_size(self):
+        batcher = MicroBatcher(self.processor, 10, 1000, 2)
+        for i in range(3):
+            batcher.put(i, request(f"{i}.wav"))
+        batcher.next_outputs()
+        batcher.next_outputs()
+        self.assertEqual([[0, 1], [2]], self.processor.batches)
+
+    def test_max_batch_frames(self):
+        batcher = MicroBatcher(self.processor, 10, 100, 8)
+        batcher.put(0, request("0.wav", 30))
+        batcher.put(1, request("1.wav", 50))
+        # 3 x 50 padded frames exceed the limit, so the request is moved to the next batch
+        batcher.put(2, request("2.wav", 20))
+        outputs, _ = batcher.next_outputs()
+        self.assertEqual([0, 1], [request_id for request_id, _ in outputs])
+        outputs, _ = batcher.next_outputs()
+        self.assertEqual([2], [request_id for request_id, _ in outputs])
+        self.assertEqual([[0, 1], [2]], self.processor.batches)
+
+    def test_errors_keep_order(self):
+        batcher = MicroBatcher(self.processor, 10, 1000, 8)
+        batcher.put(0, request("0.wav"))
+        batcher.put(1, request("missing.wav"))
+        batcher.put(2, "not a json")
+        batcher.put(3, request("3.wav"))
+        outputs, _ = batcher.next_outputs()
+        self.assertEqual([0, 1, 2, 3], [request_id for request_id, _ in outputs])
+        self.assertEqual(["ok", "error", "error", "ok"], [o["status"] for _, o in outputs])
+        self.assertEqual([[0, 3]], self.processor.batches)
+
+    def test_shutdown_closes_batch(self):
+        batcher = MicroBatcher(self.processor, 1000, 1000, 8)
+        batcher.put(0, request("0.wav"))
+        batcher.put(1, json.dumps({"command": "shutdown"}))
+        outputs, command = batcher.next_outputs()
+        self.assertEqual({"command": "shutdown"}, command)
+        self.assertEqual([0], [request_id for request_id, _ in outputs])
+
+
+    def test_end_session_after_previous_requests(self):
+        batcher = MicroBatcher(self.processor, 1000, 1000, 8)
+        batcher.put(0, request("0.wav"))
+        batcher.put(1, json.dumps({"command": "end_session", "session_id": "s"}))
+        batcher.put(2, request("2.wav"))
+        batcher.put(3, json.dumps({"command": "shutdown"}))
+        outputs, command = batcher.next_outputs()
+        self.assertIsNone(command)
+        self.assertEqual([0], [request_id for request_id, _ in outputs])
+        outputs, command = batcher.next_outputs()
+        self.assertEqual({"command": "shutdown"}, command)
+        self.assertEqual([(1, {"status": "ok"}), (2, {"translation": "2.wav", "status": "ok"})], outputs)
+        self.assertEqual([("process", 0), ("end_session", "s"), ("process", 2)], self.processor.events)
+
+    def test_end_session_error(self):
+        batcher = MicroBatcher(self.processor, 10, 1000, 8)
+        batcher.put(0, json.dumps({"command": "end_session"}))
+        outputs, _ = batcher.next_outputs()
+        self.assertEqual([0], [request_id for request_id, _ in outputs])
+        self.assertEqual("error", outputs[0][1]["status"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import logging
+import os
+import tempfile
+import unittest
+import wave
+from unittest.mock import patch
+
+import numpy as np
+
+from api.speech_processor import SpeechToTextProcessor
+from api.st_processor import STProcessorRequest
+
+
+class PcmRequestsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.processor = SpeechToTextProcessor.__new__(SpeechToTextProcessor)
+        self.processor.logger = logging.getLogger("test")
+        self.processor.feature_transforms = None
+        self.processor.request_class = STProcessorRequest
+        self.samples = (np.random.rand(16000) * 2 ** 16 - 2 ** 15).astype('<i2')
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def preproc(self, request):
+        # Return the waveform as the features, to check that all the paths read the same audio
+        with patch('api.speech_processor.extract_fbank_features') as mock_extract:
+            mock_extract.side_effect = lambda waveform, sample_rate: waveform.squeeze().numpy()
+            return self.processor.preproc_request("id", request)[1]
+
+    def test_base64_pcm_equals_wav(self):
+        wav_path = os.path.join(self.tmpdir.name, "audio.wav")
+        with wave.open(wav_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(self.samples.tobytes())
+        from_wav = self.preproc({"wav_path": wav_path, "src_lang": "en", "tgt_lang": "it"})
+        from_pcm = self.preproc({
+            "pcm": base64.b64encode(self.samples.tobytes()).decode('ascii'),
+            "src_lang": "en",
+            "tgt_lang": "it"})
+        self.assertTrue(np.array_equal(from_wav.numpy(), from_pcm.numpy()))
+
+    def test_memory_mapped_pcm(self):
+        pcm_path = os.path.join(self.tmpdir.name, "audio.pcm")
+        with open(pcm_path, 'wb') as f:
+            f.write(b'\x00' * 10)
+            f.write(self.samples.tobytes())
+        from_file = self.preproc({
+            "pcm_path": pcm_path,
+            "pcm_offset": 10,
+            "pcm_size": 2000,
+            "src_lang": "en",
+            "tgt_lang": "it"})
+        self.assertEqual(1000, from_file.shape[0])
+        self.assertTrue(np.array_equal(
+            (self.samples[:1000].astype(np.float32) / 2 ** 15), from_file.numpy()))
+
+    def test_missing_audio(self):
+        with self.assertRaises(ValueError):
+            self.processor.preproc_request("id", {"src_lang": "en", "tgt_lang": "it"})
+
+
+if __name__ == '__main__':
+    unittest.main()
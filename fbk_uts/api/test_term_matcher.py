@@ -0,0 +1,46 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import random
+import unittest
+
+from api import term_matcher
+from api.term_matcher import TermMatcher
+
+
+class TermMatcherTestCase(unittest.TestCase):
+    def test_doctest(self):
+        import doctest
+        results = doctest.testmod(m=term_matcher)
+        self.assertEqual(0, results.failed)
+
+    def test_same_as_substring_search(self):
+        random.seed(0)
+        words = ["heart", "attack", "art", "a", "at", "l'eau", "rio", "río", "de", ",", "-", ""]
+        for _ in range(500):
+            entries = [
+                (" ".join(random.choices(words, k=random.randint(1, 3))), [str(i)])
+                for i in range(random.randint(0, 20))]
+            text = random.choice([" ", ""]).join(random.choices(words, k=random.randint(0, 20)))
+            expected = [(entry, text.index(entry[0])) for entry in entries if entry[0] in text]
+            self.assertEqual(expected, TermMatcher(entries).find(text))
+
+    def test_duplicated_terms(self):
+        entries = [("board game", ["gioco da tavolo"]), ("game", ["gioco"]), ("board game", ["gioco"])]
+        self.assertEqual(
+            [(entries[0], 4), (entries[1], 10), (entries[2], 4)],
+            TermMatcher(entries).find("the board game"))
+
+
+if __name__ == '__main__':
+    unittest.main()
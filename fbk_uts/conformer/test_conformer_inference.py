@@ -0,0 +1,82 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import copy
+import unittest
+from argparse import Namespace
+
+import torch
+from torch import nn
+
+from examples.speech_to_text.models.conformer import conformer_s, ConformerModel
+from fairseq.data import Dictionary
+
+
+class ConformerInferenceTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        args = Namespace()
+        args.input_feat_per_channel = 5
+        args.input_channels = 1
+        args.max_source_positions = 1000
+        args.max_target_positions = 20
+        args.encoder_layers = 2
+        args.decoder_layers = 1
+        args.criterion = "label_smoothed_cross_entropy"
+        args.ctc_compress_strategy = "none"
+        conformer_s(args)
+        tgt_dict = Dictionary()
+        for i in range(10):
+            tgt_dict.add_symbol(str(i))
+        task = Namespace(source_dictionary=None, target_dictionary=tgt_dict)
+        # SyncBatchNorm runs only on GPU, so the reference model uses BatchNorm1d
+        batchnorm_args = copy.deepcopy(args)
+        batchnorm_args.no_syncbatchnorm = True
+        self.model = ConformerModel.build_model(batchnorm_args, task)
+        for layer in self.model.encoder.conformer_layers:
+            # non-trivial statistics, as the ones of a trained model
+            batchnorm = layer.conv_module.batchnorm
+            batchnorm.running_mean.uniform_(-1.0, 1.0)
+            batchnorm.running_var.uniform_(0.5, 2.0)
+            nn.init.uniform_(batchnorm.weight, 0.5, 1.5)
+            nn.init.uniform_(batchnorm.bias, -0.5, 0.5)
+        self.model.eval()
+        self.fast_model = ConformerModel.build_model(args, task)
+        self.fast_model.load_state_dict(self.model.state_dict())
+        self.fast_model.prepare_for_inference_(Namespace(generation=Namespace(beam=5)))
+
+    def encode(self, model, src_lengths):
+        src_tokens = torch.rand(len(src_lengths), max(src_lengths), 5)
+        with torch.no_grad():
+            return model.encoder(src_tokens, torch.LongTensor(src_lengths))["encoder_out"][0]
+
+    def test_batchnorm_folded(self):
+        for layer in self.fast_model.encoder.conformer_layers:
+            self.assertIsInstance(layer.conv_module.batchnorm, nn.Identity)
+            self.assertIsNotNone(layer.conv_module.depthwise_conv1d.bias)
+
+    def test_equivalence(self):
+        # the cache of the positional projections is both extended and sliced
+        for src_lengths in [[50, 37, 12], [300, 299], [20], [130, 1]]:
+            torch.manual_seed(1)
+            expected = self.encode(self.model, src_lengths)
+            torch.manual_seed(1)
+            actual = self.encode(self.fast_model, src_lengths)
+            torch.testing.assert_close(expected, actual, rtol=1e-4, atol=1e-4)
+        cache = self.fast_model.encoder.conformer_layers[0].attention.pos_proj_cache
+        self.assertEqual(128, cache.shape[1])
+        self.assertEqual(0, self.model.encoder.conformer_layers[0].attention.pos_proj_cache_bucket)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+from argparse import Namespace
+
+import torch
+
+from examples.speech_to_text.models.conformer import conformer_s, ConformerEncoder
+from examples.speech_to_text.models.speechformer import speechformer_s, SpeechformerEncoder
+from examples.speech_to_text.modules.encoder_streaming_support import EncoderStreamingState
+from fairseq.data import Dictionary
+
+
+class EncoderStreamingTestMixin:
+    """
+    Checks that the outputs obtained reusing the states of the previous windows
+    do not drift from those obtained with the full recomputation.
+    """
+    encoder = None
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.stream = torch.rand(400, 5)
+
+    def check_windows(self, window_frames, step_frames, modify_overlap=False, first_end=None):
+        state = EncoderStreamingState()
+        end = first_end or step_frames
+        while end <= self.stream.shape[0]:
+            start = max(0, end - window_frames)
+            window = self.stream[start:end].clone()
+            if modify_overlap:
+                window[window.shape[0] // 2] += 1.0
+            src_tokens, src_lengths = window.unsqueeze(0), torch.LongTensor([window.shape[0]])
+            full = self.encoder(src_tokens, src_lengths)
+            state.frame_offset = start
+            streaming = self.encoder(src_tokens, src_lengths, streaming_state=state)
+            self.assertEqual(full["encoder_out"][0].shape, streaming["encoder_out"][0].shape)
+            torch.testing.assert_allclose(full["encoder_out"][0], streaming["encoder_out"][0], atol=1e-5, rtol=1e-5)
+            end += step_frames
+        return state
+
+    def test_sliding_windows(self):
+        state = self.check_windows(120, 40)
+        self.assertGreater(state.reused_frames, state.computed_frames)
+
+    def test_growing_windows(self):
+        state = self.check_windows(1000, 40)
+        self.assertGreater(state.reused_frames, state.computed_frames)
+
+    def test_unaligned_shift(self):
+        # the shift is not a multiple of the stride, so the outputs cannot be reused
+        state = self.check_windows(120, 41, first_end=120)
+        self.assertEqual(0, state.reused_frames)
+
+    def test_modified_overlap(self):
+        # only the outputs not depending on the modified frames can be reused
+        state = self.check_windows(120, 40, modify_overlap=True)
+        self.assertGreater(state.computed_frames, 0)
+
+
+class ConformerEncoderStreamingTestCase(EncoderStreamingTestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        args = Namespace()
+        args.encoder_embed_dim = 16
+        args.encoder_ffn_embed_dim = 32
+        args.input_feat_per_channel = 5
+        args.input_channels = 1
+        args.max_source_positions = 1000
+        args.encoder_layers = 2
+        args.conv_channels = 8
+        args.criterion = "label_smoothed_cross_entropy"
+        args.ctc_compress_strategy = "none"
+        args.no_syncbatchnorm = True
+        conformer_s(args)
+        self.encoder = ConformerEncoder(args, Dictionary())
+        self.encoder.eval()
+
+
+class SpeechformerEncoderStreamingTestCase(EncoderStreamingTestMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        args = Namespace()
+        args.encoder_embed_dim = 16
+        args.encoder_ffn_embed_dim = 32
+        args.input_feat_per_channel = 5
+        args.input_channels = 1
+        args.max_source_positions = 1000
+        args.encoder_layers = 2
+        args.conv_channels = 8
+        args.stride = 2
+        args.criterion = "label_smoothed_cross_entropy"
+        args.ctc_compress_strategy = "none"
+        speechformer_s(args)
+        self.encoder = SpeechformerEncoder(args, Dictionary())
+        self.encoder.eval()
+
+
+if __name__ == '__main__':
+    unittest.main()
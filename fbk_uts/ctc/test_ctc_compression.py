@@ -0,0 +1,92 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+
+import torch
+
+from examples.speech_to_text.scripts.benchmark_ctc_compression import CtcCompressor, fake_ctc_output, \
+    reference_average_same_ctc_features
+
+
+class CtcCompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def check_equivalence(self, strategy, max_out_size=-1, avg_run_length=3.0, vocab_size=20):
+        compressor = CtcCompressor(strategy, max_out_size=max_out_size)
+        for max_len in [1, 7, 50, 120]:
+            x_ctc, src_lengths = fake_ctc_output(5, max_len, vocab_size, avg_run_length, torch.device("cpu"))
+            x = torch.randn(max_len, 5, 8)
+            out, lengths = compressor.average_same_ctc_features(x_ctc, x, src_lengths)
+            ref_out, ref_lengths = reference_average_same_ctc_features(compressor, strategy, x_ctc, x, src_lengths)
+            self.assertEqual(ref_lengths.tolist(), lengths.tolist())
+            self.assertEqual(ref_out.shape, out.shape)
+            torch.testing.assert_allclose(out, ref_out, atol=1e-6, rtol=1e-5)
+
+    def test_avg(self):
+        self.check_equivalence("avg")
+        self.check_equivalence("avg", max_out_size=6)
+
+    def test_weighted(self):
+        self.check_equivalence("weighted")
+        # many short runs of few symbols, so that the merged segments have ties
+        self.check_equivalence("weighted", max_out_size=7, avg_run_length=1.5, vocab_size=3)
+
+    def test_softmax(self):
+        self.check_equivalence("softmax")
+        self.check_equivalence("softmax", max_out_size=7, avg_run_length=1.5, vocab_size=3)
+
+    def test_fixed(self):
+        self.check_equivalence("fixed")
+
+    def test_pooling(self):
+        self.check_equivalence("avg_pool", max_out_size=6)
+        self.check_equivalence("weighted_pool")
+        self.check_equivalence("softmax_pool", max_out_size=7, avg_run_length=1.5, vocab_size=3)
+        self.check_equivalence("fixed_pool")
+
+    def check_gradients(self, strategy):
+        torch.manual_seed(0)
+        x_ctc, src_lengths = fake_ctc_output(3, 30, 10, 3.0, torch.device("cpu"))
+        x_ctc = (x_ctc / 10.0).requires_grad_()
+        x = torch.randn(30, 3, 4, requires_grad=True)
+        out, _ = CtcCompressor(strategy).average_same_ctc_features(x_ctc, x, src_lengths)
+        out.sum().backward()
+        return x.grad, x_ctc.grad
+
+    def test_pooling_gradients(self):
+        for strategy in ["weighted", "softmax"]:
+            dense_x_grad, dense_ctc_grad = self.check_gradients(strategy)
+            self.assertIsNone(dense_ctc_grad)
+            x_grad, ctc_grad = self.check_gradients(strategy + "_pool")
+            torch.testing.assert_allclose(x_grad, dense_x_grad, atol=1e-6, rtol=1e-5)
+            self.assertIsNotNone(ctc_grad)
+            self.assertGreater(ctc_grad.abs().sum().item(), 0.0)
+        _, ctc_grad = self.check_gradients("avg_pool")
+        self.assertIsNone(ctc_grad)
+
+    def test_merged_segment_labels(self):
+        # [(0, 1), (1, 2), (0, 2), (2, 1), (1, 2), (0, 1), (2, 5)] are merged
+        # into [(0, 5), (1, 4), (2, 5)], as the labels covering most time steps are kept
+        compressor = CtcCompressor("weighted", max_out_size=3)
+        predicted = torch.LongTensor([[0, 1, 1, 0, 0, 2, 1, 1, 0, 2, 2, 2, 2, 2]])
+        segments = compressor.ctc_segments(predicted, torch.LongTensor([14]))
+        self.assertEqual([[0, 1, 2]], segments.labels.tolist())
+        self.assertEqual([3], segments.lengths.tolist())
+        self.assertEqual(
+            [[0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2]], segments.segment_ids.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import csv
+import os.path as op
+import tempfile
+import unittest
+from argparse import Namespace
+from unittest.mock import patch
+
+import numpy as np
+import torch
+
+from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc, \
+    SpeechToTextDatasetCreatorWithSrc
+from examples.speech_to_text.scripts.binarize_texts import main as binarize_texts
+from fairseq.data import Dictionary
+
+
+class BinarizedTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.tgt_texts = ["ciao mondo", "come va", "bene grazie e tu"]
+        self.src_texts = ["hello world", "how are you", "fine thanks and you"]
+        self.write_tsv(self.tgt_texts)
+        self.tgt_dict, self.src_dict = Dictionary(), Dictionary()
+        for text in self.tgt_texts[:2]:
+            self.tgt_dict.encode_line(text)
+        for text in self.src_texts:
+            self.src_dict.encode_line(text)
+        self.tgt_dict.save(op.join(self.root, "dict.txt"))
+        self.src_dict.save(op.join(self.root, "dict_src.txt"))
+        with open(op.join(self.root, "config.yaml"), "w") as f:
+            f.write("vocab_filename: dict.txt\nvocab_filename_src: dict_src.txt\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_tsv(self, tgt_texts):
+        with open(op.join(self.root, "train.tsv"), "w") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["id", "audio", "n_frames", "src_text", "tgt_text"], delimiter="\t",
+                quotechar=None, doublequote=False, lineterminator="\n", quoting=csv.QUOTE_NONE)
+            writer.writeheader()
+            for i, (src, tgt) in enumerate(zip(self.src_texts, tgt_texts)):
+                writer.writerow({"id": i, "audio": f"{i}.npy", "n_frames": 10, "src_text": src, "tgt_text": tgt})
+
+    def load_dataset(self):
+        return SpeechToTextDatasetCreatorWithSrc.from_tsv(
+            self.root, S2TDataConfigSrc(op.join(self.root, "config.yaml")), "train", self.tgt_dict, self.src_dict,
+            None, None, None, is_train_split=True, epoch=1, seed=1).datasets[0]
+
+    @patch('fairseq.data.audio.speech_to_text_dataset.FeatureStore.get')
+    def test_same_items(self, mock_get):
+        mock_get.return_value = np.zeros((10, 4), dtype=np.float32)
+        on_the_fly = self.load_dataset()
+        self.assertIsNone(on_the_fly.tgt_tokens)
+        binarize_texts(Namespace(data_root=self.root, config_yaml="config.yaml", splits=["train"]))
+        binarized = self.load_dataset()
+        self.assertIsNotNone(binarized.tgt_tokens)
+        self.assertIsNotNone(binarized.src_tokens)
+        self.assertEqual(on_the_fly.tgt_lens.tolist(), binarized.tgt_lens.tolist())
+        self.assertEqual(on_the_fly.src_lens.tolist(), binarized.src_lens.tolist())
+        expected_items = [on_the_fly[i] for i in range(len(on_the_fly))]
+        with patch.object(Dictionary, "encode_line") as mock_encode:
+            for expected in expected_items:
+                actual = binarized[expected[0]]
+                self.assertTrue(torch.equal(expected[2], actual[2]))
+                self.assertTrue(torch.equal(expected[3], actual[3]))
+                self.assertEqual(torch.long, actual[2].dtype)
+            mock_encode.assert_not_called()
+        # the last target contains out-of-vocabulary words
+        self.assertIn(self.tgt_dict.unk(), binarized[2][2].tolist())
+
+    @patch('fairseq.data.audio.speech_to_text_dataset.FeatureStore.get')
+    def test_stale_tokens(self, mock_get):
+        mock_get.return_value = np.zeros((10, 4), dtype=np.float32)
+        binarize_texts(Namespace(data_root=self.root, config_yaml="config.yaml", splits=["train"]))
+        # the targets change after the binarization
+        self.write_tsv(["ciao", "come va", "bene grazie e tu"])
+        dataset = self.load_dataset()
+        self.assertIsNone(dataset.tgt_tokens)
+        self.assertIsNotNone(dataset.src_tokens)
+        self.assertEqual([1, 2, 4], dataset.tgt_lens.tolist())
+        self.assertEqual(self.tgt_dict.encode_line("ciao").tolist(), dataset[0][2].tolist())
+        # so does the source dictionary
+        self.src_dict.add_symbol("new")
+        self.assertIsNone(self.load_dataset().src_tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
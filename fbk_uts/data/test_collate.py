@@ -0,0 +1,58 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+
+import torch
+
+from fairseq.data import data_utils as fairseq_data_utils
+from fairseq.data.audio.speech_to_text_dataset import _collate_frames, _collate_padded, _collate_target
+
+
+class CollateTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.lengths = [3, 7, 1, 5]
+        self.order = torch.tensor([1, 3, 0, 2])
+        self.tokens = [torch.cat([torch.randint(4, 20, (n - 1,)), torch.tensor([2])]) for n in self.lengths]
+
+    def test_frames(self):
+        frames = [torch.rand(n, 4) for n in self.lengths]
+        collated = _collate_frames(frames, order=self.order)
+        self.assertEqual([4, 7, 4], list(collated.shape))
+        for i, j in enumerate(self.order.tolist()):
+            self.assertTrue(torch.equal(frames[j], collated[i, :self.lengths[j]]))
+            self.assertTrue(torch.all(collated[i, self.lengths[j]:] == 0.0))
+
+    def test_target(self):
+        target, prev_output_tokens, lengths = _collate_target(self.tokens, 1, 2, order=self.order)
+        expected_target = fairseq_data_utils.collate_tokens(
+            self.tokens, 1, 2, left_pad=False, move_eos_to_beginning=False).index_select(0, self.order)
+        expected_prev_output_tokens = fairseq_data_utils.collate_tokens(
+            self.tokens, 1, 2, left_pad=False, move_eos_to_beginning=True).index_select(0, self.order)
+        self.assertTrue(torch.equal(expected_target, target))
+        self.assertTrue(torch.equal(expected_prev_output_tokens, prev_output_tokens))
+        self.assertEqual([7, 5, 3, 1], lengths.tolist())
+
+    def test_topk(self):
+        idxs = [torch.randint(0, 10, (n, 2)).int() for n in self.lengths]
+        collated = _collate_padded(idxs, 1, pad_to_length=8)
+        self.assertEqual([4, 8, 2], list(collated.shape))
+        self.assertEqual(torch.int32, collated.dtype)
+        for i, n in enumerate(self.lengths):
+            self.assertTrue(torch.equal(idxs[i], collated[i, :n]))
+            self.assertTrue(torch.all(collated[i, n:] == 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
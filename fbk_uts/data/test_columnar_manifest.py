@@ -0,0 +1,103 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import os.path as op
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from fairseq.data.audio.columnar_manifest import ColumnarManifest, StringColumn, cache_file_path
+
+
+class StringColumnTestCase(unittest.TestCase):
+    def test_access(self):
+        strings = ["ciao", "", "perché sì", "🦘 quokka"]
+        column = StringColumn.from_strings(strings)
+        self.assertEqual(4, len(column))
+        self.assertEqual(strings, list(column))
+        self.assertEqual(strings[1:3], column[1:3])
+        self.assertEqual("🦘 quokka", column[-1])
+        self.assertEqual("perché sì", column[np.int64(2)])
+        with self.assertRaises(IndexError):
+            column[4]
+        self.assertEqual(strings, list(pickle.loads(pickle.dumps(column))))
+
+    def test_empty(self):
+        column = StringColumn.from_strings([])
+        self.assertEqual(0, len(column))
+        self.assertEqual([], list(column))
+
+
+class ColumnarManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tsv_path = op.join(self.tmp_dir.name, "train.tsv")
+        self.write_tsv(["ciao mondo", "perché", "bene"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_tsv(self, texts):
+        with open(self.tsv_path, "w") as f:
+            f.write("id\taudio\tn_frames\ttgt_text\n")
+            for i, text in enumerate(texts):
+                f.write(f"utt_{i}\tfbank.zip:{i * 100}:100\t{i + 10}\t{text}\n")
+
+    def check_manifest(self, manifest, texts):
+        self.assertEqual(len(texts), len(manifest))
+        self.assertEqual(texts, list(manifest["tgt_text"]))
+        self.assertEqual([f"utt_{i}" for i in range(len(texts))], list(manifest["id"]))
+        self.assertIsInstance(manifest["n_frames"], np.ndarray)
+        self.assertEqual(np.int64, manifest["n_frames"].dtype)
+        self.assertEqual(list(range(10, 10 + len(texts))), manifest["n_frames"].tolist())
+        self.assertNotIn("speaker", manifest)
+        self.assertEqual([""] * len(texts), list(manifest.get("speaker", "")))
+
+    def test_cache(self):
+        manifest = ColumnarManifest.from_tsv(self.tsv_path, int_columns=["n_frames"])
+        self.check_manifest(manifest, ["ciao mondo", "perché", "bene"])
+        self.assertTrue(op.isfile(cache_file_path(self.tsv_path)))
+        with patch.object(ColumnarManifest, "read_tsv") as mock_read:
+            cached = ColumnarManifest.from_tsv(self.tsv_path, int_columns=["n_frames"])
+            mock_read.assert_not_called()
+        self.check_manifest(cached, ["ciao mondo", "perché", "bene"])
+        self.assertIsInstance(cached["n_frames"].base, np.memmap)
+        # the cache is not used once the TSV changes
+        self.write_tsv(["ciao", "perché no", "bene", "male"])
+        self.check_manifest(
+            ColumnarManifest.from_tsv(self.tsv_path, int_columns=["n_frames"]), ["ciao", "perché no", "bene", "male"])
+
+    def test_ragged_rows(self):
+        with open(self.tsv_path, "w") as f:
+            f.write("id\taudio\tn_frames\ttgt_text\n")
+            f.write("utt_0\t0.npy\t10\tciao mondo\textra\n\n")
+            f.write("utt_1\t1.npy\t11\tperché\n")
+        manifest = ColumnarManifest.read_tsv(self.tsv_path, int_columns=["n_frames"])
+        self.check_manifest(manifest, ["ciao mondo", "perché"])
+        with open(self.tsv_path, "a") as f:
+            f.write("utt_2\t2.npy\t12\n")
+        with self.assertRaisesRegex(ValueError, "line 5 "):
+            ColumnarManifest.read_tsv(self.tsv_path, int_columns=["n_frames"])
+
+    def test_int_columns_changed(self):
+        manifest = ColumnarManifest.from_tsv(self.tsv_path)
+        self.assertIsInstance(manifest["n_frames"], StringColumn)
+        self.check_manifest(
+            ColumnarManifest.from_tsv(self.tsv_path, int_columns=["n_frames"]), ["ciao mondo", "perché", "bene"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import csv
+import os.path as op
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from examples.speech_to_text.data_utils import create_zip, get_zip_manifest
+from examples.speech_to_text.scripts.zip_to_packed_features import convert
+from fairseq.data.audio.packed_features import PackedFeatures, PackedFeaturesBuilder
+from fairseq.data.audio.speech_to_text_dataset import FeatureStore, get_features_or_waveform
+
+
+class StoreDataset(torch.utils.data.Dataset):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, index):
+        return torch.from_numpy(self.store.get(index))
+
+    def __len__(self):
+        return len(self.store)
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        np.random.seed(0)
+        self.features = {}
+        for i in range(10):
+            self.features[f"utt{i}"] = np.random.rand(np.random.randint(1, 50), 8).astype(np.float32)
+            np.save(op.join(root, f"utt{i}.npy"), self.features[f"utt{i}"])
+        np.save(op.join(root, "fortran.npy"), np.asfortranarray(np.random.rand(7, 3)))
+        create_zip(root, op.join(root, "fbank.zip"))
+        manifest = get_zip_manifest(root, "fbank.zip")
+        self.ids = sorted(manifest.keys())
+        self.paths = [op.join(root, manifest[utt_id]) for utt_id in self.ids]
+        # a path outside the zip is read as before
+        self.ids.append("utt0")
+        self.paths.append(op.join(root, "utt0.npy"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        store = FeatureStore(self.paths)
+        self.assertEqual(len(self.paths), len(store))
+        self.assertEqual(1, len(store.zip_paths))
+        for i, path in enumerate(self.paths):
+            features = store.get(i)
+            expected = get_features_or_waveform(path)
+            self.assertEqual(expected.dtype, features.dtype)
+            np.testing.assert_array_equal(expected, features)
+            if self.ids[i] in self.features:
+                np.testing.assert_array_equal(self.features[self.ids[i]], features)
+
+    def test_views_are_not_written_to_file(self):
+        store = FeatureStore(self.paths)
+        features = store.get(0)
+        original = features.copy()
+        features += 1.0
+        np.testing.assert_array_equal(original, get_features_or_waveform(self.paths[0]))
+
+    def test_missing_zip(self):
+        with self.assertRaises(FileNotFoundError):
+            FeatureStore([op.join(self.tmp_dir.name, "missing.zip:10:20")])
+
+    def test_pickle(self):
+        store = FeatureStore(self.paths)
+        store.get(0)
+        unpickled = pickle.loads(pickle.dumps(store))
+        np.testing.assert_array_equal(store.get(3), unpickled.get(3))
+
+    def test_dataloader_workers(self):
+        store = FeatureStore(self.paths)
+        store.get(0)
+        loader = torch.utils.data.DataLoader(StoreDataset(store), num_workers=2, collate_fn=lambda x: x[0])
+        for i, features in enumerate(loader):
+            np.testing.assert_array_equal(get_features_or_waveform(self.paths[i]), features.numpy())
+
+
+class PackedFeaturesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        np.random.seed(0)
+        self.features = [np.random.rand(np.random.randint(1, 50), 8).astype(np.float32) for _ in range(10)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_roundtrip(self):
+        prefix = op.join(self.tmp_dir.name, "fbank")
+        with PackedFeaturesBuilder(prefix) as builder:
+            for f in self.features:
+                builder.add_item(f)
+        packed = PackedFeatures(prefix)
+        self.assertEqual(len(self.features), len(packed))
+        self.assertEqual([len(f) for f in self.features], packed.sizes.tolist())
+        for i, f in enumerate(self.features):
+            self.assertEqual(np.float32, packed[i].dtype)
+            np.testing.assert_array_equal(f, packed[i])
+            np.testing.assert_array_equal(f, get_features_or_waveform(f"{prefix}.bin:{i}"))
+
+    def test_float16(self):
+        prefix = op.join(self.tmp_dir.name, "fbank")
+        with PackedFeaturesBuilder(prefix, dtype=np.float16) as builder:
+            for f in self.features:
+                builder.add_item(f)
+        packed = PackedFeatures(prefix)
+        for i, f in enumerate(self.features):
+            self.assertEqual(np.float32, packed[i].dtype)
+            np.testing.assert_allclose(f, packed[i], rtol=1e-3, atol=1e-3)
+
+    def test_convert_zip(self):
+        root = self.tmp_dir.name
+        for i, f in enumerate(self.features):
+            np.save(op.join(root, f"utt{i}.npy"), f)
+        create_zip(root, op.join(root, "fbank.zip"))
+        manifest = get_zip_manifest(root, "fbank.zip")
+        with open(op.join(root, "train.tsv"), "w") as f:
+            f.write("id\taudio\tn_frames\n")
+            for i, features in enumerate(self.features):
+                f.write(f"utt{i}\t{manifest[f'utt{i}']}\t{len(features)}\n")
+        convert(root, [op.join(root, "train.tsv")], [op.join(root, "train_packed.tsv")], "fbank_packed", "float32")
+        with open(op.join(root, "train_packed.tsv")) as f:
+            samples = list(csv.DictReader(f, delimiter="\t"))
+        self.assertEqual([f"utt{i}" for i in range(len(self.features))], [s["id"] for s in samples])
+        store = FeatureStore([op.join(root, s["audio"]) for s in samples])
+        self.assertEqual(1, len(store.packed_features))
+        for i, features in enumerate(self.features):
+            self.assertTrue(samples[i]["audio"].startswith("fbank_packed.bin:"))
+            np.testing.assert_array_equal(features, store.get(i))
+        unpickled = pickle.loads(pickle.dumps(store))
+        np.testing.assert_array_equal(self.features[3], unpickled.get(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
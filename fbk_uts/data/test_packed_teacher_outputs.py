@@ -0,0 +1,175 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import csv
+import os.path as op
+import pickle
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+
+from examples.speech_to_text.data.packed_teacher_outputs import PackedTeacherOutputs, \
+    PackedTeacherOutputsBuilder, index_dtype, merge_shards, shard_prefix, teacher_outputs_prefix
+from examples.speech_to_text.data.speech_to_text_dataset_KD import SpeechToTextDatasetCreatorKD
+from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc
+from fairseq.data import Dictionary
+
+
+class PackedTeacherOutputsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.prefix = op.join(self.tmp_dir.name, "prob_idx_train")
+        rng = np.random.RandomState(0)
+        self.outputs = [
+            (rng.randint(0, 30000, size=(n, 4)), rng.randn(n, 4).astype(np.float32)) for n in [3, 0, 7]]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, idx_dtype):
+        with PackedTeacherOutputsBuilder(self.prefix, 4, idx_dtype=idx_dtype) as builder:
+            for idxs, scores in self.outputs:
+                builder.add_item(idxs, scores)
+        return PackedTeacherOutputs(self.prefix)
+
+    def check_outputs(self, packed):
+        self.assertEqual(len(self.outputs), len(packed))
+        for i, (idxs, scores) in enumerate(self.outputs):
+            packed_idxs, packed_scores = packed[i]
+            self.assertEqual(idxs.tolist(), packed_idxs.tolist())
+            np.testing.assert_allclose(scores, packed_scores, rtol=1e-3, atol=1e-3)
+
+    def test_int16(self):
+        packed = self.write(np.int16)
+        self.assertEqual(np.int16, packed.idx_dtype)
+        self.assertEqual(np.float16, packed.score_dtype)
+        self.check_outputs(packed)
+        # 2 bytes for each index and score
+        self.assertEqual(10 * 4 * 4, op.getsize(self.prefix + ".bin"))
+
+    def test_int32(self):
+        packed = self.write(np.int32)
+        self.assertEqual(np.int32, packed.idx_dtype)
+        self.check_outputs(packed)
+        # the records are aligned to the int32 indices
+        self.assertTrue(all(o % 4 == 0 for o in packed.offsets))
+
+    def test_pickle(self):
+        packed = self.write(np.int16)
+        packed.get(0)
+        self.assertIsNotNone(packed._data)
+        unpickled = pickle.loads(pickle.dumps(packed))
+        self.assertIsNone(unpickled._data)
+        self.check_outputs(unpickled)
+
+    def test_indices_overflow(self):
+        with PackedTeacherOutputsBuilder(self.prefix, 4, idx_dtype=np.int16) as builder:
+            with self.assertRaises(AssertionError):
+                builder.add_item(np.full((2, 4), 40000), np.zeros((2, 4)))
+
+    def test_index_dtype(self):
+        self.assertEqual(np.int16, index_dtype(32768))
+        self.assertEqual(np.int32, index_dtype(32769))
+
+    def test_unordered(self):
+        with PackedTeacherOutputsBuilder(self.prefix, 4, num_samples=len(self.outputs)) as builder:
+            for i in [2, 0, 1]:
+                builder.add_item(*self.outputs[i], index=i)
+        self.check_outputs(PackedTeacherOutputs(self.prefix))
+
+    def test_resume(self):
+        builder = PackedTeacherOutputsBuilder(self.prefix, 4, num_samples=len(self.outputs))
+        builder.add_item(*self.outputs[2], index=2)
+        builder.checkpoint()
+        # interrupted before the next checkpoint
+        builder.add_item(*self.outputs[0], index=0)
+        builder._data_file.close()
+        with PackedTeacherOutputsBuilder(
+                self.prefix, 4, num_samples=len(self.outputs), resume=True) as builder:
+            self.assertEqual([False, False, True], [builder.has(i) for i in range(3)])
+            for i in [0, 1]:
+                builder.add_item(*self.outputs[i], index=i)
+        self.check_outputs(PackedTeacherOutputs(self.prefix))
+        self.assertEqual(sum(o[0].size for o in self.outputs) * 6, op.getsize(self.prefix + ".bin"))
+
+    def test_merge_shards(self):
+        shards = [shard_prefix(self.prefix, i, 2) for i in range(2)]
+        for shard, ids in zip(shards, [[2], [0, 1]]):
+            with PackedTeacherOutputsBuilder(shard, 4, num_samples=len(self.outputs)) as builder:
+                for i in ids:
+                    builder.add_item(*self.outputs[i], index=i)
+        merge_shards(shards, self.prefix)
+        self.check_outputs(PackedTeacherOutputs(self.prefix))
+
+    def test_missing(self):
+        with PackedTeacherOutputsBuilder(self.prefix, 4, num_samples=len(self.outputs)) as builder:
+            builder.add_item(*self.outputs[0], index=0)
+        packed = PackedTeacherOutputs(self.prefix)
+        self.assertEqual(3, len(packed))
+        self.assertEqual(self.outputs[0][0].tolist(), packed[0][0].tolist())
+        with self.assertRaises(KeyError):
+            packed.get(1)
+
+
+class KDDatasetPackedTeacherOutputsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        tgt_texts = ["ciao mondo", "come va"]
+        with open(op.join(self.root, "train.tsv"), "w") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["id", "audio", "n_frames", "src_text", "tgt_text"], delimiter="\t",
+                quotechar=None, doublequote=False, lineterminator="\n", quoting=csv.QUOTE_NONE)
+            writer.writeheader()
+            for i, tgt in enumerate(tgt_texts):
+                writer.writerow({"id": i, "audio": f"{i}.npy", "n_frames": 10, "src_text": tgt, "tgt_text": tgt})
+        self.tgt_dict = Dictionary()
+        for text in tgt_texts:
+            self.tgt_dict.encode_line(text)
+        self.tgt_dict.save(op.join(self.root, "dict.txt"))
+        with open(op.join(self.root, "config.yaml"), "w") as f:
+            f.write("vocab_filename: dict.txt\nvocab_filename_src: dict.txt\n")
+        self.idxs = [np.array([[4, 5], [5, 4], [2, 4]]), np.array([[6, 7], [7, 6], [2, 6]])]
+        self.scores = [np.array([[1.5, 0.5], [2., -1.], [3., 0.25]]), np.array([[0.5, 0.], [1., 0.75], [2., 1.]])]
+        with PackedTeacherOutputsBuilder(
+                teacher_outputs_prefix(self.root, "train"), 2, idx_dtype=index_dtype(len(self.tgt_dict))) \
+                as builder:
+            for idxs, scores in zip(self.idxs, self.scores):
+                builder.add_item(idxs, scores)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('fairseq.data.audio.speech_to_text_dataset.FeatureStore.get')
+    def test_items(self, mock_get):
+        mock_get.return_value = np.zeros((10, 4), dtype=np.float32)
+        # the packed outputs do not need the prob_idx_train.tsv
+        dataset = SpeechToTextDatasetCreatorKD.from_tsv(
+            self.root, S2TDataConfigSrc(op.join(self.root, "config.yaml")), "train", self.tgt_dict, self.tgt_dict,
+            None, None, None, is_train_split=True, epoch=1, seed=1).datasets[0]
+        self.assertIsNotNone(dataset.teacher_outputs)
+        for i in range(len(dataset)):
+            _, _, _, _, idxs, probs = dataset[i]
+            self.assertEqual(torch.int32, idxs.dtype)
+            self.assertEqual(torch.float32, probs.dtype)
+            self.assertEqual(self.idxs[i].tolist(), idxs.tolist())
+            self.assertEqual(self.scores[i].tolist(), probs.tolist())
+        batch = dataset.collater([dataset[0], dataset[1]])
+        self.assertEqual([2, 3, 2], list(batch["teacher_output"][0].shape))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import csv
+import glob
+import os.path as op
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from examples.speech_to_text.data.speech_to_text_dataset_with_src import S2TDataConfigSrc, \
+    SpeechToTextDatasetCreatorWithSrc
+from fairseq.data import Dictionary
+from fairseq.data.audio import speech_to_text_dataset
+from fairseq.data.audio.speech_to_text_dataset import compute_token_lengths
+
+
+class CharTokenizer:
+    def encode(self, text):
+        return " ".join(text.replace(" ", "_"))
+
+
+class TokenLengthsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        self.tgt_texts = ["ciao mondo", "come va", "bene"]
+        self.src_texts = ["hello world", "how are you", "fine"]
+        self.write_tsv(self.tgt_texts)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_tsv(self, tgt_texts):
+        with open(op.join(self.root, "train.tsv"), "w") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["id", "audio", "n_frames", "src_text", "tgt_text"], delimiter="\t",
+                quotechar=None, doublequote=False, lineterminator="\n", quoting=csv.QUOTE_NONE)
+            writer.writeheader()
+            for i, (src, tgt) in enumerate(zip(self.src_texts, tgt_texts)):
+                writer.writerow({"id": i, "audio": f"{i}.npy", "n_frames": 10 * (i + 1), "src_text": src, "tgt_text": tgt})
+
+    def load_dataset(self):
+        return SpeechToTextDatasetCreatorWithSrc.from_tsv(
+            self.root, S2TDataConfigSrc(op.join(self.root, "config.yaml")), "train", Dictionary(), Dictionary(),
+            None, CharTokenizer(), None, is_train_split=True, epoch=1, seed=1).datasets[0]
+
+    def test_lengths(self):
+        dataset = self.load_dataset()
+        self.assertEqual([10, 7, 4], dataset.tgt_lens.tolist())
+        self.assertEqual([2, 3, 1], dataset.src_lens.tolist())
+        self.assertEqual((20, 7), dataset.size(1))
+        self.assertIsInstance(dataset.sizes, np.ndarray)
+        self.assertEqual([10, 20, 30], dataset.sizes.tolist())
+
+    def test_cache(self):
+        self.load_dataset()
+        self.assertEqual(1, len(glob.glob(op.join(self.root, "train.tsv.tgt_lens.*.npy"))))
+        self.assertEqual(1, len(glob.glob(op.join(self.root, "train.tsv.src_lens.*.npy"))))
+        with patch.object(speech_to_text_dataset, "compute_token_lengths") as mock_compute:
+            dataset = self.load_dataset()
+            mock_compute.assert_not_called()
+        self.assertEqual([10, 7, 4], dataset.tgt_lens.tolist())
+        # the cached lengths are not used if the texts change
+        self.write_tsv(["ciao", "come va", "bene"])
+        dataset = self.load_dataset()
+        self.assertEqual([4, 7, 4], dataset.tgt_lens.tolist())
+        self.assertEqual(2, len(glob.glob(op.join(self.root, "train.tsv.tgt_lens.*.npy"))))
+
+    def test_cache_tokenizer_model(self):
+        # the path of the model is relative to the data root, not to the working directory
+        with open(op.join(self.root, "config.yaml"), "w") as f:
+            f.write("bpe_tokenizer:\n  bpe: sentencepiece\n  sentencepiece_model: spm.model\n")
+        with open(op.join(self.root, "spm.model"), "wb") as f:
+            f.write(b"first model")
+        self.load_dataset()
+        self.assertEqual(1, len(glob.glob(op.join(self.root, "train.tsv.tgt_lens.*.npy"))))
+        # the cached lengths are not used if the model changes
+        with open(op.join(self.root, "spm.model"), "wb") as f:
+            f.write(b"second model")
+        with patch.object(speech_to_text_dataset, "compute_token_lengths", return_value=np.zeros(3)) as mock_compute:
+            self.load_dataset()
+            # only the targets are tokenized with the model
+            mock_compute.assert_called_once()
+        self.assertEqual(2, len(glob.glob(op.join(self.root, "train.tsv.tgt_lens.*.npy"))))
+
+    def test_parallel(self):
+        texts = [f"text number {i}" * (i % 7) for i in range(1000)]
+        self.assertEqual(
+            compute_token_lengths(texts, bpe_tokenizer=CharTokenizer()).tolist(),
+            compute_token_lengths(texts, bpe_tokenizer=CharTokenizer(), num_workers=3, chunk_size=100).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
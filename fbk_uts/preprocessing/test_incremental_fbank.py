@@ -0,0 +1,80 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import importlib.util
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import torch
+
+from examples.speech_to_text.data_utils_new import extract_fbank_features, IncrementalFbankExtractor
+
+
+def fake_fbank(waveform, sample_rate, n_bins=80):
+    # Deterministic frame-level features with the Kaldi framing (25ms windows, 10ms shift)
+    frame_length, frame_shift = sample_rate // 40, sample_rate // 100
+    n_frames = 1 + (len(waveform) - frame_length) // frame_shift
+    frames = np.stack([waveform[i * frame_shift:i * frame_shift + frame_length] for i in range(n_frames)])
+    return np.stack([frames.sum(axis=1), frames[:, 0], frames[:, -1]], axis=1)
+
+
+class IncrementalFbankExtractorTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.stream = torch.rand(16000 * 20) * 2 - 1
+
+    def check_sliding_windows(self, window_samples, step_samples):
+        extractor = IncrementalFbankExtractor(16000)
+        end = step_samples
+        while end <= len(self.stream):
+            start = max(0, end - window_samples)
+            window = self.stream[start:end]
+            incremental = extractor.extract(window, start)
+            batch = extract_fbank_features(window, 16000)
+            self.assertEqual(batch.shape, incremental.shape)
+            self.assertTrue(np.array_equal(batch, incremental))
+            end += step_samples
+        return extractor
+
+    @patch('examples.speech_to_text.data_utils_new._get_kaldi_fbank')
+    def test_sliding_windows(self, mock_fbank):
+        mock_fbank.side_effect = fake_fbank
+        extractor = self.check_sliding_windows(16000 * 10, 24000)
+        self.assertGreater(extractor.cached_frames, 4 * extractor.computed_frames)
+
+    @patch('examples.speech_to_text.data_utils_new._get_kaldi_fbank')
+    def test_unaligned_windows(self, mock_fbank):
+        mock_fbank.side_effect = fake_fbank
+        # windows that do not start at a multiple of the frame shift are recomputed
+        extractor = self.check_sliding_windows(16000 * 3 + 7, 16000 + 3)
+        self.assertGreater(extractor.computed_frames, 0)
+
+    @patch('examples.speech_to_text.data_utils_new._get_kaldi_fbank')
+    def test_restart(self, mock_fbank):
+        mock_fbank.side_effect = fake_fbank
+        extractor = IncrementalFbankExtractor(16000)
+        extractor.extract(self.stream[16000:32000], 16000)
+        # a window before the cached one cannot reuse anything
+        features = extractor.extract(self.stream[:16000], 0)
+        self.assertTrue(np.array_equal(extract_fbank_features(self.stream[:16000], 16000), features))
+
+    @unittest.skipUnless(importlib.util.find_spec("torchaudio") is not None, "torchaudio is not installed")
+    @patch('examples.speech_to_text.data_utils_new._get_kaldi_fbank')
+    def test_torchaudio_fbank(self, mock_fbank):
+        mock_fbank.return_value = None
+        self.check_sliding_windows(16000 * 4, 24000)
+
+
+if __name__ == '__main__':
+    unittest.main()
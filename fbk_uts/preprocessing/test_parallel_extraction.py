@@ -0,0 +1,92 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import soundfile as sf
+import torch
+from torch.utils.data import Dataset
+
+from examples.speech_to_text.data_utils_new import extract_fbank_features, extract_fbank_features_parallel, \
+    get_features_manifest, get_num_samples
+from fairseq.data.audio.speech_to_text_dataset import get_features_or_waveform
+from fbk_uts.preprocessing.test_incremental_fbank import fake_fbank
+
+
+class FakeDataset(Dataset):
+    def __init__(self, name, lengths):
+        self.name = name
+        self.waveforms = [torch.rand(1, length) * 2 - 1 for length in lengths]
+
+    def __getitem__(self, n):
+        return self.waveforms[n], 16000, "text", f"{self.name}_{n}"
+
+    def __len__(self):
+        return len(self.waveforms)
+
+
+@patch('examples.speech_to_text.data_utils_new._get_kaldi_fbank', side_effect=fake_fbank)
+class ParallelExtractionTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.datasets = [FakeDataset("train", [1600, 3200, 800, 4000, 2400]), FakeDataset("dev", [1200, 2000])]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def check_features(self, manifest):
+        self.assertEqual(7, len(manifest))
+        for dataset in self.datasets:
+            for waveform, sample_rate, _, utt_id in dataset:
+                expected = extract_fbank_features(waveform, sample_rate)
+                features = get_features_or_waveform(manifest[utt_id])
+                self.assertEqual(expected.shape, features.shape)
+                self.assertTrue(np.allclose(expected, features))
+
+    def test_zip(self, mock_fbank):
+        sequential = extract_fbank_features_parallel(self.datasets, self.root / "seq", chunk_size=2)
+        parallel = extract_fbank_features_parallel(self.datasets, self.root / "par", num_workers=2, chunk_size=2)
+        self.check_features(sequential)
+        self.check_features(parallel)
+        self.assertEqual({k: v.replace("seq", "par") for k, v in sequential.items()}, parallel)
+        self.assertEqual(sequential, get_features_manifest(self.root / "seq"))
+
+    def test_packed(self, mock_fbank):
+        manifest = extract_fbank_features_parallel(
+            self.datasets, self.root / "fbank", num_workers=2, chunk_size=3, feature_format="packed")
+        self.check_features(manifest)
+        self.assertEqual(
+            [f"{(self.root / 'fbank').as_posix()}.bin:{i}" for i in range(7)],
+            [manifest[f"train_{i}"] for i in range(5)] + [manifest[f"dev_{i}"] for i in range(2)])
+        self.assertEqual(manifest, get_features_manifest(self.root / "fbank", "packed"))
+
+
+class NumSamplesTestCase(unittest.TestCase):
+    def test_num_samples(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            wav_path = (Path(tmp_dir) / "audio.wav").as_posix()
+            sf.write(wav_path, np.zeros(16000, dtype=np.float32), 16000)
+            self.assertEqual(16000, get_num_samples(wav_path))
+            self.assertEqual(6000, get_num_samples(wav_path, offset=10000))
+            self.assertEqual(4000, get_num_samples(wav_path, offset=10000, num_samples=4000))
+            self.assertEqual(6000, get_num_samples(wav_path, offset=10000, num_samples=8000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import io
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from examples.speech_to_text.data_utils_new import create_zip, get_zip_manifest
+from fairseq.data.audio.speech_to_text_dataset import get_features_or_waveform
+
+
+class ZipManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        rng = np.random.RandomState(0)
+        self.features = {f"utt_{i}": rng.rand(10 + i, 4).astype(np.float32) for i in range(5)}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_create_zip(self):
+        npy_root = self.root / "fbank"
+        npy_root.mkdir()
+        for utt_id, features in self.features.items():
+            np.save(npy_root / f"{utt_id}.npy", features)
+        manifest = create_zip(npy_root, self.root / "fbank.zip")
+        self.assertEqual(manifest, get_zip_manifest(self.root / "fbank.zip", validate=True))
+        for utt_id, features in self.features.items():
+            self.assertTrue(np.array_equal(features, get_features_or_waveform(manifest[utt_id])))
+
+    def test_extra_field(self):
+        # local headers with an extra field, as written by other zip tools
+        zip_path = self.root / "extra.zip"
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as f:
+            for utt_id, features in self.features.items():
+                data = io.BytesIO()
+                np.save(data, features)
+                info = zipfile.ZipInfo(f"{utt_id}.npy")
+                info.extra = b"\xfe\xca\x04\x00abcd"
+                f.writestr(info, data.getvalue())
+        manifest = get_zip_manifest(zip_path, validate=True, num_workers=2)
+        for utt_id, features in self.features.items():
+            self.assertTrue(np.array_equal(features, get_features_or_waveform(manifest[utt_id])))
+
+    def test_validation(self):
+        zip_path = self.root / "invalid.zip"
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as f:
+            f.writestr("utt_0.npy", b"not a npy file")
+        self.assertEqual(1, len(get_zip_manifest(zip_path)))
+        with self.assertRaises(AssertionError):
+            get_zip_manifest(zip_path, validate=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -103,12 +103,18 @@ class SpeechformerCompressionTestCase(unittest.TestCase):
         self.assertEqual(out_lens[1].item(), 3)
         self.assertEqual(out_lens[2].item(), 3)
         self.assertEqual(out_lens[3].item(), 3)
-        fake_batch_predicted = [
-            [('a', 1), ('b', 2), ('a', 2), ('c', 1), ('b', 2), ('a', 1), ('c', 5)],
-            [('a', 10)]]
-        out_batch_pred = encoder.ensure_max_ctc_out_len(fake_batch_predicted)
-        self.assertEqual([('a', 5), ('b', 4), ('c', 5)], out_batch_pred[0])
-        self.assertEqual([('a', 10)], out_batch_pred[1])
+        # a = 0, b = 1, c = 2: the predictions are
+        # [(a, 1), (b, 2), (a, 2), (c, 1), (b, 2), (a, 1), (c, 5)] and [(a, 10)]
+        fake_predicted = torch.LongTensor([
+            [0, 1, 1, 0, 0, 2, 1, 1, 0, 2, 2, 2, 2, 2],
+            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+        segments = encoder.ctc_segments(fake_predicted, torch.LongTensor([14, 10]))
+        # merged into [(a, 5), (b, 4), (c, 5)] and [(a, 10)]
+        self.assertEqual([3, 1], segments.lengths.tolist())
+        self.assertEqual([0, 1, 2], segments.labels[0].tolist())
+        self.assertEqual(0, segments.labels[1][0].item())
+        self.assertEqual([5, 4, 5], segments.segment_ids[0][segments.mask[0]].bincount().tolist())
+        self.assertEqual([10], segments.segment_ids[1][segments.mask[1]].bincount().tolist())
 
     def test_fixed_compression(self):
         custom_args = copy.deepcopy(self.base_args)
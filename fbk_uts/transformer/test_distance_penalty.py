@@ -0,0 +1,98 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+from argparse import Namespace
+
+import torch
+
+from examples.speech_to_text.models.s2t_transformer_fbk import s2t_transformer_s
+from examples.speech_to_text.modules.distance_penalty import GaussPenalty, LogPenalty
+from examples.speech_to_text.modules.local_attention import LocalAttention
+from examples.speech_to_text.modules.transformer_layer_penalty import TransformerEncoderLayerPenalty
+
+
+class DistancePenaltyTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.args = Namespace(encoder_attention_heads=4, init_variance=3.0)
+
+    @staticmethod
+    def distances(tgt_len, src_len):
+        return torch.abs(torch.arange(tgt_len).unsqueeze(1) - torch.arange(src_len).unsqueeze(0)).float()
+
+    def test_log_penalty(self):
+        penalty = LogPenalty(self.args)
+        attn_weights = torch.rand(2, 4, 6, 9)
+        for tgt_len, src_len in [(6, 9), (3, 2), (12, 12)]:
+            distances = self.distances(tgt_len, src_len)
+            expected = torch.max(torch.zeros_like(distances), torch.log(distances))
+            self.assertTrue(torch.equal(expected, penalty(tgt_len, src_len, attn_weights)))
+        self.assertEqual(1, len(penalty._cache))
+        self.assertEqual([12, 12], list(penalty._cache[(attn_weights.device, torch.float)].shape))
+
+    def test_gauss_penalty(self):
+        penalty = GaussPenalty(self.args)
+        with torch.no_grad():
+            penalty.variance.uniform_(1.0, 5.0)
+        distances = self.distances(7, 5)
+        expected = (distances * distances).unsqueeze(0) / (2 * penalty.variance * penalty.variance).view(-1, 1, 1)
+        actual = penalty(7, 5, torch.rand(2, 4, 7, 5))
+        self.assertEqual([4, 7, 5], list(actual.shape))
+        torch.testing.assert_close(expected, actual)
+        # the variance is trained
+        actual.sum().backward()
+        self.assertIsNotNone(penalty.variance.grad)
+
+    def test_local_attention(self):
+        penalty = GaussPenalty(self.args)
+        attention = LocalAttention(16, 4, self_attention=True, penalty=penalty)
+        x = torch.rand(7, 2, 16)
+        # the penalty is not applied by the fused PyTorch implementation
+        attn_weights, _ = attention(x, x, x, incremental_state={}, before_softmax=True)
+        torch.testing.assert_close(self.expected_attn_weights(attention, penalty, x), attn_weights)
+        # and by the fused one only when it is enabled
+        attention.always_apply_penalty = True
+        attn_weights, _ = attention(x, x, x, before_softmax=True)
+        torch.testing.assert_close(self.expected_attn_weights(attention, penalty, x), attn_weights)
+
+    def expected_attn_weights(self, attention, penalty, x):
+        q = (attention.q_proj(x) * attention.scaling).view(7, 2 * 4, 4).transpose(0, 1)
+        k = attention.k_proj(x).view(7, 2 * 4, 4).transpose(0, 1)
+        distances = self.distances(7, 7)
+        return torch.bmm(q, k.transpose(1, 2)) - (distances * distances).unsqueeze(0) / (
+            2 * penalty.variance * penalty.variance).unsqueeze(1).unsqueeze(2).repeat(2, 1, 1)
+
+    def test_encoder_layer(self):
+        args = Namespace(encoder_embed_dim=16, distance_penalty="log", init_variance=1.0)
+        s2t_transformer_s(args)
+        layer = TransformerEncoderLayerPenalty(args)
+        layer.eval()
+        x = torch.rand(7, 2, 16)
+        padding_mask = torch.zeros(2, 7, dtype=torch.bool)
+        padding_mask[1, 5:] = True
+        out = layer(x, padding_mask)
+        self.assertEqual([7, 2, 16], list(out.shape))
+        self.assertTrue(torch.all(torch.isfinite(out)))
+        # the existing models are not affected by the penalty, unless enabled
+        layer.self_attn.penalty = None
+        torch.testing.assert_close(out, layer(x, padding_mask))
+        args.apply_distance_penalty = True
+        penalty_layer = TransformerEncoderLayerPenalty(args)
+        penalty_layer.load_state_dict(layer.state_dict())
+        penalty_layer.eval()
+        self.assertFalse(torch.allclose(out, penalty_layer(x, padding_mask)))
+
+
+if __name__ == '__main__':
+    unittest.main()
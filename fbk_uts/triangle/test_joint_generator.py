@@ -0,0 +1,67 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+
+import torch
+
+from examples.speech_to_text.joint_sequence_generator import JointSequenceGenerator
+from examples.speech_to_text.models.s2t_transformer_fbk_triangle import S2TTransformerTriangle
+from examples.speech_to_text.twophase_sequence_generator import TwoPhaseSequenceGenerator
+from fbk_uts.triangle import test_triangle
+
+
+class JointSequenceGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        triangle_setup = test_triangle.TriangleTestCase()
+        triangle_setup.setUp()
+        self.samples = triangle_setup.samples
+        self.src_dict = triangle_setup.src_dict
+        self.tgt_dict = triangle_setup.tgt_dict
+        self.model = S2TTransformerTriangle.build_model(triangle_setup.args, triangle_setup.task)
+        self.model.eval()
+
+    def generate(self, generator_cls, **kwargs):
+        generator = generator_cls([self.model], self.src_dict, self.tgt_dict, max_len_a=0, max_len_b=10, **kwargs)
+        with torch.no_grad():
+            return generator.generate([self.model], self.samples)
+
+    def test_full_lookahead(self):
+        # the translation starts when the transcript is over, as in the two-phase generation
+        two_phase_hypos = self.generate(TwoPhaseSequenceGenerator, beam_size=1)
+        joint_hypos = self.generate(JointSequenceGenerator, beam_size=1, aux_lookahead=11)
+        for two_phase_hypo, joint_hypo in zip(two_phase_hypos, joint_hypos):
+            self.assertEqual(two_phase_hypo[0]["aux_tokens"].tolist(), joint_hypo[0]["aux_tokens"].tolist())
+            self.assertEqual(two_phase_hypo[0]["tokens"].tolist(), joint_hypo[0]["tokens"].tolist())
+            self.assertAlmostEqual(two_phase_hypo[0]["score"].item(), joint_hypo[0]["score"].item(), places=4)
+            torch.testing.assert_close(
+                two_phase_hypo[0]["positional_scores"], joint_hypo[0]["positional_scores"], rtol=1e-4, atol=1e-4)
+
+    def test_interleaved(self):
+        greedy_hypos = self.generate(TwoPhaseSequenceGenerator, beam_size=1)
+        for aux_lookahead in [1, 3]:
+            joint_hypos = self.generate(JointSequenceGenerator, beam_size=3, aux_lookahead=aux_lookahead)
+            self.assertEqual(len(greedy_hypos), len(joint_hypos))
+            for greedy_hypo, sent_hypos in zip(greedy_hypos, joint_hypos):
+                self.assertEqual(3, len(sent_hypos))
+                scores = [h["score"].item() for h in sent_hypos]
+                self.assertEqual(sorted(scores, reverse=True), scores)
+                for h in sent_hypos:
+                    # the transcript is completed also when the translation is over before it
+                    self.assertEqual(greedy_hypo[0]["aux_tokens"].tolist(), h["aux_tokens"].tolist())
+                    self.assertEqual(self.tgt_dict.eos(), h["tokens"][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
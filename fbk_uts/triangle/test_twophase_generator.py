@@ -0,0 +1,96 @@
+# Copyright 2023 FBK
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License
+import unittest
+
+import torch
+
+from examples.speech_to_text.models.s2t_transformer_fbk_triangle import S2TTransformerTriangle
+from examples.speech_to_text.twophase_sequence_generator import TwoPhaseSequenceGenerator
+from fbk_uts.triangle import test_triangle
+
+
+class TwoPhaseSequenceGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        triangle_setup = test_triangle.TriangleTestCase()
+        triangle_setup.setUp()
+        self.samples = triangle_setup.samples
+        self.src_dict = triangle_setup.src_dict
+        self.model = S2TTransformerTriangle.build_model(triangle_setup.args, triangle_setup.task)
+        self.model.eval()
+        self.generator = TwoPhaseSequenceGenerator(
+            [self.model], self.src_dict, triangle_setup.tgt_dict, beam_size=3, max_len_a=0.5, max_len_b=3)
+
+    def test_packed_aux_nbest(self):
+        net_input = self.samples["net_input"]
+        bsz = net_input["src_tokens"].shape[0]
+        with torch.no_grad():
+            encoder_outs = self.generator.model.forward_encoder(net_input)
+            new_order = torch.arange(bsz).view(-1, 1).repeat(1, 3).view(-1)
+            encoder_outs = self.generator.model.reorder_encoder_out(encoder_outs, new_order)
+            aux_nbest = self.generator._generate_aux(self.samples, encoder_outs)
+        tokens, lengths = aux_nbest["tokens"], aux_nbest["lengths"]
+        self.assertEqual(bsz, tokens.shape[0])
+        self.assertEqual(3, tokens.shape[1])
+        self.assertIsNone(aux_nbest["aux_tags"])
+        self.assertEqual(list(tokens.shape) + [self.model.decoder.embed_dim],
+                         list(aux_nbest["auxiliary_out"].shape))
+        self.assertEqual(self.model.decoder.embed_tokens.weight.dtype, aux_nbest["auxiliary_out"].dtype)
+        self.assertTrue(torch.all(lengths > 0))
+        self.assertTrue(torch.all(torch.isfinite(aux_nbest["scores"])))
+        for b in range(bsz):
+            for k in range(3):
+                length = lengths[b, k]
+                self.assertEqual(self.src_dict.eos(), tokens[b, k, length - 1])
+                self.assertTrue(torch.all(tokens[b, k, length:] == self.src_dict.pad()))
+
+    def test_reorder_aux_decoder_states(self):
+        net_input = self.samples["net_input"]
+        bsz = net_input["src_tokens"].shape[0]
+        aux_len, embed_dim = 5, self.model.decoder.embed_dim
+        aux_out = torch.rand(bsz, aux_len, embed_dim)
+        aux_tokens = torch.randint(4, 10, (bsz, aux_len))
+        aux_tokens[0, 3:] = self.src_dict.pad()
+        prev_output_tokens = torch.randint(4, 10, (bsz, 2))
+        new_order = torch.tensor([2, 0, 2])
+        with torch.no_grad():
+            encoder_out = self.model.encoder(net_input["src_tokens"], net_input["src_lengths"])
+            incremental_state = {}
+            self.model.forward_decoder(
+                prev_output_tokens[:, :1], encoder_out, aux_out, aux_tokens, incremental_state=incremental_state)
+            self.model.decoder.reorder_incremental_state_scripting(incremental_state, new_order)
+            encoder_out = self.model.encoder.reorder_encoder_out(encoder_out, new_order)
+            prev_output_tokens = prev_output_tokens.index_select(0, new_order)
+            incremental_out, _ = self.model.forward_decoder(
+                prev_output_tokens, encoder_out, aux_out, aux_tokens, incremental_state=incremental_state)
+            # the auxiliary outputs are not reordered, as their projections are cached
+            full_out, _ = self.model.forward_decoder(
+                prev_output_tokens, encoder_out, aux_out.index_select(0, new_order),
+                aux_tokens.index_select(0, new_order))
+        torch.testing.assert_close(full_out[:, -1], incremental_out[:, -1], rtol=1e-5, atol=1e-5)
+
+    def test_generate(self):
+        with torch.no_grad():
+            hypos = self.generator.generate([self.model], self.samples)
+        self.assertEqual(self.samples["net_input"]["src_tokens"].shape[0], len(hypos))
+        for sent_hypos in hypos:
+            self.assertEqual(3, len(sent_hypos))
+            scores = [h["score"].item() for h in sent_hypos]
+            self.assertEqual(sorted(scores, reverse=True), scores)
+            for h in sent_hypos:
+                self.assertEqual(self.src_dict.eos(), h["aux_tokens"][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
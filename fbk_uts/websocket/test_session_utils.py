@@ -0,0 +1,151 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import random
+import unittest
+
+from websocket_server.session_utils import AudioRingBuffer, StServerTerminatedError, assignLeastLoadedWorker, \
+    endSession
+
+
+class FakeWorker:
+    def __init__(self, numSessions, queueDepth, alive=True):
+        self.numSessions = numSessions
+        self.queueDepth = queueDepth
+        self.alive = alive
+        self.requests = []
+
+    def load(self):
+        return self.numSessions, self.queueDepth
+
+    async def sendReceive(self, msg):
+        self.requests.append(msg)
+        if not self.alive:
+            raise StServerTerminatedError()
+        return '{"status": 0}'
+
+
+class FakeSession:
+    def __init__(self, worker):
+        self.sessionId = "test"
+        self.worker = worker
+        self.released = False
+        self.numRemoveFiles = 0
+
+    def removeFiles(self):
+        self.numRemoveFiles += 1
+
+
+class AssignLeastLoadedWorkerTestCase(unittest.TestCase):
+    def test_fewer_sessions(self):
+        workers = [FakeWorker(2, 0), FakeWorker(1, 5), FakeWorker(3, 0)]
+        self.assertIs(workers[1], assignLeastLoadedWorker(workers))
+        self.assertEqual([2, 2, 3], [w.numSessions for w in workers])
+
+    def test_fewer_queued_requests(self):
+        workers = [FakeWorker(1, 3), FakeWorker(1, 1), FakeWorker(1, 2)]
+        self.assertIs(workers[1], assignLeastLoadedWorker(workers))
+
+    def test_round_robin_when_idle(self):
+        workers = [FakeWorker(0, 0) for _ in range(3)]
+        assigned = [assignLeastLoadedWorker(workers) for _ in range(6)]
+        self.assertEqual(workers + workers, assigned)
+        self.assertEqual([2, 2, 2], [w.numSessions for w in workers])
+
+    def test_skip_dead_workers(self):
+        workers = [FakeWorker(0, 0, alive=False), FakeWorker(3, 2)]
+        self.assertIs(workers[1], assignLeastLoadedWorker(workers))
+        self.assertEqual([0, 4], [w.numSessions for w in workers])
+        workers[1].alive = False
+        with self.assertRaises(StServerTerminatedError):
+            assignLeastLoadedWorker(workers)
+
+
+class EndSessionTestCase(unittest.TestCase):
+    def end(self, session):
+        asyncio.get_event_loop().run_until_complete(endSession(session))
+
+    def test_end_session(self):
+        worker = FakeWorker(1, 0)
+        session = FakeSession(worker)
+        self.end(session)
+        self.assertEqual(['{"command": "end_session", "session_id": "test"}'], worker.requests)
+        self.assertEqual(0, worker.numSessions)
+        self.assertEqual(1, session.numRemoveFiles)
+
+    def test_failing_end_session(self):
+        worker = FakeWorker(1, 0, alive=False)
+        session = FakeSession(worker)
+        with self.assertRaises(StServerTerminatedError):
+            self.end(session)
+        self.assertEqual(0, worker.numSessions)
+        self.assertEqual(1, session.numRemoveFiles)
+        # as when the connection is closed after the failure, the session is not released again
+        self.end(session)
+        self.assertEqual(1, len(worker.requests))
+        self.assertEqual(0, worker.numSessions)
+        self.assertEqual(1, session.numRemoveFiles)
+
+
+class AudioRingBufferTestCase(unittest.TestCase):
+    def test_same_slices_of_whole_audio(self):
+        random.seed(0)
+        capacity = 100
+        buffer = AudioRingBuffer(capacity)
+        audio = bytearray()
+        for _ in range(200):
+            chunk = bytes(random.randrange(256) for _ in range(random.randrange(1, 130)))
+            buffer.append(chunk)
+            audio += chunk
+            self.assertEqual(len(audio), len(buffer))
+            self.assertEqual(bytes(audio[-capacity:]), bytes(buffer[len(audio) - capacity:]))
+            start = random.randrange(len(audio) - min(capacity, len(audio)), len(audio) + 1)
+            self.assertEqual(bytes(audio[start:start + 30]), bytes(buffer[start:start + 30]))
+
+    def test_positions_before_stream_start(self):
+        buffer = AudioRingBuffer(10)
+        buffer.append(b'abcd')
+        self.assertEqual(b'abc', bytes(buffer[-5:3]))
+        self.assertEqual(b'abcd', bytes(buffer[:]))
+        self.assertEqual(b'', bytes(buffer[3:1]))
+
+    def test_chunk_longer_than_capacity(self):
+        buffer = AudioRingBuffer(4)
+        buffer.append(b'abcdefgh')
+        self.assertEqual(8, len(buffer))
+        self.assertEqual(4, buffer.firstPosition())
+        self.assertEqual(b'efgh', bytes(buffer[4:]))
+
+    def test_evicted_positions(self):
+        buffer = AudioRingBuffer(4)
+        buffer.append(b'abcd')
+        buffer.append(b'efgh')
+        # the buffer is full, so only the last capacity bytes are kept
+        buffer.append(b'ij')
+        self.assertEqual(6, buffer.firstPosition())
+        self.assertEqual(b'ghij', bytes(buffer[6:]))
+        with self.assertRaises(IndexError):
+            buffer[5:8]
+
+    def test_only_contiguous_slices(self):
+        buffer = AudioRingBuffer(4)
+        buffer.append(b'abcd')
+        with self.assertRaises(TypeError):
+            buffer[0]
+        with self.assertRaises(TypeError):
+            buffer[0:4:2]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -66,7 +66,8 @@ test -f $yamlF || { echo cannot find yamlF $yamlF ; exit 1 ; }
 
 
 
-logFerr=$wDir/ioserver.${sysName}.LOG.err
+# each ST server started by the FBK API server has its own log file
+logFerr=$wDir/ioserver.${sysName}${FBK_ST_WORKER_ID:+.$FBK_ST_WORKER_ID}.LOG.err
 
 # in absence of the PRINT_STDERR env var, print STDERR on a local flie 
 if test -z "${PRINT_STDERR}"
@@ -24,12 +24,14 @@ import json
 import logging
 import sys, os
 import datetime
-import subprocess
 import base64
+import collections
 import argparse
 import shutil
 import time
 
+from session_utils import AudioRingBuffer, StServerTerminatedError, assignLeastLoadedWorker, endSession
+
 
 def getTime():
     # return (float) seconds
@@ -40,38 +42,116 @@ def debug(msg):
         now = datetime.datetime.now().isoformat(sep="T", timespec="seconds")
         print(f'{now} {msg}')
 
-def stServerStart():
-    global stServerProc, stServerCmdList
-    # start stServer
-    stServerProc = subprocess.Popen(stServerCmdList, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-    # wait stServer to start up
-    debug("waiting stServer to start up ...")
-    line = stServerProc.stdout.readline().decode("utf-8")
-    if "server started successfully" in line:
-        doWarmUp()
-        return
-    
-def stServerSendOnly(msg):
-    global stServerProc
-    msg = msg.rstrip()
-    stServerProc.stdin.write(bytes(msg + "\n", 'utf-8'));
-    stServerProc.stdin.flush();
-    debug(f'stServerSendOnly -> |{msg}|')
-    
-def stServerSendReceive(msg):
-    global stServerProc
-    msg = msg.rstrip()
-    stServerProc.stdin.write(bytes(msg + "\n", 'utf-8'));
-    stServerProc.stdin.flush();
-    debug(f'stServerSendReceive -> |{msg}|')
-    reply = stServerProc.stdout.readline().rstrip().decode("utf-8")
-    debug(f'stServerSendReceive <- |{reply}|')
-    return reply
-
-def doWarmUp():
-    global warmupWavPath, srcLanguage, tgtLanguage
-    srcLanguage = "en"
-    tgtLanguage = "es"
+
+class StWorker:
+    """
+    An ST server subprocess driven through non-blocking pipes. The requests are written
+    to its stdin as soon as they arrive and the replies, which the ST server writes in
+    the same order of the requests, are dispatched to the coroutines waiting for them.
+    """
+    def __init__(self, workerId):
+        self.workerId = workerId
+        self.proc = None
+        self.readerTask = None
+        self.pendingReplies = collections.deque()  # the futures of the requests waiting for a reply
+        self.numSessions = 0                       # the number of sessions assigned to the worker
+        self.alive = True                          # False once the ST server has terminated
+        self.drainLock = asyncio.Lock()
+
+    def queueDepth(self):
+        return len(self.pendingReplies)
+
+    def load(self):
+        return (self.numSessions, self.queueDepth())
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *stServerCmdList, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            limit=stServerReadLimit, env=dict(os.environ, FBK_ST_WORKER_ID=str(self.workerId)))
+        # wait stServer to start up
+        debug(f'waiting stServer {self.workerId} to start up ...')
+        line = (await self.proc.stdout.readline()).decode("utf-8")
+        self.readerTask = asyncio.ensure_future(self.readReplies())
+        if "server started successfully" in line:
+            await doWarmUp(self)
+
+    async def readReplies(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            reply = line.rstrip().decode("utf-8")
+            debug(f'stServer {self.workerId} <- |{reply}|')
+            if self.pendingReplies:
+                self.pendingReplies.popleft().set_result(reply)
+        # the ST server terminated: no more replies will come
+        self.alive = False
+        print(f'ERROR: stServer {self.workerId} terminated')
+        while self.pendingReplies:
+            self.pendingReplies.popleft().set_exception(StServerTerminatedError())
+
+    async def write(self, msg):
+        msg = msg.rstrip()
+        self.proc.stdin.write(bytes(msg + "\n", 'utf-8'))
+        # the messages are written in order, but they are flushed by one coroutine at a time
+        async with self.drainLock:
+            await self.proc.stdin.drain()
+
+    async def sendOnly(self, msg):
+        await self.write(msg)
+        debug(f'stServer {self.workerId} sendOnly -> |{msg.rstrip()}|')
+
+    async def sendReceive(self, msg):
+        if not self.alive:
+            raise StServerTerminatedError()
+        reply = asyncio.get_event_loop().create_future()
+        self.pendingReplies.append(reply)
+        await self.write(msg)
+        debug(f'stServer {self.workerId} sendReceive -> |{msg.rstrip()}| (queue depth {self.queueDepth()})')
+        return await reply
+
+
+async def stServerStart():
+    global stWorkers
+    stWorkers = [StWorker(i) for i in range(numWorkers)]
+    await asyncio.gather(*[worker.start() for worker in stWorkers])
+
+
+def stServerAssignWorker():
+    return assignLeastLoadedWorker(stWorkers)
+
+
+def stServerStatus():
+    return [
+        {"worker": w.workerId, "pid": w.proc.pid, "alive": w.alive, "sessions": w.numSessions,
+         "queue_depth": w.queueDepth()}
+        for w in stWorkers]
+
+
+class Session:
+    """The state of the session of a client connection."""
+    def __init__(self, sessionId, srcLanguage, tgtLanguage, worker):
+        self.sessionId = sessionId
+        self.srcLanguage = srcLanguage
+        self.tgtLanguage = tgtLanguage
+        self.worker = worker
+        self.released = False    # whether the session has been ended and released from its worker
+        # the buffer with the stored audio, which needs only the last window and step
+        self.audioBuffer = AudioRingBuffer((int((stWindowSecs + stStepSecs) * frameRate) + 1) * frameSize)
+        self.totAudioSecs = 0    # the current amount of stored audio
+        self.lastSentEndSec = -1
+        # the wav file to be processed by the ST
+        self.stWavPath = f'/tmp/FAs.{sessionId}.wav'
+        self.bilingualDictPath = f'/tmp/FAs.{sessionId}.dict.tsv'
+
+    def removeFiles(self):
+        if os.path.exists(self.stWavPath):    os.remove(self.stWavPath)
+        if os.path.exists(self.bilingualDictPath):    os.remove(self.bilingualDictPath)
+
+
+async def doWarmUp(worker):
+    global warmupWavPath
+    session = Session(f'{os.getpid()}.warmup{worker.workerId}', "en", "es", worker)
     # read WAV file and filter out the header:w
     wContent = b''
     with open(warmupWavPath, mode='rb') as fp:
@@ -97,12 +177,13 @@ def doWarmUp():
     audioSta = 0
     audioEnd = min(warmupSec * audioSizeOneSec, contentLen)
     audioChunk = wContent[audioSta:audioEnd]
-    debug(f'doWarmUp: before sending chunks {audioEnd}')
+    debug(f'doWarmUp: before sending chunks {audioEnd} to stServer {worker.workerId}')
     t1 = getTime()
     for i in range(3):
-        processAudioAndComposeClientMsg(audioChunk, useBilingualDict=False)
+        await processAudioAndComposeClientMsg(session, audioChunk, useBilingualDict=False)
     t2 = getTime()
-    debug(f'completed warm-up phase in {t2-t1} secs')
+    session.removeFiles()
+    debug(f'completed warm-up phase of stServer {worker.workerId} in {t2-t1} secs')
     return
 
 
@@ -119,56 +200,52 @@ def getNormalizedStringList(l, nesFlag=True):
     return s
             
 
-def checkAudioAndSendToProcess():
-    global totAudioSecs, stStepSecs, stWindowSecs, audioBuffer, lastSentEndSec
-    debug(f'checkAudioAndSendToProcess -> {totAudioSecs} {len(audioBuffer)}')
+async def checkAudioAndSendToProcess(session):
+    global stStepSecs, stWindowSecs
+    debug(f'checkAudioAndSendToProcess -> {session.sessionId} {session.totAudioSecs} {len(session.audioBuffer)}')
     # if not enough audio then do nothing
     #
-    if totAudioSecs < stStepSecs:
+    if session.totAudioSecs < stStepSecs:
         debug('checkAudioAndSendToProcess: 1 do-nothing')
-        lastSentEndSec = -1
+        session.lastSentEndSec = -1
         return None
     #
     # if audio < stWindowSecs, then
     #    send the first (stStepSecs * n) < stWindowSecs audio to be processed,
     #    and remove nothing
-    if totAudioSecs < stWindowSecs:
-        sec = int(totAudioSecs / stStepSecs) * stStepSecs
-        if sec <= lastSentEndSec:
+    if session.totAudioSecs < stWindowSecs:
+        sec = int(session.totAudioSecs / stStepSecs) * stStepSecs
+        if sec <= session.lastSentEndSec:
             debug('checkAudioAndSendToProcess: 2A do-nothing')
             return None
         dim = int(sec * (frameRate * frameSize))
-        lastSentEndSec = sec
-        debug(f'checkAudioAndSendToProcess: 2B sending {sec} ({dim} / {len(audioBuffer)})')
-        outMsg = processAudioAndComposeClientMsg(audioBuffer[0:dim])
+        session.lastSentEndSec = sec
+        debug(f'checkAudioAndSendToProcess: 2B sending {sec} ({dim} / {len(session.audioBuffer)})')
+        outMsg = await processAudioAndComposeClientMsg(session, session.audioBuffer[0:dim], streamOffset=0)
         return outMsg
     #
     # audio >= stWindowSecs, so send the last stWindowSecs audio
     #
-    endSec = int(totAudioSecs / stStepSecs) * stStepSecs
-    if endSec <= lastSentEndSec:
+    endSec = int(session.totAudioSecs / stStepSecs) * stStepSecs
+    if endSec <= session.lastSentEndSec:
         debug('checkAudioAndSendToProcess: 3A do-nothing')
         return None
-    lastSentEndSec = endSec
+    session.lastSentEndSec = endSec
     startSec       = endSec - stWindowSecs
     ## if startSec < 0:   startSec = 0
     startBuf = int(startSec * (frameRate * frameSize))
     dim      = int(stWindowSecs * (frameRate * frameSize))
     endBuf   = int(startBuf + dim)
-    debug(f'checkAudioAndSendToProcess: 3B sending [{startSec}, {endSec}] [{startBuf}, {endBuf}] ({dim} / {len(audioBuffer)})')
-    outMsg = processAudioAndComposeClientMsg(audioBuffer[startBuf:endBuf])
+    debug(f'checkAudioAndSendToProcess: 3B sending [{startSec}, {endSec}] [{startBuf}, {endBuf}] ({dim} / {len(session.audioBuffer)})')
+    streamOffset = int(startBuf / frameSize) if startBuf >= 0 else None
+    outMsg = await processAudioAndComposeClientMsg(session, session.audioBuffer[startBuf:endBuf], streamOffset=streamOffset)
     return outMsg
         
 
-# send audio to the stServer, wait reply, compose the msg to the
-#   client websocket and return it
-#
-def processAudioAndComposeClientMsg(audioData, useBilingualDict=True):
-    global stWavPath, srcLanguage, tgtLanguage, bilingualDictPath
-    global audioSaveFlag, lastSentEndSec
+def writeWav(wavPath, audioData):
     # compute audio byte size
     audioSize = len(audioData)
-    with open(stWavPath, mode='wb') as fp:
+    with open(wavPath, mode='wb') as fp:
         # write WAV header (78 bytes)
         header = b'RIFF' + (audioSize + 70).to_bytes(4, byteorder='little')
         header += b'WAVE'
@@ -182,18 +259,35 @@ def processAudioAndComposeClientMsg(audioData, useBilingualDict=True):
         fp.write(header)
         # write content
         fp.write(audioData)
+
+
+# send audio to the stServer, wait reply, compose the msg to the
+#   client websocket and return it
+#
+async def processAudioAndComposeClientMsg(session, audioData, useBilingualDict=True, streamOffset=None):
+    global audioSaveFlag, wavFileFlag
+    if wavFileFlag or audioSaveFlag:
+        writeWav(session.stWavPath, audioData)
     if audioSaveFlag:
-        backupWavFile = f'{stWavPath}__backup_{lastSentEndSec}.wav'
-        shutil.copyfile(stWavPath, backupWavFile)
+        backupWavFile = f'{session.stWavPath}__backup_{session.lastSentEndSec}.wav'
+        shutil.copyfile(session.stWavPath, backupWavFile)
+    if wavFileFlag:
+        audioField = '"wav_path": "%s"' % session.stWavPath
+    else:
+        # send the raw PCM in the request, avoiding the round trip through the disk
+        audioField = '"pcm": "%s", "sample_rate": %d' % (base64.b64encode(audioData).decode('ascii'), frameRate)
+    if streamOffset is not None:
+        # the ST server reuses the features of the audio shared with the previous window
+        audioField += ', "session_id": "%s", "stream_offset": %d' % (session.sessionId, streamOffset)
     if useBilingualDict:
-        msgToSt = '{"wav_path": "%s", "src_lang":  "%s", "tgt_lang":  "%s", "dictionary": "%s"}' % (stWavPath, srcLanguage, tgtLanguage, bilingualDictPath)
+        msgToSt = '{%s, "src_lang":  "%s", "tgt_lang":  "%s", "dictionary": "%s"}' % (audioField, session.srcLanguage, session.tgtLanguage, session.bilingualDictPath)
     else:
-        msgToSt = '{"wav_path": "%s", "src_lang":  "%s", "tgt_lang":  "%s"}' % (stWavPath, srcLanguage, tgtLanguage)
+        msgToSt = '{%s, "src_lang":  "%s", "tgt_lang":  "%s"}' % (audioField, session.srcLanguage, session.tgtLanguage)
     debug(f'msgToSt {msgToSt}')
     startT = getTime()
-    reply = stServerSendReceive(msgToSt)
+    reply = await session.worker.sendReceive(msgToSt)
     responseT = getTime() - startT
-    debug(f'  stServer responseT {responseT}')
+    debug(f'  stServer {session.worker.workerId} responseT {responseT}')
     debug(f'reply {reply}')
     d = json.loads(reply)
     # d["status"], d["score"], d["translation"], d["transcript"], d["nes"", d["terms"]
@@ -205,15 +299,14 @@ def processAudioAndComposeClientMsg(audioData, useBilingualDict=True):
     return outMsg
 
 
-def saveBilingualTerms(bilingualGloss):
-    global bilingualDictPath
+def saveBilingualTerms(session, bilingualGloss):
     try:
-        with open(bilingualDictPath, mode='w') as fp:
+        with open(session.bilingualDictPath, mode='w') as fp:
             for term in bilingualGloss:
                 srcText = term["src"]
                 tgtText = term["tgt"]
                 fp.write(f'{srcText}\t{tgtText}\n')
-    except Error as err:
+    except OSError as err:
         debug(f'ERROR: due to {err}')
         return False
     return True
@@ -227,96 +320,124 @@ class MissingStartDataError(Exception):
     """Raised when the input msg of type "start" does not include the expected data"""
     pass
 
+class MissingSessionError(Exception):
+    """Raised when the input msg requires a session that has not been started"""
+    pass
 
+# each connection has its own session, which is served by one of the ST workers,
+#   so that a slow inference on a worker does not stall the other connections
+#
 async def externalLoop(websocket, path):
-    global stWavPath, audioBuffer, totAudioSecs, srcLanguage, tgtLanguage
+    global sessionCounter
     print(f'started connection from {websocket.remote_address} {path}')
-    while True:
-        try:
-            debug(f'waiting msg from {websocket.remote_address}')
-            inMsg = await websocket.recv()
-            d = json.loads(inMsg)
-            debug(f'received inMsg (len {len(inMsg)}, type {type(inMsg)}) from {websocket.remote_address}')
-
-            if not "action" in d:
-                raise MissingActionError
-            action = d["action"]
-            #
-            outMsg = ""
-            if action == "shutdown":
-                debug(f'  shutdown | {inMsg}')
-                stServerSendOnly('{"command": "shutdown"}')
-                if os.path.exists(stWavPath):   os.remove(stWavPath)
-                if os.path.exists(bilingualDictPath):    os.remove(bilingualDictPath)
-                sys.exit(0);
-            #
-            elif action == "start":
-                debug(f'  start | {inMsg}')
-                if not "data" in d:
-                    raise MissingStartDataError
-                if not "src" in d["data"] or not "tgt" in d["data"] or not "bilingual_gloss" in d["data"]:
-                    raise MissingStartDataError
+    session = None
+    try:
+        while True:
+            try:
+                debug(f'waiting msg from {websocket.remote_address}')
+                inMsg = await websocket.recv()
+                d = json.loads(inMsg)
+                debug(f'received inMsg (len {len(inMsg)}, type {type(inMsg)}) from {websocket.remote_address}')
+
+                if not "action" in d:
+                    raise MissingActionError
+                action = d["action"]
                 #
-                srcLanguage    = d["data"]["src"]
-                tgtLanguage    = d["data"]["tgt"]
-                bilingualGloss = d["data"]["bilingual_gloss"]
-                saveBilingualTerms(bilingualGloss)
-                audioBuffer = b''
-                totAudioSecs = 0
-                outMsg = '{"type": "response", "status": 0, "info": ""}'
-                debug(f'outMsg {outMsg}')
-                await websocket.send(outMsg)
-            #
-            elif action == "chunk":
-                debug(f'  chunk | ')
-                b64Content = d["data"]["audio"]
-                audioChunk = base64.b64decode(b64Content)
-                audioSecs = len(audioChunk) / (frameRate * frameSize)
-                totAudioSecs += audioSecs
-                audioBuffer += audioChunk
-                debug(f'  audioBuffer {len(audioBuffer)}, audioChunk {type(audioChunk)} {len(audioChunk)}, b64Content {type(b64Content)} {len(b64Content)}, audioSecs {audioSecs}, totAudioSecs {totAudioSecs}')
+                outMsg = ""
+                if action == "shutdown":
+                    debug(f'  shutdown | {inMsg}')
+                    for worker in stWorkers:
+                        if worker.alive:
+                            await worker.sendOnly('{"command": "shutdown"}')
+                    if session is not None:
+                        session.removeFiles()
+                        session = None
+                    sys.exit(0);
                 #
-                outMsg = checkAudioAndSendToProcess()
-                if outMsg:
+                elif action == "start":
+                    debug(f'  start | {inMsg}')
+                    if not "data" in d:
+                        raise MissingStartDataError
+                    if not "src" in d["data"] or not "tgt" in d["data"] or not "bilingual_gloss" in d["data"]:
+                        raise MissingStartDataError
+                    #
+                    if session is not None:
+                        # a new start replaces the current session
+                        await endSession(session)
+                    sessionCounter += 1
+                    session = Session(
+                        f'{os.getpid()}.{sessionCounter}', d["data"]["src"], d["data"]["tgt"], stServerAssignWorker())
+                    debug(f'  session {session.sessionId} assigned to stServer {session.worker.workerId}, status {stServerStatus()}')
+                    bilingualGloss = d["data"]["bilingual_gloss"]
+                    saveBilingualTerms(session, bilingualGloss)
+                    outMsg = '{"type": "response", "status": 0, "info": ""}'
                     debug(f'outMsg {outMsg}')
                     await websocket.send(outMsg)
-            #
-            elif action == "end":
-                debug(f'  end | {inMsg}')
-                # if still audio then send it to ST to be processed
                 #
-                outMsg = checkAudioAndSendToProcess()
-                if outMsg:
+                elif action == "chunk":
+                    debug(f'  chunk | ')
+                    if session is None:
+                        raise MissingSessionError
+                    b64Content = d["data"]["audio"]
+                    audioChunk = base64.b64decode(b64Content)
+                    audioSecs = len(audioChunk) / (frameRate * frameSize)
+                    session.totAudioSecs += audioSecs
+                    session.audioBuffer.append(audioChunk)
+                    debug(f'  audioBuffer {len(session.audioBuffer)}, audioChunk {type(audioChunk)} {len(audioChunk)}, b64Content {type(b64Content)} {len(b64Content)}, audioSecs {audioSecs}, totAudioSecs {session.totAudioSecs}')
+                    #
+                    outMsg = await checkAudioAndSendToProcess(session)
+                    if outMsg:
+                        debug(f'outMsg {outMsg}')
+                        await websocket.send(outMsg)
+                #
+                elif action == "end":
+                    debug(f'  end | {inMsg}')
+                    if session is None:
+                        raise MissingSessionError
+                    # if still audio then send it to ST to be processed
+                    #
+                    outMsg = await checkAudioAndSendToProcess(session)
+                    if outMsg:
+                        debug(f'outMsg {outMsg}')
+                        await websocket.send(outMsg)
+                    await endSession(session)
+                    session = None
+                    outMsg = '{"type": "response", "status": 0, "info": ""}'
                     debug(f'outMsg {outMsg}')
                     await websocket.send(outMsg)
-                audioBuffer = b''
-                totAudioSecs = 0
-                lastSentEndSec = -1
-                if os.path.exists(stWavPath):    os.remove(stWavPath)
-                if os.path.exists(bilingualDictPath):    os.remove(bilingualDictPath)
-                outMsg = '{"type": "response", "status": 0, "info": ""}'
-                debug(f'outMsg {outMsg}')
-                await websocket.send(outMsg)
-            #
-            else:
-                # unknown action
-                info = f'unknown action {action}'
-                outMsg = '{"type": "response", "status": 1, "info": "unknown action %s"}' % action
-                debug(f'outMsg {outMsg}')
-                await websocket.send(outMsg)
+                #
+                elif action == "status":
+                    debug(f'  status | {inMsg}')
+                    outMsg = '{"type": "response", "status": 0, "info": {"workers": %s}}' % json.dumps(stServerStatus())
+                    debug(f'outMsg {outMsg}')
+                    await websocket.send(outMsg)
+                #
+                else:
+                    # unknown action
+                    info = f'unknown action {action}'
+                    outMsg = '{"type": "response", "status": 1, "info": "unknown action %s"}' % action
+                    debug(f'outMsg {outMsg}')
+                    await websocket.send(outMsg)
+
+            except json.decoder.JSONDecodeError as err:
+                debug(f'ERROR: not json format from {websocket.remote_address}')
 
-        except json.decoder.JSONDecodeError as err:
-            debug(f'ERROR: not json format from {websocket.remote_address}')
+            except MissingActionError as err:
+                debug(f'ERROR: missing-action from {websocket.remote_address}')
 
-        except MissingActionError as err:
-            debug(f'ERROR: missing-action from {websocket.remote_address}')
+            except MissingStartDataError as err:
+                debug(f'ERROR: missing-start-data from {websocket.remote_address}')
 
-        except MissingStartDataError as err:
-            debug(f'ERROR: missing-start-data from {websocket.remote_address}')
+            except MissingSessionError as err:
+                debug(f'ERROR: missing-session from {websocket.remote_address}')
 
-        except websockets.WebSocketException as err:
-            print(f'end connection from {websocket.remote_address} due to {err}')
-            break
+            except websockets.WebSocketException as err:
+                print(f'end connection from {websocket.remote_address} due to {err}')
+                break
+    finally:
+        # release the session of a client that disconnected without ending it
+        if session is not None:
+            await endSession(session)
     return
 
 
@@ -333,18 +454,17 @@ frameSize = 2      # the size (in bytes) of each audio frame
 stStepSecs   = 1.5
 # the default size (in seconds) of the audio window to be processed by the ST
 stWindowSecs = 10
-# the wav file to be processed by the ST
-stWavPath    = f'/tmp/FAs.{os.getpid()}.wav'  
+# the default number of ST server processes
+numWorkers   = 1
+# the max size (in bytes) of a line read from the ST servers
+stServerReadLimit = 2 ** 24
 
-audioBuffer  = b'' # the buffer with the stored audio
-totAudioSecs = 0   # the current amount of stored audio
+stWorkers = []      # the ST server processes
 debugFlag = False
-lastSentEndSec = -1
+sessionCounter = 0  # the number of sessions started so far, used to compose the session IDs
 
-srcLanguage = ""
-tgtLanguage = ""
-bilingualDictPath  = f'/tmp/FAs.{os.getpid()}.dict.tsv'  
 audioSaveFlag = False
+wavFileFlag = False
 warmupWavPath = './warmupFile.wav'
 
 
@@ -354,6 +474,8 @@ parser.add_argument("-d", "--debug", action="store_true", help="enable debug")
 parser.add_argument("-s", "--stepsize", type=float, help=f"the size (in seconds) of the atomic audio unit (default {stStepSecs})")
 parser.add_argument("-w", "--windowsize", type=float, help=f"the size (in seconds) of the audio window to be processed (default {stWindowSecs})")
 parser.add_argument("-a", "--saveaudio", action="store_true", help="enable audio saving")
+parser.add_argument("-n", "--workers", type=int, help=f"the number of ST server processes serving the sessions (default {numWorkers})")
+parser.add_argument("-f", "--wavfile", action="store_true", help="send the audio to the ST server through a WAV file instead of in-memory PCM")
 
 #
 # positional (mandatory) args
@@ -371,7 +493,10 @@ if args.stepsize:
     stStepSecs   = args.stepsize
 if args.windowsize:
     stWindowSecs = args.windowsize
+if args.workers:
+    numWorkers   = args.workers
 audioSaveFlag = args.saveaudio
+wavFileFlag = args.wavfile
 
 stServerCmdList = stServerInfo.split('|')
 if not os.path.isfile(stServerCmdList[0]):
@@ -385,9 +510,9 @@ if not os.path.isfile(warmupWavPath):
 
 print('initialization phase: please wait...')
 
-stServerStart()
+asyncio.get_event_loop().run_until_complete(stServerStart())
 
-print(f'  ok stServer with pid {stServerProc.pid}; stStepSecs {stStepSecs}, stWindowSecs {stWindowSecs}')
+print(f'  ok {numWorkers} stServer with pids {[w.proc.pid for w in stWorkers]}; stStepSecs {stStepSecs}, stWindowSecs {stWindowSecs}')
 
     
 cPath = os.environ.get('CREDENTIAL_HOME')
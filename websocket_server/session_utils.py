@@ -0,0 +1,94 @@
+# Copyright (c) 2023 FBK.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+class StServerTerminatedError(Exception):
+    """Raised when the ST server terminates before replying to a request"""
+    pass
+
+
+def assignLeastLoadedWorker(workers):
+    """
+    Assigns a new session to the least-loaded of the *workers* that are still alive, i.e. the
+    one with fewer sessions and, then, fewer queued requests (as returned by their *load()* method).
+    In case of a tie, the first worker is chosen.
+    """
+    aliveWorkers = [w for w in workers if w.alive]
+    if not aliveWorkers:
+        raise StServerTerminatedError("all the ST servers terminated")
+    worker = min(aliveWorkers, key=lambda w: w.load())
+    worker.numSessions += 1
+    return worker
+
+
+async def endSession(session):
+    """
+    Ends the *session* on the ST server of its worker and releases it. The session is released
+    even if the ST server fails to end it, and only once, so ending it again does nothing.
+    """
+    if session.released:
+        return
+    session.released = True
+    try:
+        await session.worker.sendReceive('{"command": "end_session", "session_id": "%s"}' % session.sessionId)
+    finally:
+        session.worker.numSessions -= 1
+        session.removeFiles()
+
+
+class AudioRingBuffer:
+    """
+    The audio of a session, of which only the last *capacity* bytes are kept.
+    The bytes are addressed with their position in the whole stream (so that the
+    slicing is the same of a buffer with all the audio) and are stored contiguously in a
+    preallocated bytearray of twice the capacity: when it is full, the most recent
+    bytes are moved back to its beginning. Hence, the slices are zero-copy memoryviews
+    and each byte is copied at most once by the compaction.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = bytearray(2 * capacity)
+        self.view = memoryview(self.data)
+        self.used = 0       # the number of bytes stored in data
+        self.totSize = 0    # the number of bytes received since the start of the session
+
+    def __len__(self):
+        return self.totSize
+
+    def firstPosition(self):
+        # the position in the stream of the oldest byte kept
+        return self.totSize - self.used
+
+    def append(self, chunk):
+        chunk = memoryview(chunk)
+        self.totSize += len(chunk)
+        if len(chunk) > self.capacity:
+            chunk = chunk[len(chunk) - self.capacity:]
+        if self.used + len(chunk) > len(self.data):
+            keep = min(self.used, self.capacity - len(chunk))
+            self.view[0:keep] = self.view[self.used - keep:self.used]
+            self.used = keep
+        self.view[self.used:self.used + len(chunk)] = chunk
+        self.used += len(chunk)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError("only contiguous slices of the audio are supported")
+        # the positions before the start of the stream are clipped to it
+        start = max(key.start or 0, 0)
+        stop = self.totSize if key.stop is None else min(key.stop, self.totSize)
+        if start < self.firstPosition():
+            raise IndexError(f'audio position {start} is no longer in the buffer')
+        offset = self.firstPosition()
+        return self.view[start - offset:max(start, stop) - offset]